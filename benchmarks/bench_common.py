@@ -0,0 +1,99 @@
+"""
+Common utilities for recording benchmark results across versions.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+def get_revision():
+    "Get the git revision of the working tree, or an empty string"
+    import subprocess
+
+    try:
+        rev = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                      cwd=REPO_DIR,
+                                      stderr=subprocess.PIPE)
+        return rev.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_results(fname, name):
+    "Load previously recorded results of the named benchmark"
+    import json
+
+    records = []
+    if os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('benchmark') == name:
+                    records.append(record)
+
+    return records
+
+
+def record_results(fname, name, results):
+    """
+    Append the results of the named benchmark to fname in NDJSON format,
+    together with the git revision and Python version, and print them
+    side by side with the previous record of the same benchmark.
+    """
+    import json
+    import time
+    import platform
+
+    previous = load_results(fname, name)
+    previous = previous[-1]['results'] if previous else {}
+
+    record = {'benchmark': name,
+              'revision': get_revision(),
+              'python': platform.python_version(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+
+    with open(fname, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    for key in sorted(results):
+        value = results[key]
+        if key in previous and isinstance(value, (int, float)) and \
+                previous[key]:
+            print('%-40s %12.4g  (%+.1f%%)' %
+                  (key, value, 100.0 * (value - previous[key]) / previous[key]))
+        elif isinstance(value, (int, float)):
+            print('%-40s %12.4g' % (key, value))
+        else:
+            print('%-40s %12s' % (key, value))
+
+
+def get_parser(description):
+    "Create a parser for the command-line arguments common to all benchmarks"
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-n', '--repeat',
+                        help='Number of repetitions. The default is 5.',
+                        type=int,
+                        default=5)
+
+    parser.add_argument('-o', '--output',
+                        help='NDJSON file to append the results to. ' +
+                        'The default is benchmarks/results.jsonl.',
+                        default=BENCH_DIR + '/results.jsonl')
+
+    return parser
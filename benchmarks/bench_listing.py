@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the scalability of listing files with list_files and gd-ls.
+
+The listing runs against a fake Drive object serving synthetic trees from
+memory, so the measurements cover only the client: a wide folder, deeply
+nested folders, files linked into many folders, which are listed as
+aliases, and queries with many name patterns. For each tree, the wall
+time, the number of API calls and the peak memory of the listing are
+recorded, as well as the time of each sort mode and of printing.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+
+from bench_common import get_parser, record_results
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Number of results per page of a files.list call of Drive v2, which is
+# not set by list_files
+PAGE_SIZE = 100
+
+# Metadata listed by gd-ls unless -q is given
+METADATA = ('modifiedDate', 'editable', 'fileExtension')
+
+
+class FakeList(object):
+    "The result of FakeDrive.ListFile"
+
+    def __init__(self, drive, param):
+        self.drive = drive
+        self.param = param
+
+    def GetList(self):
+        return self.drive.query(self.param['q'])
+
+
+class FakeDrive(object):
+    """
+    A fake GoogleDrive object serving the queries of list_files from a
+    synthetic tree. The calls and the pages of results are counted.
+    """
+
+    QUERY = re.compile(r"'([^']*)' in parents and trashed=false"
+                       r"(?: and title ?(=|contains) ?'([^']*)')?$")
+
+    def __init__(self):
+        self.children = {'root': []}
+        self.count = 0
+        self.calls = 0
+        self.pages = 0
+
+    def add(self, parent_id, title, folder=False, id=None):
+        "Add a file or folder into a folder, and return its ID"
+
+        if id is None:
+            self.count += 1
+            id = 'id%08d' % self.count
+
+        file1 = {'id': id, 'title': title, 'editable': True,
+                 'modifiedDate': '2018-%02d-%02dT12:00:00.000Z' %
+                 (self.count % 12 + 1, self.count % 28 + 1)}
+        if folder:
+            file1['mimeType'] = FOLDER_MIME
+            self.children.setdefault(id, [])
+        else:
+            file1['mimeType'] = 'application/octet-stream'
+            file1['fileSize'] = str(self.count * 7919 % 1000003)
+            file1['fileExtension'] = title.rsplit('.', 1)[-1] \
+                if '.' in title else ''
+
+        self.children[parent_id].append(file1)
+
+        return id
+
+    def query(self, q):
+        parent_id, op, title = self.QUERY.match(q).groups()
+
+        files = self.children.get(parent_id, [])
+        if op == '=':
+            files = [file1 for file1 in files if file1['title'] == title]
+        elif op == 'contains':
+            files = [file1 for file1 in files if title in file1['title']]
+
+        self.calls += 1
+        self.pages += max(1, (len(files) + PAGE_SIZE - 1) // PAGE_SIZE)
+
+        # Copy the resources like they are decoded from the responses
+        return [dict(file1) for file1 in files]
+
+    def ListFile(self, param):
+        return FakeList(self, param)
+
+
+def make_wide(nfiles):
+    "A folder with nfiles files"
+
+    drive = FakeDrive()
+    for i in range(nfiles):
+        drive.add('root', 'data_%06d.%s' % (i, ['h5', 'txt', 'csv'][i % 3]))
+
+    return drive, {'recursive': False}
+
+
+def make_deep(depth, nfiles=10):
+    "A chain of depth nested folders with nfiles files each"
+
+    drive = FakeDrive()
+    parent_id = 'root'
+    for level in range(depth):
+        for i in range(nfiles):
+            drive.add(parent_id, 'file_%02d.dat' % i)
+        parent_id = drive.add(parent_id, 'level_%04d' % level, folder=True)
+
+    return drive, {'recursive': True}
+
+
+def make_aliases(nfolders, nfiles):
+    "nfolders folders that all contain the same nfiles files"
+
+    drive = FakeDrive()
+    folders = [drive.add('root', 'copy_%04d' % i, folder=True)
+               for i in range(nfolders)]
+    for i in range(nfiles):
+        id = drive.add(folders[0], 'shared_%05d.bin' % i)
+        for folder_id in folders[1:]:
+            drive.add(folder_id, 'shared_%05d.bin' % i, id=id)
+
+    return drive, {'recursive': True}
+
+
+def make_patterns(nfolders, nfiles):
+    """
+    nfolders folders with nfiles files each, queried with exact names,
+    prefixes, globs and patterns spanning two levels
+    """
+
+    drive = FakeDrive()
+    for i in range(nfolders):
+        folder_id = drive.add('root', 'run_%03d' % i, folder=True)
+        for j in range(nfiles):
+            drive.add(folder_id, 'frame_%05d.%s' % (j, ['h5', 'json'][j % 2]))
+
+    patterns = ['run_%03d/frame_%05d.h5' % (i, i) for i in range(0, nfolders, 4)]
+    patterns += ['run_01*/frame_0000*', 'run_*/*.json', '*/frame_[0-4]*.h5']
+
+    return drive, {'recursive': False, 'patterns': patterns}
+
+
+def get_sort_args(mode):
+    "Get the arguments of gd-ls for a sort mode"
+    import argparse
+
+    args = argparse.Namespace(sort_by_name=False, sort_by_size=False,
+                              sort_by_time=False, sort_by_extension=False)
+    setattr(args, 'sort_by_' + mode, True)
+
+    return args
+
+
+def measure_memory(func):
+    "Get the peak memory in MB allocated by func, or 0 if not supported"
+
+    try:
+        import tracemalloc
+    except ImportError:
+        return 0
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1048576.0
+    finally:
+        tracemalloc.stop()
+
+
+def bench_tree(name, drive, options, repeat, results):
+    "Measure listing, sorting and printing a tree"
+    import argparse
+    from gd_list import list_files, sort_files, print_file
+
+    def list_tree():
+        return list_files(drive, parent_id='root', metadata=METADATA,
+                          **options)
+
+    best = float('inf')
+    for i in range(repeat):
+        drive.calls = drive.pages = 0
+        start = time.time()
+        ls = list_tree()
+        best = min(best, time.time() - start)
+
+    results[name + '_entries'] = len(ls)
+    results[name + '_aliases'] = len([value for value in ls.values()
+                                      if value['alias']])
+    results[name + '_list_s'] = best
+    results[name + '_api_calls'] = drive.calls
+    results[name + '_pages'] = drive.pages
+    results[name + '_list_peak_mb'] = measure_memory(list_tree)
+
+    for mode in ['name', 'size', 'time', 'extension']:
+        args = get_sort_args(mode)
+        best = float('inf')
+        for i in range(repeat):
+            start = time.time()
+            files = sort_files(ls, args)
+            best = min(best, time.time() - start)
+        results['%s_sort_%s_s' % (name, mode)] = best
+
+    args = argparse.Namespace(long=True, use_color=False)
+    stdout = sys.stdout
+    best = float('inf')
+    with open(os.devnull, 'w') as devnull:
+        try:
+            sys.stdout = devnull
+            for i in range(repeat):
+                start = time.time()
+                for value in files:
+                    print_file(value, args)
+                best = min(best, time.time() - start)
+        finally:
+            sys.stdout = stdout
+    results[name + '_print_s'] = best
+
+
+if __name__ == "__main__":
+    parser = get_parser(__doc__)
+
+    parser.add_argument('-s', '--scale',
+                        help='Scale the sizes of the trees, e.g. 0.1 for ' +
+                        'a quick run. The default is 1, with 100k files ' +
+                        'in the wide folder.',
+                        type=float,
+                        default=1.0)
+
+    parser.add_argument('trees', metavar='TREE',
+                        nargs='*',
+                        help='Trees to benchmark among wide, deep, aliases ' +
+                        'and patterns. The default is all of them.')
+
+    args = parser.parse_args()
+
+    def scaled(n):
+        return max(1, int(n * args.scale))
+
+    makers = [('wide', lambda: make_wide(scaled(100000))),
+              ('deep', lambda: make_deep(min(scaled(200), 400))),
+              ('aliases', lambda: make_aliases(scaled(50), scaled(1000))),
+              ('patterns', lambda: make_patterns(scaled(40), scaled(1000)))]
+
+    results = {'scale': args.scale}
+    for name, make in makers:
+        if args.trees and name not in args.trees:
+            continue
+
+        drive, options = make()
+        sys.stderr.write('Benchmarking %s ...\n' % name)
+        bench_tree(name, drive, options, args.repeat, results)
+
+    record_results(args.output, 'listing', results)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the cold-start latency of the command-line tools.
+
+Each measurement runs a fresh interpreter, so it includes the cost of
+importing the modules. Building the Drive service is measured with and
+without the cached discovery document.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+
+from bench_common import REPO_DIR, get_parser, record_results
+
+
+def time_command(cmd, repeat):
+    "Return the minimum wall time of running cmd in a fresh interpreter"
+
+    best = float('inf')
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.call(cmd, cwd=REPO_DIR, stdout=devnull, stderr=devnull)
+            best = min(best, time.time() - start)
+
+    return best
+
+
+def time_build_service(repeat, cached):
+    "Return the minimum time of building the Drive service in-process"
+    from httplib2 import Http
+    from googleapiclient.discovery import build, build_from_document
+    from gd_auth import DISCOVERY_URL
+
+    if cached:
+        resp, doc = Http().request(DISCOVERY_URL)
+        doc = doc.decode('utf-8')
+
+    best = float('inf')
+    for i in range(repeat):
+        start = time.time()
+        if cached:
+            build_from_document(doc, http=Http())
+        else:
+            build('drive', 'v2', http=Http(), cache_discovery=False)
+        best = min(best, time.time() - start)
+
+    return best
+
+
+if __name__ == "__main__":
+    parser = get_parser(__doc__)
+    args = parser.parse_args()
+
+    python = sys.executable
+    results = {}
+
+    results['interpreter'] = time_command([python, '-c', 'pass'], args.repeat)
+    for module in ['gd_auth', 'gd_list', 'gd_get', 'gd_get_pub']:
+        results['import_' + module] = time_command(
+            [python, '-c', 'import ' + module], args.repeat)
+    results['import_pydrive'] = time_command(
+        [python, '-c', 'import pydrive.drive'], args.repeat)
+    for script in ['gd_list.py', 'gd_get.py', 'gd_get_pub.py']:
+        results['help_' + script] = time_command(
+            [python, script, '-h'], args.repeat)
+
+    for cached in [False, True]:
+        try:
+            results['build_service_' + ('cached' if cached else 'fetched')] = \
+                time_build_service(args.repeat, cached)
+        except Exception as e:
+            sys.stderr.write('Could not build the Drive service: %s\n' % e)
+
+    record_results(args.output, 'startup', results)
@@ -5,12 +5,199 @@ Authenticate for Google Drive access.
 """
 
 import sys
+import threading
+from contextlib import contextmanager
 
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/drive/v2/rest'
+DISCOVERY_TTL = 7 * 86400
 
-def authenticate(conf_dir, cmdline=False, verbose=False):
+# Refresh the access token if it expires within this many seconds
+REFRESH_MARGIN = 300
+
+
+@contextmanager
+def lock_credential(credfile, exclusive=True):
+    """
+    Hold an advisory lock on credfile, shared by all processes using it.
+    A shared lock is sufficient for reading the credential, and an
+    exclusive lock is required for refreshing or writing it.
+    """
+
+    f = open(credfile + '.lock', 'a+')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(f.fileno(),
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except ImportError:
+            # Windows does not support shared locks
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        yield
+    finally:
+        # Closing the file releases the lock
+        f.close()
+
+
+def expires_soon(credentials, margin=REFRESH_MARGIN):
+    "Check whether the access token expires within margin seconds"
+    import datetime
+
+    if credentials.access_token_expired:
+        return True
+    elif credentials.token_expiry is None:
+        return False
+
+    return credentials.token_expiry - datetime.datetime.utcnow() < \
+        datetime.timedelta(seconds=margin)
+
+
+def write_credential(credentials, credfile):
+    """
+    Write the credentials into a temporary file and rename it to credfile,
+    so that other processes never read a partially written credential.
+    The caller must hold the exclusive lock of credfile.
+    """
+    import os
+
+    tmpfile = credfile + '.tmp'
+    fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(credentials.to_json())
+    getattr(os, 'replace', os.rename)(tmpfile, credfile)
+
+
+class CredentialStorage(object):
+    """
+    The storage of credentials in credfile, with the interface of
+    oauth2client.client.Storage. oauth2client refreshes the access token of
+    credentials with a store while holding its lock, so this holds the
+    exclusive lock of credfile as well, reads a token refreshed by another
+    process, and writes the refreshed credential atomically.
+    """
+
+    def __init__(self, credfile):
+        self.credfile = credfile
+        self.lock = threading.Lock()
+        self.flock = None
+
+    def acquire_lock(self):
+        self.lock.acquire()
+        try:
+            self.flock = lock_credential(self.credfile)
+            self.flock.__enter__()
+        except BaseException:
+            self.flock = None
+            self.lock.release()
+            raise
+
+    def release_lock(self):
+        try:
+            self.flock.__exit__(None, None, None)
+        finally:
+            self.flock = None
+            self.lock.release()
+
+    def locked_get(self):
+        from oauth2client.file import Storage
+
+        credentials = Storage(self.credfile).locked_get()
+        if credentials is not None:
+            credentials.set_store(self)
+
+        return credentials
+
+    def locked_put(self, credentials):
+        write_credential(credentials, self.credfile)
+
+    def get(self):
+        self.acquire_lock()
+        try:
+            return self.locked_get()
+        finally:
+            self.release_lock()
+
+    def put(self, credentials):
+        self.acquire_lock()
+        try:
+            self.locked_put(credentials)
+        finally:
+            self.release_lock()
+
+
+def save_credential(gauth, credfile):
+    """
+    Save the credential of gauth atomically into credfile, which then
+    stores the access tokens refreshed by oauth2client during the run.
+    The caller must hold the exclusive lock of credfile.
+    """
+
+    write_credential(gauth.credentials, credfile)
+    gauth.credentials.set_store(CredentialStorage(credfile))
+
+
+def authorize(gauth):
+    """
+    Authorize the HTTP object of gauth and build the Drive service.
+
+    Unlike GoogleAuth.Authorize, this builds the service from a locally
+    cached discovery document when available instead of fetching it.
+    """
+
+    from httplib2 import Http
+    from googleapiclient.discovery import build, build_from_document
+
+    try:
+        from gd_cache import load_cached, save_cached
+    except ImportError:
+        # gd_auth.py may be used as a standalone script
+        load_cached = save_cached = None
+
+    if gauth.http is None:
+        gauth.http = Http()
+    gauth.http = gauth.credentials.authorize(gauth.http)
+
+    doc = None
+    if load_cached:
+        doc = load_cached('discovery-drive-v2', DISCOVERY_TTL)
+        if doc is None:
+            try:
+                resp, content = Http().request(DISCOVERY_URL)
+                if resp.status == 200:
+                    doc = content.decode('utf-8')
+                    save_cached('discovery-drive-v2', doc)
+            except Exception:
+                doc = None
+
+    if doc:
+        gauth.service = build_from_document(doc, http=gauth.http)
+    else:
+        gauth.service = build('drive', 'v2', http=gauth.http)
+
+
+def get_config_dir(conf_dir=''):
+    """
+    Get the configuration directory containing the credential, which is
+    ~/.config/gdutil/ unless conf_dir is given. The default directory is
+    created if it does not exist.
+    """
+    import os
+
+    if not conf_dir:
+        conf_dir = os.path.expanduser('~') + '/.config/gdutil'
+        if not os.path.exists(conf_dir):
+            os.makedirs(conf_dir, 0o700)
+
+    return conf_dir
+
+
+def authenticate(conf_dir, cmdline=False, verbose=False, credfile=''):
     """"
     Authenticate using web browser and save the credential into specified
     directory. If directory is not specified, the default is ~/.config/gdutil/.
+    If credfile is specified, it is used instead of mycred.txt.
     """
 
     from pydrive.auth import GoogleAuth
@@ -18,20 +205,26 @@ def authenticate(conf_dir, cmdline=False, verbose=False):
     import os.path
     from httplib2 import Http
 
-    # Authenticate Google account and initialize caching
+    try:
+        from gd_cache import get_http_cache
+    except ImportError:
+        # gd_auth.py may be used as a standalone script
+        get_http_cache = None
+
+    # Authenticate Google account and initialize caching of metadata
     gauth = GoogleAuth()
-    gauth.http = Http(cache=os.path.expanduser('~') + '/.cache/gdutil')
+    gauth.http = Http(cache=get_http_cache() if get_http_cache else None)
 
     if not conf_dir:
-        conf_dir = os.path.expanduser('~') + '/.config/gdutil'
-        if not os.path.exists(conf_dir):
-            os.makedirs(conf_dir, 0o700)
+        conf_dir = get_config_dir()
 
-        if os.path.exists("./mycred.txt"):
+        if credfile:
+            pass
+        elif os.path.exists("./mycred.txt"):
             credfile = './mycred.txt'
         else:
             credfile = conf_dir + '/mycred.txt'
-    else:
+    elif not credfile:
         credfile = conf_dir + '/mycred.txt'
 
     clientfile = conf_dir + '/' + 'client_secrets.json'
@@ -54,24 +247,39 @@ def authenticate(conf_dir, cmdline=False, verbose=False):
     try:
         # Try to load saved client credentials
         if os.path.exists(credfile):
-            gauth.LoadCredentialsFile(credfile)
+            with lock_credential(credfile, exclusive=False):
+                gauth.LoadCredentialsFile(credfile)
 
         if gauth.credentials is None:
             raise Exception('Empty credential')
-        elif gauth.access_token_expired:
-            # Refresh them if expired
-            gauth.Refresh()
-            # Save the current credentials to a file
-            gauth.SaveCredentialsFile(credfile)
-
-            if verbose:
-                print('Refreshed the credential.')
+        elif expires_soon(gauth.credentials):
+            # Refresh them if expired or about to expire. Only the process
+            # holding the exclusive lock refreshes; the others wait and
+            # then load the credential it saved.
+            with lock_credential(credfile):
+                gauth.LoadCredentialsFile(credfile)
+
+                if expires_soon(gauth.credentials):
+                    gauth.Refresh()
+                    # Save the current credentials to a file
+                    save_credential(gauth, credfile)
+
+                    if verbose:
+                        print('Refreshed the credential.')
+                elif verbose:
+                    print('Credential ' + credfile +
+                          ' was refreshed by another process.')
+
+            authorize(gauth)
         else:
             # Initialize the saved creds
-            gauth.Authorize()
+            authorize(gauth)
             if verbose:
                 print('Credential ' + credfile + ' is up to date.')
 
+        # Coordinate the refreshes during the run with other processes
+        gauth.credentials.set_store(CredentialStorage(credfile))
+
     except:
         if verbose:
             print('*** You need to authenticate using your Google account.')
@@ -92,7 +300,8 @@ def authenticate(conf_dir, cmdline=False, verbose=False):
                 gauth.LocalWebserverAuth()
 
             # Save the current credentials to a file
-            gauth.SaveCredentialsFile(credfile)
+            with lock_credential(credfile):
+                save_credential(gauth, credfile)
 
             if verbose:
                 print('Credential saved to ' + credfile)
@@ -0,0 +1,230 @@
+"""
+Local cache for results that are expensive to obtain, such as the
+discovery document of the Drive API and the network profile of the host.
+"""
+
+import os
+
+
+def get_cache_dir(subdir=''):
+    "Get the cache directory and create it if needed"
+
+    cache_dir = os.getenv('GDUTIL_CACHE_DIR',
+                          os.path.expanduser('~') + '/.cache/gdutil')
+    if subdir:
+        cache_dir = cache_dir + '/' + subdir
+
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir, 0o700)
+        except OSError:
+            pass
+
+    return cache_dir
+
+
+def load_cached(key, ttl):
+    """
+    Load the value stored under key if it is not older than ttl seconds.
+    Returns None if the value is missing, expired or unreadable.
+    """
+    import json
+    import time
+
+    fname = get_cache_dir() + '/' + key + '.json'
+    try:
+        if time.time() - os.path.getmtime(fname) > ttl:
+            return None
+        with open(fname) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def save_cached(key, value):
+    "Save a JSON-serializable value under key"
+    import json
+    import tempfile
+
+    cache_dir = get_cache_dir()
+    try:
+        # Write into a temporary file and rename it, so that concurrent
+        # processes never see a partially written value
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir, prefix='.' + key)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        getattr(os, 'replace', os.rename)(tmpname,
+                                          cache_dir + '/' + key + '.json')
+    except (OSError, IOError):
+        pass
+
+
+# Default limits of the HTTP cache. The size in megabytes can be overridden
+# by the environment variable GDUTIL_HTTP_CACHE, where 0 disables the cache.
+HTTP_CACHE_SIZE = 16
+HTTP_CACHE_AGE = 7 * 86400
+HTTP_CACHE_ENTRY = 1048576
+
+
+class MetadataCache(object):
+    """
+    A bounded cache for httplib2 that stores only listing and metadata
+    responses of the Drive API, which carry an ETag so that httplib2 can
+    revalidate them. Content bodies are never stored. Entries older than
+    max_age seconds are discarded, and the oldest entries are evicted when
+    the total size exceeds max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size=HTTP_CACHE_SIZE * 1048576,
+                 max_age=HTTP_CACHE_AGE, max_entry=HTTP_CACHE_ENTRY):
+        from httplib2 import safename
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_entry = max_entry
+        self.safe = safename
+        self.size = None
+
+    @staticmethod
+    def is_metadata(key):
+        "Check whether key is the URI of a listing or metadata request"
+
+        return '/drive/v2/' in key and 'alt=media' not in key
+
+    def get(self, key):
+        import time
+
+        if not self.is_metadata(key):
+            return None
+
+        fname = os.path.join(self.cache_dir, self.safe(key))
+        try:
+            if time.time() - os.path.getmtime(fname) > self.max_age:
+                self.delete(key)
+                return None
+            with open(fname, 'rb') as f:
+                return f.read()
+        except (OSError, IOError):
+            return None
+
+    def set(self, key, value):
+        import tempfile
+
+        if not self.is_metadata(key) or len(value) > self.max_entry:
+            return
+
+        # Store only JSON responses that can be revalidated
+        header = value[:value.find(b'\r\n\r\n')].lower()
+        if b'etag:' not in header or b'application/json' not in header:
+            return
+
+        if self.size is None:
+            self.evict()
+
+        fname = os.path.join(self.cache_dir, self.safe(key))
+        try:
+            # A revalidated response overwrites the entry of the same key
+            old_size = os.path.getsize(fname)
+        except OSError:
+            old_size = 0
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            getattr(os, 'replace', os.rename)(tmpname, fname)
+        except (OSError, IOError):
+            return
+
+        self.size += len(value) - old_size
+        if self.size > self.max_size:
+            self.evict()
+
+    def delete(self, key):
+        fname = os.path.join(self.cache_dir, self.safe(key))
+        try:
+            size = os.path.getsize(fname)
+            os.remove(fname)
+        except OSError:
+            return
+
+        if self.size is not None:
+            self.size -= size
+
+    def evict(self):
+        "Remove expired entries and the oldest entries beyond max_size"
+        import time
+
+        entries = []
+        now = time.time()
+        for fname in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if now - st.st_mtime > self.max_age:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        # Evict down to 3/4 of the limit to avoid evicting on every set
+        entries.sort()
+        self.size = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+
+def prune_legacy_cache():
+    """
+    Remove the responses that earlier versions stored with the unbounded
+    FileCache of httplib2 directly in the cache directory. This is done
+    once, which is recorded by a marker file.
+    """
+    import re
+
+    cache_dir = get_cache_dir()
+    marker = cache_dir + '/.legacy-pruned'
+    if os.path.exists(marker):
+        return
+
+    # The FileCache names its files by the URI followed by its MD5 digest
+    legacy = re.compile(r'[^.].*,[0-9a-f]{32}$')
+    try:
+        for fname in os.listdir(cache_dir):
+            path = cache_dir + '/' + fname
+            if legacy.match(fname) and os.path.isfile(path):
+                os.remove(path)
+        open(marker, 'w').close()
+    except (OSError, IOError):
+        pass
+
+
+def get_http_cache():
+    """
+    Get the HTTP cache for httplib2, or None if it is disabled by setting
+    the environment variable GDUTIL_HTTP_CACHE to 0.
+    """
+
+    prune_legacy_cache()
+
+    try:
+        max_size = int(float(os.getenv('GDUTIL_HTTP_CACHE', HTTP_CACHE_SIZE)) *
+                       1048576)
+    except ValueError:
+        max_size = HTTP_CACHE_SIZE * 1048576
+
+    if max_size <= 0:
+        return None
+
+    return MetadataCache(get_cache_dir('http'), max_size)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""
+Copy files and folders within Google Drive without downloading them.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+from gd_auth import authenticate
+from gd_list import list_files
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-p', '--parent',
+                        help='ID of parent folder of the source files in ' +
+                        'Google Drive',
+                        default="root")
+
+    parser.add_argument('-t', '--target',
+                        help='ID of the folder in Google Drive into which ' +
+                        'the files are copied. The paths of the files ' +
+                        'relative to the parent folder are preserved.',
+                        required=True)
+
+    parser.add_argument('-r', '--recursive',
+                        help='Copy folders recursively.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-j', '--jobs',
+                        help='Number of files to copy concurrently. ' +
+                        'The default is 8.',
+                        type=int,
+                        default=8)
+
+    parser.add_argument('-L', '--limit-rate',
+                        help='Limit the number of API requests per second. ' +
+                        'The default is 10.',
+                        type=float,
+                        default=10)
+
+    parser.add_argument('--retries',
+                        help='Number of retries of a failed request with ' +
+                        'exponential backoff. The default is 5.',
+                        type=int,
+                        default=5)
+
+    parser.add_argument('-J', '--journal',
+                        help='File in which the copied files are recorded. ' +
+                        'If the copy is interrupted, rerunning it with the ' +
+                        'same journal skips the files already copied.',
+                        default="")
+
+    parser.add_argument('-c', '--config',
+                        help='Configuration directory containing the ' +
+                        ' credential. The default is ~/.config/gdutil/.',
+                        default="")
+
+    parser.add_argument('-q', '--quiet',
+                        help='Suppress information and error messages.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('-i', '--id', dest='ids',
+                        nargs='+',
+                        help='List of file or folder IDs to be copied.')
+
+    parser.add_argument('patterns', metavar='NAME_PATTERN',
+                        nargs='*',
+                        help='List of file names or Unix filename patterns. ' +
+                        '(Each name pattern must be enclosed in quotes).')
+
+    return parser.parse_args()
+
+
+def is_folder(file1):
+    "Check whether a value in the listing of list_files is a folder"
+
+    return file1['fileobj'].get('mimeType') == FOLDER_MIME
+
+
+def load_journal(fname):
+    """
+    Load the journal of a previous copy as a dictionary from the IDs of
+    the source files and folders to the IDs of their copies
+    """
+    import os
+    import json
+
+    copied = {}
+    if not fname or not os.path.exists(fname):
+        return copied
+
+    with open(fname) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                copied[entry['source']] = entry['target']
+            except (ValueError, KeyError):
+                # Skip a partially written last line
+                pass
+
+    return copied
+
+
+class Journal(object):
+    "Record the copied files and folders, one JSON object per line"
+
+    def __init__(self, fname):
+        self.f = open(fname, 'a') if fname else None
+        self.lock = threading.Lock()
+
+    def record(self, source, target):
+        import json
+
+        if self.f is None:
+            return
+
+        with self.lock:
+            self.f.write(json.dumps({'source': source, 'target': target}) +
+                         '\n')
+            self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def execute(request, auth, args, limiter):
+    "Execute an API request under the rate limit with retries"
+    from gd_get import get_http
+
+    limiter.consume(1)
+
+    return request.execute(http=get_http(auth), num_retries=args.retries)
+
+
+def copy_tree(ls, auth, args):
+    """
+    Copy the files and folders in the listing of list_files into the
+    target folder, preserving their paths. Folders are created level by
+    level, and files are copied by args.jobs concurrent workers on the
+    server side. Returns a summary with the numbers of copied, skipped
+    and failed files, the copied bytes and the elapsed time.
+    """
+    import os
+    import time
+    from gd_plan import run_tasks
+    from gd_throttle import BandwidthLimiter
+
+    # Files in the journal were copied by a previous run
+    copied = load_journal(args.journal)
+    journal = Journal(args.journal)
+    limiter = BandwidthLimiter(args.limit_rate)
+    service = auth.service
+    lock = threading.Lock()
+
+    # Folders to be created, including the parent folders of the listed
+    # files that are not listed themselves, which are journaled by path
+    values = sorted(ls, key=lambda file1: file1['name'])
+    mkdirs = dict((file1['name'], file1['id']) for file1 in values
+                  if is_folder(file1))
+    for file1 in values:
+        dirname = os.path.dirname(file1['name'])
+        while dirname and dirname not in mkdirs:
+            mkdirs[dirname] = '/' + dirname
+            dirname = os.path.dirname(dirname)
+
+    # IDs of the target folders by their paths
+    folders = {'': args.target}
+    for path, id in mkdirs.items():
+        if id in copied:
+            folders[path] = copied[id]
+
+    def make_folder(task):
+        file1 = task['file']
+        body = {'title': os.path.basename(file1['name']),
+                'mimeType': FOLDER_MIME,
+                'parents': [{'id': folders[os.path.dirname(file1['name'])]}]}
+        folder = execute(service.files().insert(body=body, fields='id'),
+                         auth, args, limiter)
+
+        with lock:
+            folders[file1['name']] = folder['id']
+        journal.record(file1['id'], folder['id'])
+
+    # Create the folders in the order of depth, since a folder can only be
+    # created after its parent
+    pending = [{'file': {'id': id, 'name': path}}
+               for path, id in sorted(mkdirs.items()) if path not in folders]
+    depth = 0
+    while pending:
+        level = [task for task in pending
+                 if task['file']['name'].count('/') == depth]
+        run_tasks(level, max(1, min(args.jobs, len(level))), make_folder)
+        pending = [task for task in pending
+                   if task['file']['name'].count('/') > depth]
+        depth += 1
+
+    tasks = [{'file': file1} for file1 in values
+             if not is_folder(file1) and file1['id'] not in copied]
+    stats = {'copied': 0, 'failed': 0, 'bytes': 0,
+             'skipped': len([file1 for file1 in values
+                             if not is_folder(file1) and
+                             file1['id'] in copied])}
+    start = time.time()
+
+    def copy_file(task):
+        file1 = task['file']
+        dirname = os.path.dirname(file1['name'])
+        if dirname not in folders:
+            raise IOError('target folder %s was not created' % dirname)
+
+        body = {'title': os.path.basename(file1['name']),
+                'parents': [{'id': folders[dirname]}]}
+        copy = execute(service.files().copy(fileId=file1['id'], body=body,
+                                            fields='id'),
+                       auth, args, limiter)
+        journal.record(file1['id'], copy['id'])
+
+        with lock:
+            stats['copied'] += 1
+            stats['bytes'] += max(file1['fileSize'], 0)
+            if not args.quiet and (stats['copied'] % 100 == 0 or
+                                   stats['copied'] == len(tasks)):
+                sys.stderr.write('\rCopied %d of %d files' %
+                                 (stats['copied'], len(tasks)))
+
+        return max(file1['fileSize'], 0)
+
+    try:
+        run_tasks(tasks, max(1, min(args.jobs, len(tasks))), copy_file)
+    finally:
+        journal.close()
+
+    stats['failed'] = len(tasks) - stats['copied']
+    stats['elapsed'] = time.time() - start
+
+    if not args.quiet:
+        from gd_get import sizeof_fmt
+
+        sys.stderr.write('\nCopied %d files (%s) in %.1f seconds, ' %
+                         (stats['copied'], sizeof_fmt(stats['bytes'], 'B'),
+                          stats['elapsed']) +
+                         'skipped %d copied before, %d failed\n' %
+                         (stats['skipped'], stats['failed']))
+
+    return stats
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    from pydrive.drive import GoogleDrive
+
+    # Athenticate
+    gauth = authenticate(args.config)
+
+    # Create drive object
+    drive = GoogleDrive(gauth)
+
+    ls = list_files(drive,
+                    parent_id=args.parent,
+                    ids=args.ids,
+                    patterns=args.patterns,
+                    recursive=args.recursive)
+
+    if not ls:
+        if not args.quiet:
+            sys.stderr.write('Not found\n')
+        sys.exit(-1)
+
+    if copy_tree(list(ls.values()), gauth, args)['failed']:
+        sys.exit(-1)
@@ -8,9 +8,15 @@ from __future__ import print_function
 
 import sys
 import hashlib
+import threading
+from contextlib import closing
 from gd_auth import authenticate
 from gd_list import list_files
-import httplib2
+from gd_throttle import throttle
+from gd_profile import phase, profiled
+from gd_transport import Transport
+
+HOSTADDR_TTL = 86400
 
 
 def parse_args(description):
@@ -58,21 +64,169 @@ def parse_args(description):
                         action='store_true',
                         default=False)
 
+    parser.add_argument('-j', '--jobs',
+                        help='Number of files or byte ranges of large files ' +
+                        'to download concurrently. The default is 1.',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--transport',
+                        help='HTTP transport for downloading blocks. ' +
+                        'httplib2 supports hedging, and stream reads the ' +
+                        'blocks into a fixed pool of reusable buffers. ' +
+                        'The default is httplib2.',
+                        choices=['httplib2', 'stream'],
+                        default='httplib2')
+
+    parser.add_argument('--hedge',
+                        help='Maximum fraction of Range requests that are ' +
+                        'duplicated on a new connection when they are much ' +
+                        'slower than usual. 0 disables hedging. The ' +
+                        'default is 0.05.',
+                        type=float,
+                        default=0.05)
+
+    parser.add_argument('--shard-index',
+                        help='Index of this node among the nodes ' +
+                        'downloading the same files together, from 0 to ' +
+                        'the shard count - 1.',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--shard-count',
+                        help='Number of nodes downloading the same files ' +
+                        'together. Each node downloads a disjoint subset ' +
+                        'of the files and of the byte ranges of large files, ' +
+                        'balanced by size. The default is 1.',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('-w', '--watch',
+                        help='Keep running after downloading the files, and ' +
+                        'download new or modified files under the parent ' +
+                        'folder as they appear. A restarted watch resumes ' +
+                        'from where it stopped.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--interval',
+                        help='Seconds between polls for changes with -w. ' +
+                        'The default is 5.',
+                        type=float,
+                        default=5)
+
+    parser.add_argument('--debounce',
+                        help='Seconds for which a file must not change ' +
+                        'before it is downloaded with -w. The default is 2.',
+                        type=float,
+                        default=2)
+
+    parser.add_argument('-L', '--limit-rate',
+                        help='Limit the aggregate bandwidth, e.g. 50M for ' +
+                        '50 MB/s. It is shared with other processes on the ' +
+                        'same host according to their priorities.',
+                        default="")
+
+    parser.add_argument('--priority',
+                        help='Priority class for sharing the bandwidth. ' +
+                        'The default is normal.',
+                        choices=['urgent', 'high', 'normal', 'low'],
+                        default='normal')
+
+    parser.add_argument('--rate-file',
+                        help='Control file containing the bandwidth limit, ' +
+                        'which is reloaded when it changes. SIGUSR1 halves ' +
+                        'and SIGUSR2 doubles the limit at runtime.',
+                        default="")
+
     parser.add_argument('-c', '--config',
                         help='Configuration directory containing the ' +
                         ' credential. The default is ~/.config/gdutil/.',
                         default="")
 
+    parser.add_argument('-z', '--decompress',
+                        help='Decompress .gz, .bz2, .xz and .zst files while ' +
+                        'downloading and write only the decompressed output, ' +
+                        'without the compression extension. The checksum of ' +
+                        'the compressed stream is still verified.',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-x', '--extract',
+                        help='Extract tar archives, possibly compressed, into ' +
+                        'the output directory while downloading, without ' +
+                        'writing the archives to disk. The checksum of the ' +
+                        'archive is still verified.',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('--member', dest='members',
+                        help='Extract only the members matching the Unix ' +
+                        'filename pattern. Can be given multiple times.',
+                        action='append',
+                        default=[])
+
     parser.add_argument('-n', '--no-chksum',
                         help='Do not check the chksum of the file. Default is to check.',
                         action='store_true',
                         default=False)
 
+    parser.add_argument('--memory-budget',
+                        help='Limit the memory of the blocks in flight, ' +
+                        'e.g. 2G. New requests wait while the budget is ' +
+                        'used up. The default is unlimited.',
+                        default="")
+
+    parser.add_argument('--hash-jobs',
+                        help='Number of local files to hash in parallel ' +
+                        'when checking whether they are up to date. The ' +
+                        'default is the number of CPUs.',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('--hash-processes',
+                        help='Hash local files in processes instead of ' +
+                        'threads.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--io-depth',
+                        help='Number of 8 MB blocks of a local file read ' +
+                        'ahead while hashing it. The default is 4.',
+                        type=int,
+                        default=4)
+
+    parser.add_argument('--credentials',
+                        help='List of credential files, e.g. of several users ' +
+                        'with access to the same folder, among which the ' +
+                        'concurrent downloads are spread. The default is ' +
+                        'mycred.txt in the configuration directory.',
+                        nargs='+',
+                        default=[])
+
+    parser.add_argument('--profile',
+                        help='Report the wall and CPU time of each phase, ' +
+                        'the numbers of requests and the bytes hashed.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--profile-dump',
+                        help='Also profile the run into the given file, in ' +
+                        'collapsed stacks for flame graphs if its name ends ' +
+                        'with .folded, and in pstats format otherwise.',
+                        default="")
+
     parser.add_argument('-q', '--quiet',
                         help='Suppress information and error messages.',
                         default=False,
                         action='store_true')
 
+    parser.add_argument('-m', '--manifest',
+                        help='Download the files in a manifest written by ' +
+                        'gd-ls -m instead of listing them in Google Drive. ' +
+                        'Use -m - for reading from stdin.',
+                        default="")
+
     parser.add_argument('-i', '--id', dest='ids',
                         nargs='+',
                         help='List of file or folder IDs to be downloaded.')
@@ -91,21 +245,62 @@ def parse_args(description):
     if args.resume and args.outfile == '-':
         sys.stderr('Resume downloading is not supported for stdout')
         sys.exit(-1)
+    if args.outfile == '-' or args.jobs < 1:
+        args.jobs = 1
+    if args.decompress and args.resume:
+        sys.stderr.write('Resume downloading is not supported with -z\n')
+        sys.exit(-1)
+    if args.shard_count < 1 or \
+            not 0 <= args.shard_index < args.shard_count:
+        parser.error('The shard index must be between 0 and the shard count')
+    if args.shard_count > 1 and (args.outfile or not args.preserve):
+        parser.error('Sharding requires -P and no -o')
+    if args.watch and (args.manifest or args.ids or args.outfile or
+                       args.shard_count > 1):
+        parser.error('Watching does not support -m, -i, -o or sharding')
 
     return args
 
 
-def md5chksum(fname):
-    "Computes md5chksum of a local file"
+def md5chksum(fname, purpose='md5chksum'):
+    """
+    Computes md5chksum of a local file with the hash engine of gd_hash,
+    which returns the checksum computed by prehash if the file did not
+    change. The time is profiled as the phase given by purpose.
+    """
+    import gd_hash
+
+    with phase(purpose):
+        return gd_hash.engine.hash_file(fname)
+
 
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def prehash(files, args):
+    """
+    Hash the existing local files with the sizes of the files in the
+    listing in parallel, so that checking whether they are up to date does
+    not hash them one at a time
+    """
+    import os
+    import gd_hash
 
+    fnames = []
+    for file1 in files:
+        if file1['fileSize'] < 0 or is_streamed(file1, args):
+            continue
 
-def check_lastchunk(fname, oldFileSize, service, url, blocksize=65535):
+        fname = get_outname(file1, args)
+        # Files with recorded ranges are incomplete
+        if fname != '-' and os.path.isfile(fname) and \
+                os.path.getsize(fname) == file1['fileSize'] and \
+                not os.path.exists(fname + '.ranges'):
+            fnames.append(fname)
+
+    if fnames:
+        with phase('md5chksum'):
+            gd_hash.engine.hash_files(fnames)
+
+
+def check_lastchunk(fname, oldFileSize, http, url, blocksize=65535):
     """Check the last block of the file and return true if they are
      the same with that on Google Drive"""
 
@@ -114,7 +309,7 @@ def check_lastchunk(fname, oldFileSize, service, url, blocksize=65535):
 
     headers = {"Range": 'bytes=%s-%s' %
                (oldFileSize - blocksize, oldFileSize - 1)}
-    resp, content = service._http.request(url, headers=headers)
+    resp, content = http.request(url, headers=headers)
 
     if resp.status == 206:
         with open(fname, 'rb') as f:
@@ -137,19 +332,216 @@ def sizeof_fmt(num, suffix='B/s'):
 
 
 def get_hostaddr():
-    "Get host address for printing and determining speed"
-    import requests
+    """
+    Get host address for printing and determining speed. The result is
+    cached in memory and on disk for HOSTADDR_TTL seconds per host.
+    """
     import socket
+    from gd_cache import load_cached, save_cached
 
-    ip = requests.get('http://ip.42.pl/raw').text
-    try:
-        hostaddr = socket.gethostbyaddr(ip)[0]
-    except:
-        hostaddr = ip
+    if get_hostaddr.hostaddr:
+        return get_hostaddr.hostaddr
+
+    key = 'hostaddr-' + socket.gethostname()
+    hostaddr = load_cached(key, HOSTADDR_TTL)
+
+    if not hostaddr:
+        import requests
+
+        ip = requests.get('http://ip.42.pl/raw').text
+        try:
+            hostaddr = socket.gethostbyaddr(ip)[0]
+        except:
+            hostaddr = ip
+
+        save_cached(key, hostaddr)
+
+    get_hostaddr.hostaddr = hostaddr
 
     return hostaddr
 
 
+get_hostaddr.hostaddr = None
+
+
+def get_http(auth):
+    """
+    Get an authorized HTTP object for the current thread, since httplib2
+    is not thread-safe. The main thread uses the HTTP object of the service,
+    unless slow Range requests are hedged, since a hedged request may leave
+    its HTTP object to a thread in progress.
+    """
+    import httplib2
+    import gd_hedge
+
+    https = getattr(get_http.local, 'https', None)
+    if https is None:
+        https = get_http.local.https = {}
+
+    if id(auth) not in https:
+        def new_http(cache=None):
+            http = auth.credentials.authorize(httplib2.Http(cache=cache))
+
+            # Track the responses of credentials in a gd_pool.CredentialPool
+            tracker = getattr(auth, 'tracker', None)
+            if tracker is not None:
+                from gd_pool import TrackedHttp
+
+                http = TrackedHttp(http, tracker)
+
+            return http
+
+        if gd_hedge.tracker is not None:
+            cache = getattr(auth.service._http, 'cache', None) \
+                if threading.current_thread().name == 'MainThread' else None
+            http = gd_hedge.HedgedHttp(new_http(cache), new_http,
+                                       gd_hedge.tracker)
+        elif threading.current_thread().name == 'MainThread':
+            http = auth.service._http
+            if getattr(auth, 'tracker', None) is not None:
+                from gd_pool import TrackedHttp
+
+                http = TrackedHttp(http, auth.tracker)
+        else:
+            http = new_http()
+
+        https[id(auth)] = http
+
+    return https[id(auth)]
+
+
+get_http.local = threading.local()
+
+
+class HttplibTransport(Transport):
+    """
+    A transport over the authorized httplib2 object of the current thread
+    from get_http, which returns the body of each response as one bytes
+    object. The blocks are handed on as they are, while fetch copies the
+    body into the buffer.
+    """
+
+    def __init__(self, auth):
+        self.auth = auth
+
+    def fetch(self, url, start, end, buf):
+        headers = {"Range": 'bytes=%s-%s' % (start, end - 1)}
+        resp, content = get_http(self.auth).request(url, headers=headers)
+
+        n = 0
+        if resp.status == 206:
+            n = min(len(content), len(buf))
+            buf[:n] = content[:n]
+
+        return resp.status, resp.reason or '', n
+
+    def iter_blocks(self, url, end, chunksize, start=0):
+        return iter_blocks(get_http(self.auth), url, end, chunksize, start)
+
+
+def get_transport(auth, name='stream', nbuffers=2):
+    """
+    Get the transport of the given name for the current thread, which is
+    stream for the StreamingTransport of gd_transport, reading into the
+    buffers of a pool of nbuffers buffers, or httplib2
+    """
+    from gd_transport import StreamingTransport
+
+    transports = getattr(get_transport.local, 'transports', None)
+    if transports is None:
+        transports = get_transport.local.transports = {}
+
+    key = (id(auth), name)
+    if key not in transports:
+        if name == 'stream':
+            transports[key] = StreamingTransport(
+                auth.credentials, getattr(auth, 'tracker', None),
+                nbuffers=nbuffers)
+        else:
+            transports[key] = HttplibTransport(auth)
+
+    return transports[key]
+
+
+get_transport.local = threading.local()
+
+
+def iter_blocks(http, dld_url, end, chunksize, start=0):
+    """
+    Generate the blocks of bytes start to end-1 of a file in Google Drive.
+    A block is charged to the memory budget until the next one is requested.
+    Raises IOError if a block cannot be downloaded.
+    """
+    import gd_transport
+
+    sz = start
+    backoff = 0
+    while sz < end:
+        pnext = min(sz + chunksize, end)
+        headers = {"Range": 'bytes=%s-%s' % (sz, pnext - 1)}
+
+        throttle(pnext - sz)
+        with gd_transport.budget.reserve(pnext - sz):
+            status, content, backoff = get_next_block(
+                http, dld_url, headers, end, chunksize, backoff)
+            if status:
+                raise IOError('could not download bytes %d-%d' %
+                              (sz, pnext - 1))
+
+            yield content
+        sz = pnext
+
+
+def iter_file_blocks(auth, args, dld_url, end, chunksize, start=0):
+    """
+    Generate the blocks of bytes start to end-1 of a file with the
+    transport selected by args.transport. A block is only valid until the
+    next one is requested. Raises IOError if a block cannot be downloaded.
+    """
+
+    transport = get_transport(auth, args.transport, args.jobs + 1)
+
+    return transport.iter_blocks(dld_url, end, chunksize, start)
+
+
+def is_streamed(file1, args):
+    "Check whether a file is decompressed or extracted while downloading"
+    from gd_stream import get_compression, is_tar
+
+    return args.extract and is_tar(file1['name']) or \
+        args.decompress and get_compression(file1['name']) != ''
+
+
+def get_modified_time(file1):
+    "Get the modification time of a file in Google Drive as a timestamp"
+    import time
+    import calendar
+
+    return calendar.timegm(time.strptime(file1['fileobj']['modifiedDate'][:19],
+                                         '%Y-%m-%dT%H:%M:%S'))
+
+
+def get_outname(file1, args):
+    "Get the local file name of a file in the listing, or '-' for stdout"
+    import os
+    from gd_stream import strip_compression
+
+    dirname, basename = os.path.split(file1['name'])
+    if args.decompress:
+        basename = strip_compression(basename)
+
+    if args.preserve:
+        fname = args.outdir + dirname + '/' + basename
+    elif args.outfile and args.outfile != '-':
+        fname = args.outdir + args.outfile
+    elif args.remote:
+        fname = args.outdir + basename
+    else:
+        fname = '-'
+
+    return fname
+
+
 def get_chunksize_perthread(hostaddr):
     " Determine the proper chunk size. "
 
@@ -212,38 +604,50 @@ def get_next_block(http, dld_url, headers, fileSize, chunksize, backoff):
     return -1, '', backoff
 
 
+@profiled('transfer')
 def download_file(file1, auth, args):
     " Download a given file "
 
     import sys
     import os
     import time
-    from progress import ResumableBar
-
-    dirname, basename = os.path.split(file1['name'])
+    import socket
+    import httplib2
 
-    if args.preserve:
-        fname = args.outdir + dirname + '/' + basename
-    elif args.outfile and args.outfile != '-':
-        fname = args.outdir + args.outfile
-    elif args.remote:
-        fname = args.outdir + basename
+    try:
+        from http.client import HTTPException
+    except ImportError:
+        from httplib import HTTPException
+    from gd_stream import get_compression, is_tar
+
+    if args.extract and file1['fileSize'] >= 0 and is_tar(file1['name']):
+        return extract_file(file1, auth, args)
+
+    fname = get_outname(file1, args)
+    dirname = os.path.dirname(fname)
+    resume = args.resume
+    if args.decompress:
+        compression = get_compression(file1['name'])
     else:
-        fname = '-'
+        compression = ''
+    show_bar = not args.quiet and args.jobs <= 1
 
     # If the given file is a folder, create the directory locally
     oldFileSize = 0
     fileSize = file1['fileSize']
     if fileSize < 0:
         if args.preserve and not os.path.isdir(fname):
-            os.makedirs(fname)
+            makedirs(fname)
         return
 
     if fname != '-' and os.path.isfile(fname):
         # Download the file only if size is different or
-        # the checksum is different Compute chksum
+        # the checksum is different Compute chksum. A decompressed file
+        # is up to date if it has the modification time of the remote file
         oldFileSize = os.path.getsize(fname)
-        if oldFileSize == fileSize and \
+        if compression and \
+                os.path.getmtime(fname) == get_modified_time(file1) or \
+                not compression and oldFileSize == fileSize and \
                 md5chksum(fname) == file1['fileobj']['md5Checksum']:
             # Download the file
             if not args.quiet:
@@ -252,18 +656,19 @@ def download_file(file1, auth, args):
 
             return
     else:
-        args.resume = False
+        resume = False
         if fname != '-' and args.preserve and \
                 dirname and not os.path.isdir(dirname):
             # Create directory if not exist
-            os.makedirs(dirname)
+            makedirs(dirname)
 
     dld_url = file1['fileobj']['downloadUrl']
+    http = get_http(auth)
     hostaddr = get_hostaddr()
     chunksize = get_chunksize_perthread(hostaddr)
 
     if not args.quiet:
-        if args.resume:
+        if resume:
             sys.stderr.write("Resume downloading file " +
                              file1['name'] + " ...\n")
         else:
@@ -274,9 +679,8 @@ def download_file(file1, auth, args):
     # Open the file for appending/writing
     pstart = 0
     if fname != '-':
-        if args.resume and oldFileSize > 0 and \
-                check_lastchunk(fname, oldFileSize,
-                                auth.service, dld_url):
+        if resume and oldFileSize > 0 and \
+                check_lastchunk(fname, oldFileSize, http, dld_url):
             # Open file for appending
             f = open(fname, "ab")
             pstart = oldFileSize
@@ -293,50 +697,62 @@ def download_file(file1, auth, args):
             import msvcrt
             msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
 
-    if not args.quiet:
+    if compression:
+        from gd_stream import DecompressWriter, DecompressError
+
+        out = DecompressWriter(f, compression)
+    else:
+        out = f
+
+    if show_bar:
+        from progress import ResumableBar
+
         bar = ResumableBar(maxval=fileSize, initial_value=pstart)
         bar.start()
 
-    # Download the file using httplib2 and URL
+    # Hash the file while downloading it, unless only the rest of the file
+    # is downloaded
+    if not compression and pstart == 0 and fname != '-':
+        md5 = hashlib.md5()
+    else:
+        md5 = None
+
     interrupted = False
 
     # Start up
     start = time.time()
     sz = pstart   # Counter for filesize
-    backoff = 0
-
-    while True:
-        try:
-            pnext = sz + chunksize
-            if pnext >= fileSize:
-                headers = {"Range": 'bytes=%s-%s' % (sz, '')}
-                pnext = fileSize
-            else:
-                headers = {"Range": 'bytes=%s-%s' % (sz, pnext - 1)}
-
-            status, content, backoff = get_next_block(
-                auth.service._http, dld_url, headers, fileSize, chunksize, backoff)
-
-            if status:
-                break
-
-            f.write(content)
-            sz = pnext
 
-            if not args.quiet:
-                bar.update(sz)
-
-            if sz == fileSize:
-                break
-
-        except httplib2.ServerNotFoundError:
-            sys.stderr.write("\nSite is Down\n")
-            break
-        except KeyboardInterrupt:
-            interrupted = True
-            sys.stderr.write(
-                "\nDownload interrupted. You can resume it using the -R option.\n")
-            break
+    decompressed = True
+    try:
+        # Close the generator on errors, so that its buffer is released
+        with closing(iter_file_blocks(auth, args, dld_url, fileSize,
+                                      chunksize, pstart)) as blocks:
+            for block in blocks:
+                out.write(block)
+                if md5 is not None:
+                    md5.update(block)
+                sz += len(block)
+
+                if show_bar:
+                    bar.update(sz)
+
+        if compression and sz == fileSize:
+            out.finish()
+    except httplib2.ServerNotFoundError:
+        sys.stderr.write("\nSite is Down\n")
+    except (IOError, socket.error, HTTPException) as e:
+        if compression and isinstance(e, DecompressError):
+            decompressed = False
+            sys.stderr.write("\nFailed to decompress %s: %s\n" %
+                             (file1['name'], e))
+        else:
+            sys.stderr.write("\nFailed to download %s: %s\n" %
+                             (file1['name'], e))
+    except KeyboardInterrupt:
+        interrupted = True
+        sys.stderr.write(
+            "\nDownload interrupted. You can resume it using the -R option.\n")
 
     # Close the file and progress bar
     if fname != '-':
@@ -345,7 +761,7 @@ def download_file(file1, auth, args):
         sys.stdout.flush()
     elapsed = time.time() - start
 
-    if not args.quiet:
+    if show_bar:
         if sz == fileSize:
             bar.finish()
         else:
@@ -356,34 +772,480 @@ def download_file(file1, auth, args):
                          (sizeof_fmt(sz - pstart, 'B'), elapsed,
                           sizeof_fmt((sz - pstart) / elapsed), hostaddr))
 
-    # Check the checksum of the file for integrity
-    if not args.no_chksum and not interrupted and fname != '-' and sz == fileSize and \
-            md5chksum(fname) != file1['fileobj']['md5Checksum']:
-        sys.stderr.write("Checksum of the file does not match. The file might be corrupted " +
-                         "during transmission or was changed on Google Drive during transfer.")
+    # Check the checksum of the file for integrity. For decompressed files,
+    # check the checksum of the compressed stream
+    if not args.no_chksum and not interrupted and decompressed and \
+            sz == fileSize and (compression or fname != '-'):
+        if compression:
+            md5 = out.hexdigest()
+        elif md5 is not None:
+            md5 = md5.hexdigest()
+        else:
+            md5 = md5chksum(fname, 'verify')
+
+        if md5 != file1['fileobj']['md5Checksum']:
+            sys.stderr.write("Checksum of the file does not match. The file might be corrupted " +
+                             "during transmission or was changed on Google Drive during transfer.")
+        elif compression and fname != '-':
+            # Mark the decompressed file as up to date
+            mtime = get_modified_time(file1)
+            os.utime(fname, (mtime, mtime))
 
     return sz, elapsed
 
 
+def extract_file(file1, auth, args):
+    """
+    Download a tar archive and extract it into the output directory while
+    downloading, without writing the archive to disk.
+    """
+    import os
+    import time
+    import tarfile
+    from gd_stream import BlockReader, extract_tar
+
+    outdir = args.outdir or './'
+    if args.preserve:
+        outdir = outdir + os.path.dirname(file1['name'])
+    if outdir and not os.path.isdir(outdir):
+        makedirs(outdir)
+
+    if not args.quiet:
+        sys.stderr.write("Extracting file " + file1['name'] + " ...\n")
+
+    chunksize = get_chunksize_perthread(get_hostaddr())
+    blocks = iter_file_blocks(auth, args, file1['fileobj']['downloadUrl'],
+                              file1['fileSize'], chunksize)
+    reader = BlockReader(blocks)
+
+    start = time.time()
+    try:
+        # Close the generator on errors, so that its buffer is released
+        with closing(blocks):
+            count = extract_tar(reader, outdir, args.members, args.quiet)
+
+            # Read the rest of the archive, such as the padding at its end
+            # and the unmatched members, to verify the checksum of the whole
+            # archive
+            if not args.no_chksum:
+                reader.drain()
+    except (IOError, tarfile.TarError) as e:
+        sys.stderr.write("Failed to extract %s: %s\n" % (file1['name'], e))
+        return reader.count, time.time() - start
+    elapsed = time.time() - start
+
+    if not args.quiet:
+        sys.stderr.write("Extracted %d members of %s in %.1f seconds\n" %
+                         (count, file1['name'], elapsed))
+
+    if not args.no_chksum and \
+            reader.hexdigest() != file1['fileobj']['md5Checksum']:
+        sys.stderr.write("Checksum of the archive %s does not match. " % file1['name'] +
+                         "The archive might be corrupted during transmission " +
+                         "or was changed on Google Drive during transfer.\n")
+
+    return reader.count, elapsed
+
+
+def makedirs(dirname):
+    "Create a directory recursively, if another process did not create it"
+    import os
+    import errno
+
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dirname):
+            raise
+
+
+def prepare_ranges(file1, args, shared=False):
+    """
+    Prepare the local file for downloading a file in byte ranges.
+    Returns the local file name, or None if the file is up to date.
+    The downloaded ranges are recorded by record_range, and with the -R
+    option, the file and its recorded ranges are kept so that only the
+    other ranges are downloaded. If the file is shared with other nodes
+    downloading other ranges of it, their data in the file is always kept,
+    and the file is not hashed by every node: a shared file is up to date
+    if the node that completed it marked it with the modification time of
+    the remote file.
+    """
+    import os
+
+    fname = get_outname(file1, args)
+    fileSize = file1['fileSize']
+
+    # A file with recorded ranges is incomplete
+    if os.path.isfile(fname) and os.path.getsize(fname) == fileSize and \
+            not os.path.exists(fname + '.ranges'):
+        if shared:
+            uptodate = os.path.getmtime(fname) == get_modified_time(file1)
+        else:
+            uptodate = md5chksum(fname) == file1['fileobj']['md5Checksum']
+
+        if uptodate:
+            if not args.quiet:
+                sys.stderr.write("File %s is up to date.\n" % fname)
+            return None
+
+    dirname = os.path.dirname(fname)
+    if dirname and not os.path.isdir(dirname):
+        makedirs(dirname)
+
+    # Preallocate the file so that the ranges can be written by offset
+    if shared:
+        fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if os.fstat(fd).st_size != fileSize:
+                os.ftruncate(fd, fileSize)
+
+                # The node creating the file drops the ranges recorded by
+                # an earlier run
+                with open(fname + '.ranges', 'w'):
+                    pass
+        finally:
+            os.close(fd)
+    elif not (args.resume and os.path.isfile(fname) and
+              os.path.getsize(fname) == fileSize):
+        with open(fname, "wb") as f:
+            f.truncate(fileSize)
+        with open(fname + '.ranges', 'w'):
+            pass
+
+    return fname
+
+
+def get_ranges(fname, file1):
+    """
+    Get the byte ranges of a file recorded in fname.ranges for the current
+    version of the remote file
+    """
+
+    md5 = file1['fileobj']['md5Checksum']
+    ranges = set()
+    try:
+        with open(fname + '.ranges') as f:
+            for line in f:
+                try:
+                    s, e, checksum = line.split()
+                    if checksum == md5:
+                        ranges.add((int(s), int(e)))
+                except ValueError:
+                    pass
+    except IOError:
+        pass
+
+    return ranges
+
+
+def record_range(fname, start, end, file1):
+    """
+    Record a downloaded byte range of a file in the file fname.ranges next
+    to it, and return whether this node completed the file and should
+    verify it. The file may be shared with other nodes. Lines are appended,
+    which is atomic for short lines also on parallel filesystems. They
+    carry the checksum of the remote file, so that ranges recorded for an
+    earlier version are ignored. Of the nodes that see all ranges recorded,
+    only the one that renames the ranges file away completes the file.
+    """
+    import os
+    import socket
+
+    with open(fname + '.ranges', 'a') as f:
+        f.write('%d %d %s\n' % (start, end, file1['fileobj']['md5Checksum']))
+
+    covered = 0
+    for s, e in sorted(get_ranges(fname, file1)):
+        if s > covered:
+            return False
+        covered = max(covered, e)
+
+    if covered < file1['fileSize']:
+        return False
+
+    claimed = '%s.ranges.%s.%d' % (fname, socket.gethostname(), os.getpid())
+    try:
+        os.rename(fname + '.ranges', claimed)
+    except OSError:
+        # Completed by another node
+        return False
+    os.remove(claimed)
+
+    return True
+
+
+@profiled('transfer')
+def download_range(task, auth, args):
+    """
+    Download the byte range of a task into the local file prepared by
+    prepare_ranges. Verifies the checksum after the last range of the file
+    is downloaded. Returns the number of bytes downloaded.
+    """
+    import os
+    import socket
+    import httplib2
+
+    try:
+        from http.client import HTTPException
+    except ImportError:
+        from httplib import HTTPException
+
+    file1 = task['file']
+    dld_url = file1['fileobj']['downloadUrl']
+    chunksize = get_chunksize_perthread(get_hostaddr())
+
+    try:
+        with open(task['fname'], "r+b") as f:
+            f.seek(task['start'])
+            with closing(iter_file_blocks(auth, args, dld_url, task['end'],
+                                          chunksize, task['start'])) as blocks:
+                for block in blocks:
+                    f.write(block)
+    except (IOError, socket.error, HTTPException,
+            httplib2.HttpLib2Error) as e:
+        # The range is not recorded, so that it is downloaded again with -R
+        sys.stderr.write("Failed to download bytes %d-%d of %s: %s. " %
+                         (task['start'], task['end'] - 1, file1['name'], e) +
+                         "You can resume it using the -R option.\n")
+        return 0
+
+    # Other nodes may still be downloading their ranges of a shared file
+    parts = task['parts']
+    with parts['lock']:
+        done = record_range(task['fname'], task['start'], task['end'], file1)
+
+    if done:
+        if not args.quiet:
+            sys.stderr.write("Downloaded file %s\n" % file1['name'])
+
+        if not args.no_chksum and \
+                md5chksum(task['fname'], 'verify') != \
+                file1['fileobj']['md5Checksum']:
+            sys.stderr.write("Checksum of the file %s does not match. " % file1['name'] +
+                             "The file might be corrupted during transmission " +
+                             "or was changed on Google Drive during transfer.\n")
+        elif parts['shared']:
+            # Mark the shared file as up to date for the other nodes
+            mtime = get_modified_time(file1)
+            os.utime(task['fname'], (mtime, mtime))
+
+    return task['end'] - task['start']
+
+
+def run_task(task, pool, args):
+    """
+    Download a task of the transfer plan with a credential from the pool
+    and return the number of bytes
+    """
+
+    auth = pool.acquire()
+    try:
+        if task['whole']:
+            result = download_file(task['file'], auth, args)
+            return result[0] if result else 0
+        else:
+            return download_range(task, auth, args)
+    finally:
+        pool.release(auth)
+
+
+def download_files(ls, auth, args, pool=None):
+    """
+    Download the files in the listing with args.jobs concurrent workers,
+    following the transfer plan of gd_plan. The tasks are spread among the
+    credentials in the pool if given.
+    """
+    import time
+    import gd_hedge
+    from gd_plan import plan_transfers, estimate_makespan, run_tasks, \
+        load_throughput, save_throughput
+    from gd_pool import CredentialPool
+
+    if pool is None:
+        pool = CredentialPool([auth])
+
+    files = sorted(ls, key=lambda file1: file1['name'])
+
+    # Create the folders first
+    for file1 in files:
+        if file1['fileSize'] < 0:
+            download_file(file1, auth, args)
+
+    # Check the existing files in one parallel batch
+    prehash(files, args)
+
+    if args.shard_count > 1:
+        # All nodes must split the files in the same way
+        chunksize = get_chunksize_perthread('')
+    else:
+        chunksize = get_chunksize_perthread(get_hostaddr())
+    splittable = lambda file1: not is_streamed(file1, args)
+    tasks = plan_transfers(files, args.jobs, chunksize,
+                           splittable=splittable,
+                           shard_index=args.shard_index,
+                           shard_count=args.shard_count)[0]
+
+    # Count the ranges of each file in this shard and in all shards, since
+    # files with ranges in other shards are shared with other nodes
+    nranges = {}
+    for task in tasks:
+        nranges[task['file']['id']] = nranges.get(task['file']['id'], 0) + 1
+    total_ranges = nranges
+    if args.shard_count > 1:
+        from gd_plan import make_tasks
+
+        total_ranges = {}
+        for task in make_tasks(files, args.jobs * args.shard_count,
+                               chunksize, splittable=splittable):
+            total_ranges[task['file']['id']] = \
+                total_ranges.get(task['file']['id'], 0) + 1
+
+    # Prepare the files to be downloaded in ranges
+    parts = {}
+    for task in tasks:
+        if not task['whole']:
+            file1 = task['file']
+            if file1['id'] not in parts:
+                shared = total_ranges[file1['id']] > nranges[file1['id']]
+                fname = prepare_ranges(file1, args, shared)
+                ranges = get_ranges(fname, file1) if fname else set()
+                parts[file1['id']] = {'fname': fname, 'ranges': ranges,
+                                      'shared': shared,
+                                      'lock': threading.Lock()}
+
+            task['parts'] = parts[file1['id']]
+            task['fname'] = task['parts']['fname']
+
+    # Skip the files that are up to date and the ranges downloaded before
+    tasks = [task for task in tasks if task['whole'] or task['fname'] and
+             (task['start'], task['end']) not in task['parts']['ranges']]
+    makespan = estimate_makespan(tasks, args.jobs, load_throughput())
+
+    if not args.quiet:
+        sys.stderr.write("Planned %d tasks with %d workers. " %
+                         (len(tasks), args.jobs) +
+                         "Estimated completion time is %.1f seconds.\n" %
+                         makespan)
+
+    start = time.time()
+    nbytes, throughput = run_tasks(tasks, args.jobs, run_task, (pool, args))
+    elapsed = time.time() - start
+
+    if not args.quiet and len(pool) > 1:
+        pool.report()
+
+    if not args.quiet and gd_hedge.tracker is not None and \
+            gd_hedge.tracker.hedges:
+        sys.stderr.write("Hedged %d of %d requests, of which %d were faster\n" %
+                         (gd_hedge.tracker.hedges, gd_hedge.tracker.requests,
+                          gd_hedge.tracker.wins))
+
+    save_throughput(throughput)
+
+    if not args.quiet and elapsed > 0:
+        sys.stderr.write("Downloaded %s in %.1f seconds at %s\n" %
+                         (sizeof_fmt(nbytes, 'B'), elapsed,
+                          sizeof_fmt(nbytes / elapsed)))
+
+    return nbytes, elapsed
+
+
 if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    if args.profile or args.profile_dump:
+        import gd_profile
+
+        gd_profile.enable(args.profile_dump)
+
     from pydrive.drive import GoogleDrive
 
-    args = parse_args(description=__doc__)
+    import gd_hash
+    import gd_hedge
+    import gd_transport
 
-    # Athenticate
-    gauth = authenticate(args.config)
+    gd_hash.configure(args.hash_jobs, args.hash_processes, args.io_depth)
+    gd_hedge.configure(args.hedge)
+
+    if args.memory_budget:
+        from gd_throttle import parse_rate
 
-    # Create drive object
-    drive = GoogleDrive(gauth)
+        gd_transport.configure_budget(parse_rate(args.memory_budget))
 
-    # List files and download matching files
-    ls = list_files(drive,
-                    parent_id=args.parent,
-                    ids=args.ids,
-                    patterns=args.patterns,
-                    recursive=args.recursive,
-                    callback=download_file,
-                    callback_args=(gauth, args))
+    if args.limit_rate or args.rate_file:
+        from gd_throttle import configure, parse_rate
 
-    if not ls and args.patterns and not args.quiet:
+        configure(parse_rate(args.limit_rate or 0), args.priority,
+                  args.rate_file)
+
+    # Athenticate
+    with phase('authenticate'):
+        if args.credentials:
+            from gd_pool import CredentialPool
+
+            auths = [authenticate(args.config, credfile=credfile)
+                     for credfile in args.credentials]
+            pool = CredentialPool(auths, args.credentials)
+            if not pool.check_health():
+                sys.stderr.write('None of the credentials is healthy\n')
+                sys.exit(-1)
+            gauth = auths[0]
+        else:
+            gauth = authenticate(args.config)
+            pool = None
+
+    if args.watch:
+        from gd_watch import watch
+
+        # Download the files and then the new or modified ones until
+        # interrupted
+        watch(gauth, args, pool)
+    elif args.manifest:
+        from gd_manifest import read_manifest
+
+        # Download the files in the manifest without listing them
+        ls = read_manifest(args.manifest)
+        if args.jobs > 1 or pool or args.shard_count > 1:
+            download_files(ls, gauth, args, pool)
+        else:
+            prehash(ls, args)
+            for file1 in ls:
+                download_file(file1, gauth, args)
+    elif args.jobs > 1 or pool or args.shard_count > 1:
+        # List all files first and then download them concurrently
+        drive = GoogleDrive(gauth)
+        with phase('list_files'):
+            ls = list_files(drive,
+                            parent_id=args.parent,
+                            ids=args.ids,
+                            patterns=args.patterns,
+                            recursive=args.recursive)
+
+        download_files(list(ls.values()), gauth, args, pool)
+    else:
+        # Create drive object
+        drive = GoogleDrive(gauth)
+
+        # List files and download matching files
+        with phase('list_files'):
+            ls = list_files(drive,
+                            parent_id=args.parent,
+                            ids=args.ids,
+                            patterns=args.patterns,
+                            recursive=args.recursive,
+                            callback=download_file,
+                            callback_args=(gauth, args))
+
+    if not args.watch and not ls and args.patterns and not args.quiet:
         sys.stderr.write('Not found\n')
+
+    if not args.quiet and gd_transport.budget.peak:
+        budget = gd_transport.budget
+        sys.stderr.write("Peak memory of transfers was %s" %
+                         sizeof_fmt(budget.peak, 'B'))
+        if budget.limit:
+            sys.stderr.write(" of the budget of %s, which delayed %d "
+                             "requests" % (sizeof_fmt(budget.limit, 'B'),
+                                           budget.waits))
+        sys.stderr.write("\n")
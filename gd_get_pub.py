@@ -10,6 +10,7 @@ for downloading test datasets in batch mode.
 """
 
 import sys
+from contextlib import contextmanager
 
 
 def parse_args(description):
@@ -36,11 +37,61 @@ def parse_args(description):
                         type=int,
                         default=-1)
 
+    parser.add_argument('-j', '--jobs',
+                        help='Number of concurrent connections for downloading ' +
+                        'byte ranges of the file. The default is 1.',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('-m', '--manifest',
+                        help='Manifest file for batch mode. Each line contains ' +
+                        'a file ID, optionally followed by the output file ' +
+                        'name and the expected size, separated by whitespace ' +
+                        'or commas. In batch mode, -j is the number of files ' +
+                        'downloaded concurrently.',
+                        default="")
+
+    parser.add_argument('-r', '--retries',
+                        help='Number of attempts to recover each file from ' +
+                        'errors in batch mode. The default is 5.',
+                        type=int,
+                        default=5)
+
+    parser.add_argument('-L', '--limit-rate',
+                        help='Limit the aggregate bandwidth, e.g. 50M for ' +
+                        '50 MB/s. It is shared with other processes on the ' +
+                        'same host according to their priorities.',
+                        default="")
+
+    parser.add_argument('--priority',
+                        help='Priority class for sharing the bandwidth. ' +
+                        'The default is normal.',
+                        choices=['urgent', 'high', 'normal', 'low'],
+                        default='normal')
+
+    parser.add_argument('--rate-file',
+                        help='Control file containing the bandwidth limit, ' +
+                        'which is reloaded when it changes. SIGUSR1 halves ' +
+                        'and SIGUSR2 doubles the limit at runtime.',
+                        default="")
+
     parser.add_argument('-q', '--quiet',
                         help='Suppress output.',
                         default=False,
                         action='store_true')
 
+    parser.add_argument('--profile',
+                        help='Report the wall and CPU time of the transfer ' +
+                        'and the numbers of requests. Requires gd_profile.py.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--profile-dump',
+                        help='Also profile the run into the given file, in ' +
+                        'collapsed stacks for flame graphs if its name ends ' +
+                        'with .folded, and in pstats format otherwise.',
+                        default="")
+
     parser.add_argument('-i', '--id',
                         help='Dummy tag for compatability with gd-get.',
                         action='store_true',
@@ -48,22 +99,43 @@ def parse_args(description):
 
     parser.add_argument('file_id',
                         help='ID of the file in Google Drive to be downloaded.',
+                        nargs='?',
                         default="")
 
     args = parser.parse_args()
     if args.outfile:
         args.remote = False
+    if not args.file_id and not args.manifest:
+        parser.error('A file ID or a manifest is required.')
 
     return args
 
 
-def get_request(file_id, headers=None):
-    'Get a request for the given file ID'
+URL = "https://drive.google.com/uc?export=download"
+
+
+def get_session(pool_size=10):
+    'Create a session with a connection pool of the given size'
     import requests
 
-    URL = "https://drive.google.com/uc?export=download"
     session = requests.Session()
 
+    # Byte counts and ranges refer to the file itself, not to an encoding
+    session.headers['Accept-Encoding'] = 'identity'
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_request(file_id, headers=None, session=None):
+    'Get a request for the given file ID'
+
+    if session is None:
+        session = get_session(1)
+
     params = {'id': file_id}
     req = session.get(URL, params=params, headers=headers, stream=True)
 
@@ -85,11 +157,24 @@ def get_request(file_id, headers=None):
     return req
 
 
-def download_file(file_id, outfile, filesize, quiet=False):
-    "Download file with the given file ID from Google Drive"
+def download_file(file_id, outfile, filesize, quiet=False,
+                  session=None, retries=-1):
+    """
+    Download file with the given file ID from Google Drive.
+
+    If outfile is empty, the remote file name is used. At most retries
+    attempts are made to recover from errors (unlimited if negative).
+    Raises IOError if the transfer is incomplete.
+    """
     import time
 
-    req = get_request(file_id)
+    if session is None:
+        session = get_session(1)
+    req = get_request(file_id, session=session)
+    url = req.url
+
+    # Size of the remote file for detecting truncated transfers
+    remote_size = int(req.headers.get('Content-Length', -1))
 
     # Get filesize and file name
     if filesize <= 0 and 'Content-Length' in req.headers.keys():
@@ -98,10 +183,10 @@ def download_file(file_id, outfile, filesize, quiet=False):
     disposition = req.headers['Content-Disposition']
     remotefile = disposition[21:disposition.find('"', 21)]
 
-    if args.remote:
+    if not outfile:
         outfile = remotefile
 
-    if not args.quiet:
+    if not quiet:
         sys.stderr.write('Downlading %s and saving into %s ...\n' %
                          (remotefile, outfile))
 
@@ -117,7 +202,7 @@ def download_file(file_id, outfile, filesize, quiet=False):
             import msvcrt
             msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
 
-    if not args.quiet:
+    if not quiet:
         try:
             from progressbar import ProgressBar, UnknownLength
 
@@ -134,16 +219,25 @@ def download_file(file_id, outfile, filesize, quiet=False):
     start = time.time()
 
     count = 0
+    attempts = 0
+    interrupted = False
     while True:
         try:
             count, interrupted, done, bar = write_req_content(
                 req, fd, count, bar)
-            if interrupted or done:
+            if interrupted or done or attempts == retries:
                 break
             else:
-                # Try to recover by continuing from where it was left
+                attempts += 1
+                time.sleep(min(0.1 * 2 ** attempts, 10))
+
+                # Try to recover by continuing from where it was left,
+                # reusing the resolved URL to skip the confirmation
                 headers = {"Range": 'bytes=%s-' % count}
-                req = get_request(file_id, headers)
+                req = session.get(url, headers=headers, stream=True)
+                if req.status_code != 206:
+                    req.close()
+                    req = get_request(file_id, headers, session)
         except BaseException:
             done = False
             break
@@ -158,9 +252,279 @@ def download_file(file_id, outfile, filesize, quiet=False):
     if bar and done:
         bar.finish()
 
+    if not interrupted and (not done or 0 <= remote_size != count):
+        raise IOError('Received %d bytes of %s, but %s were expected' %
+                      (count, remotefile,
+                       remote_size if remote_size >= 0 else 'more'))
+
     return count, elapsed
 
 
+def get_range(session, url, start, end):
+    "Get a request for bytes start to end-1 of the resolved URL"
+
+    headers = {"Range": 'bytes=%s-%s' % (start, end - 1)}
+    req = session.get(url, headers=headers, stream=True)
+
+    if req.status_code != 206:
+        req.close()
+        raise IOError('Range request failed with status %d' % req.status_code)
+
+    return req
+
+
+def download_file_ranged(file_id, outfile, filesize, nthreads, quiet=False):
+    """
+    Download file with the given file ID using concurrent range requests.
+
+    The confirmation token and the final URL are resolved only once, and
+    the byte ranges are then fetched over a pooled session and written
+    into the output file by offset. Falls back to download_file if
+    the server does not support range requests or if writing to stdout.
+    Raises IOError with the missing byte ranges if a range cannot be
+    downloaded, after removing the incomplete output file.
+    """
+    import os
+    import time
+    import threading
+
+    mega = 1048576
+    CHUNK_SIZE = 8 * mega
+    MAX_RETRIES = 10
+
+    if outfile == '-' or nthreads <= 1:
+        return download_file(file_id, outfile, filesize, quiet)
+
+    session = get_session(nthreads)
+    req = get_request(file_id, session=session)
+
+    if filesize <= 0 and 'Content-Length' in req.headers.keys():
+        filesize = int(req.headers['Content-Length'])
+
+    disposition = req.headers['Content-Disposition']
+    remotefile = disposition[21:disposition.find('"', 21)]
+    url = req.url
+    req.close()
+
+    # Probe whether the resolved URL supports range requests
+    try:
+        get_range(session, url, 0, 1).close()
+    except IOError:
+        filesize = -1
+
+    if filesize <= 0:
+        return download_file(file_id, outfile, filesize, quiet)
+
+    if not outfile:
+        outfile = remotefile
+
+    if not quiet:
+        sys.stderr.write('Downlading %s and saving into %s with %d connections ...\n' %
+                         (remotefile, outfile, nthreads))
+
+    # Preallocate the file so that ranges can be written by offset
+    with open(outfile, "wb") as fd:
+        fd.truncate(filesize)
+
+    # Use ranges large enough to amortize the requests but small enough
+    # to balance the load among the connections
+    rangesize = max(CHUNK_SIZE, min(8 * CHUNK_SIZE,
+                                    filesize // (4 * nthreads) + 1))
+    ranges = [(p, min(p + rangesize, filesize))
+              for p in range(0, filesize, rangesize)]
+    ranges.reverse()
+
+    if not quiet:
+        try:
+            from progressbar import ProgressBar
+
+            bar = ProgressBar(max_value=filesize)
+            bar.start()
+        except BaseException:
+            bar = None
+    else:
+        bar = None
+
+    lock = threading.Lock()
+    state = {'count': 0, 'failed': [], 'interrupted': False}
+
+    def worker():
+        fd = open(outfile, "r+b")
+        try:
+            while not state['failed'] and not state['interrupted']:
+                with lock:
+                    if not ranges:
+                        break
+                    pos, end = ranges.pop()
+
+                retries = 0
+                while pos < end:
+                    try:
+                        req = get_range(session, url, pos, end)
+                        fd.seek(pos)
+                        for chunk in req.iter_content(CHUNK_SIZE):
+                            if chunk:
+                                fd.write(chunk)
+                                pos += len(chunk)
+                                throttle(len(chunk))
+                                with lock:
+                                    state['count'] += len(chunk)
+                                    if bar is not None:
+                                        bar.update(state['count'])
+                            if state['interrupted']:
+                                return
+                    except BaseException:
+                        retries += 1
+                        if retries > MAX_RETRIES:
+                            with lock:
+                                state['failed'].append((pos, end))
+                            return
+                        time.sleep(min(0.1 * 2 ** retries, 10))
+        finally:
+            fd.close()
+
+    start = time.time()
+
+    threads = [threading.Thread(target=worker) for i in range(nthreads)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        state['interrupted'] = True
+        for t in threads:
+            t.join()
+
+    elapsed = time.time() - start
+    if bar and state['count'] == filesize:
+        bar.finish()
+
+    if state['failed']:
+        # The ranges not taken by any worker are missing as well
+        missing = sorted(state['failed'] + ranges)
+        os.remove(outfile)
+        raise IOError('Failed to download bytes %s of %s' %
+                      (', '.join('%d-%d' % (pos, end - 1)
+                                 for pos, end in missing), outfile))
+
+    return state['count'], elapsed
+
+
+def read_manifest(fname):
+    """
+    Read a manifest of file IDs with optional output names and sizes.
+    Returns a list of (file_id, outfile, filesize) tuples.
+    """
+
+    entries = []
+    with open(fname) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if ',' in line:
+                fields = [field.strip() for field in line.split(',')]
+            else:
+                fields = line.split()
+
+            file_id = fields[0]
+            outfile = fields[1] if len(fields) > 1 else ''
+            try:
+                filesize = int(fields[2])
+            except (IndexError, ValueError):
+                filesize = -1
+
+            entries.append((file_id, outfile, filesize))
+
+    return entries
+
+
+def download_batch(entries, nthreads, retries=5, quiet=False):
+    """
+    Download a list of (file_id, outfile, filesize) entries concurrently
+    over a shared connection pool. Files that already exist with the
+    expected size are skipped. Returns a dictionary with the summary.
+    """
+    import os
+    import time
+    import threading
+
+    nthreads = max(1, nthreads)
+    session = get_session(nthreads)
+
+    lock = threading.Lock()
+    pending = list(reversed(entries))
+    summary = {'downloaded': 0, 'skipped': 0, 'failed': [],
+               'bytes': 0, 'elapsed': 0}
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                file_id, outfile, filesize = pending.pop()
+
+            if outfile and filesize >= 0 and os.path.isfile(outfile) and \
+                    os.path.getsize(outfile) == filesize:
+                with lock:
+                    summary['skipped'] += 1
+                    if not quiet:
+                        sys.stderr.write('File %s is up to date.\n' % outfile)
+                continue
+
+            dirname = os.path.dirname(outfile)
+            if dirname and not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    pass
+
+            try:
+                sz, elapsed = download_file(file_id, outfile, filesize, True,
+                                            session, retries)
+                ok = filesize < 0 or sz == filesize
+            except BaseException:
+                sz, ok = 0, False
+
+            with lock:
+                summary['bytes'] += sz
+                if ok:
+                    summary['downloaded'] += 1
+                    if not quiet:
+                        sys.stderr.write('Downloaded %s (%s)\n' %
+                                         (outfile or file_id,
+                                          sizeof_fmt(sz, 'B')))
+                else:
+                    summary['failed'].append(file_id)
+                    if not quiet:
+                        sys.stderr.write('Failed to download %s\n' % file_id)
+
+    start = time.time()
+
+    threads = [threading.Thread(target=worker) for i in range(nthreads)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        with lock:
+            del pending[:]
+        sys.stderr.write('\nBatch download interrupted.\n')
+
+    summary['elapsed'] = time.time() - start
+
+    return summary
+
+
 def get_confirm_token(req):
     "Obtain confirmation token from req"
 
@@ -171,6 +535,61 @@ def get_confirm_token(req):
     return None
 
 
+def throttle(nbytes):
+    "Account for nbytes transferred with the gdutil bandwidth limiter"
+
+    if throttle.limiter is not None:
+        throttle.limiter(nbytes)
+
+
+# Set by configure_throttle if the gdutil bandwidth limiter is available
+throttle.limiter = None
+
+
+def configure_throttle(rate, priority, control_file):
+    "Configure the gdutil bandwidth limiter if available"
+
+    try:
+        import gd_throttle
+    except ImportError:
+        # gd_get_pub.py may be used as a standalone script
+        sys.stderr.write("Warning: Bandwidth limiting requires gd_throttle.py\n")
+        return
+
+    gd_throttle.configure(gd_throttle.parse_rate(rate or 0), priority,
+                          control_file)
+    throttle.limiter = gd_throttle.throttle
+
+
+def configure_profile(dump):
+    "Enable the gdutil profiler if available"
+
+    try:
+        import gd_profile
+    except ImportError:
+        # gd_get_pub.py may be used as a standalone script
+        sys.stderr.write("Warning: Profiling requires gd_profile.py\n")
+        return
+
+    gd_profile.enable(dump)
+    profile_phase.phase = gd_profile.phase
+
+
+@contextmanager
+def profile_phase(name):
+    "Attribute the time spent in the block to a phase if profiling"
+
+    if profile_phase.phase is None:
+        yield
+    else:
+        with profile_phase.phase(name):
+            yield
+
+
+# Set by configure_profile if the gdutil profiler is available
+profile_phase.phase = None
+
+
 def write_req_content(req, fd, start, bar):
     """ Write the content into outfile of stdout """
     import requests
@@ -185,6 +604,7 @@ def write_req_content(req, fd, start, bar):
             if chunk:  # filter out keep-alive new chunks
                 fd.write(chunk)
                 count += len(chunk)
+                throttle(len(chunk))
 
                 if bar is not None:
                     # Initial size was specified incorrectly
@@ -207,6 +627,34 @@ def write_req_content(req, fd, start, bar):
     return count, interrupted, done, bar
 
 
+def get_hostaddr():
+    "Get host address for printing, using the gdutil cache if available"
+    import socket
+
+    try:
+        from gd_cache import load_cached, save_cached
+    except ImportError:
+        # gd_get_pub.py may be used as a standalone script
+        load_cached = save_cached = None
+
+    key = 'hostaddr-' + socket.gethostname()
+    hostaddr = load_cached(key, 86400) if load_cached else None
+
+    if not hostaddr:
+        import requests
+
+        ip = requests.get('http://ip.42.pl/raw').text
+        try:
+            hostaddr = socket.gethostbyaddr(ip)[0]
+        except:
+            hostaddr = ip
+
+        if save_cached:
+            save_cached(key, hostaddr)
+
+    return hostaddr
+
+
 def sizeof_fmt(num, suffix='B/s'):
     for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
         if abs(num) < 1024.0:
@@ -281,7 +729,6 @@ def install_requests(verbose=False):
 
 if __name__ == "__main__":
     import os
-    import socket
     import shutil
 
     # Process command-line arguments
@@ -294,13 +741,37 @@ if __name__ == "__main__":
         tmpdir = install_requests(not args.quiet)
         import requests
 
-    try:
-        sz, elapsed = download_file(
-            args.file_id, args.outfile, args.size, args.quiet)
-    except BaseException:
-        sys.exit(-1)
+    if args.limit_rate or args.rate_file:
+        configure_throttle(args.limit_rate, args.priority, args.rate_file)
+
+    if args.profile or args.profile_dump:
+        configure_profile(args.profile_dump)
 
-    if not args.quiet and args.size > 0 and sz != args.size:
+    if args.manifest:
+        with profile_phase('transfer'):
+            summary = download_batch(read_manifest(args.manifest),
+                                     args.jobs, args.retries, args.quiet)
+        sz, elapsed = summary['bytes'], summary['elapsed']
+
+        if not args.quiet:
+            sys.stderr.write("Downloaded %d, skipped %d, failed %d files.\n" %
+                             (summary['downloaded'], summary['skipped'],
+                              len(summary['failed'])))
+            for file_id in summary['failed']:
+                sys.stderr.write("Failed: %s\n" % file_id)
+    else:
+        try:
+            with profile_phase('transfer'):
+                sz, elapsed = download_file_ranged(
+                    args.file_id, args.outfile, args.size, args.jobs,
+                    args.quiet)
+        except BaseException as e:
+            if str(e):
+                sys.stderr.write('\n%s\n' % e)
+            sys.exit(-1)
+
+    if not args.quiet and not args.manifest and \
+            args.size > 0 and sz != args.size:
         try:
             use_color = os.environ["LS_COLORS"] != ""
         except BaseException:
@@ -314,16 +785,15 @@ if __name__ == "__main__":
                              " bytes, but " + str(args.size) +
                              " was expected.")
 
-    ip = requests.get('http://ip.42.pl/raw').text
-    try:
-        hostaddr = socket.gethostbyaddr(ip)[0]
-    except:
-        hostaddr = ip
-
     if not args.quiet:
+        hostaddr = get_hostaddr()
+
         sys.stderr.write("Downloaded %s in %.1f seconds at %s to %s\n" %
                          (sizeof_fmt(sz, 'B'), elapsed,
                           sizeof_fmt(sz / elapsed), hostaddr))
 
     if tmpdir:
         shutil.rmtree(tmpdir)
+
+    if args.manifest and summary['failed']:
+        sys.exit(-1)
@@ -0,0 +1,223 @@
+"""
+Compute the MD5 checksums of local files in parallel.
+
+Checking whether thousands of existing files are up to date, or verifying
+them after a download, is dominated by hashing. The files are hashed by a
+pool of threads, since hashlib releases the GIL on large buffers, or of
+processes, with large reads into a reused buffer or with mmap. Reads ahead
+of the hasher are requested from the kernel up to the I/O depth, so that a
+parallel filesystem serves several blocks of a file at a time. Computed
+checksums are kept by the identity of the file, so that a file is not
+hashed twice while it is unchanged.
+"""
+
+import os
+import hashlib
+import threading
+
+# Size of the reads, which is a multiple of the page size
+BLOCKSIZE = 8 * 1024 * 1024
+
+# Number of blocks requested ahead of the hasher
+IO_DEPTH = 4
+
+
+def get_identity(fname):
+    "Get the identity of a local file, which changes when it is written"
+
+    st = os.stat(fname)
+
+    return (st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime),
+            st.st_dev, st.st_ino)
+
+
+def advise(fd, offset, length, advice):
+    "Give the kernel advice on the access of a range of a file, if supported"
+
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except (OSError, AttributeError):
+            pass
+
+
+def md5_file(fname, blocksize=BLOCKSIZE, depth=IO_DEPTH, use_mmap=False):
+    """
+    Compute the MD5 checksum of a local file, reading blocks of blocksize
+    bytes with depth blocks read ahead, or mapping the file with use_mmap.
+    Returns the hex digest and the number of bytes hashed.
+    """
+
+    md5 = hashlib.md5()
+    size = 0
+    with open(fname, 'rb') as f:
+        fd = f.fileno()
+        advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+        if use_mmap and os.fstat(fd).st_size > 0:
+            import mmap
+
+            m = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(m)
+                try:
+                    for offset in range(0, len(m), blocksize):
+                        advise(fd, offset + blocksize, depth * blocksize,
+                               'POSIX_FADV_WILLNEED')
+                        block = view[offset:offset + blocksize]
+                        try:
+                            md5.update(block)
+                        finally:
+                            block.release()
+                    size = len(m)
+                finally:
+                    # The map cannot be closed while it is exported, even
+                    # when a traceback still refers to a block
+                    view.release()
+            finally:
+                m.close()
+        else:
+            buf = bytearray(blocksize)
+            view = memoryview(buf)
+            while True:
+                advise(fd, size + blocksize, depth * blocksize,
+                       'POSIX_FADV_WILLNEED')
+                n = f.readinto(buf)
+                if not n:
+                    break
+                md5.update(view[:n])
+                size += n
+
+    return md5.hexdigest(), size
+
+
+def hash_task(task):
+    """
+    Hash a file in a worker of the pool. Returns the error instead on
+    errors, so that it is passed back from a process.
+    """
+
+    fname, blocksize, depth, use_mmap = task
+    try:
+        return md5_file(fname, blocksize, depth, use_mmap)
+    except (IOError, OSError, ValueError) as e:
+        return e
+
+
+class HashEngine(object):
+    """
+    Hash local files with jobs threads, or processes if processes is set.
+    The checksums are cached by the identity of the files.
+    """
+
+    def __init__(self, jobs=0, processes=False, blocksize=BLOCKSIZE,
+                 depth=IO_DEPTH, use_mmap=False):
+        import multiprocessing
+
+        self.jobs = jobs if jobs > 0 else multiprocessing.cpu_count()
+        self.processes = processes
+        self.blocksize = blocksize
+        self.depth = max(1, depth)
+        self.use_mmap = use_mmap
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.pool = None
+
+    def get_pool(self):
+        from multiprocessing.pool import Pool, ThreadPool
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = (Pool if self.processes else ThreadPool)(self.jobs)
+
+            return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def lookup(self, fname):
+        "Get the cached checksum of an unchanged file, or None"
+
+        try:
+            key = (os.path.abspath(fname), get_identity(fname))
+        except OSError:
+            return None
+
+        with self.lock:
+            return self.cache.get(key)
+
+    def hash_files(self, fnames, strict=False):
+        """
+        Hash the files in parallel. Returns a dictionary from the file names
+        to their checksums, which is None for the files that cannot be read,
+        or raises the error of the first such file if strict.
+        """
+        from gd_profile import count
+
+        results = {}
+        pending = []
+        for fname in fnames:
+            md5 = self.lookup(fname)
+            if md5 is not None:
+                results[fname] = md5
+            elif fname not in pending:
+                pending.append(fname)
+
+        if not pending:
+            return results
+
+        # Get the identities before hashing, so that a file modified while
+        # it is hashed is not cached as unchanged
+        identities = {}
+        for fname in pending:
+            try:
+                identities[fname] = get_identity(fname)
+            except OSError:
+                if strict:
+                    raise
+                results[fname] = None
+
+        pending = [fname for fname in pending if fname in identities]
+        tasks = [(fname, self.blocksize, self.depth, self.use_mmap)
+                 for fname in pending]
+        if len(tasks) == 1:
+            hashed = [hash_task(tasks[0])]
+        else:
+            hashed = self.get_pool().map(hash_task, tasks, chunksize=1)
+
+        for fname, result in zip(pending, hashed):
+            if isinstance(result, Exception):
+                if strict:
+                    raise result
+                results[fname] = None
+                continue
+
+            md5, size = result
+            results[fname] = md5
+            count('bytes hashed', size)
+            with self.lock:
+                self.cache[(os.path.abspath(fname), identities[fname])] = md5
+
+        return results
+
+    def hash_file(self, fname):
+        """
+        Hash a file in the calling thread, or get its cached checksum.
+        Raises IOError or OSError if the file cannot be read.
+        """
+
+        return self.hash_files([fname], strict=True)[fname]
+
+
+# The hash engine of this process
+engine = HashEngine()
+
+
+def configure(jobs=0, processes=False, depth=IO_DEPTH, use_mmap=False):
+    "Configure the hash engine of this process"
+    global engine
+
+    engine.close()
+    engine = HashEngine(jobs, processes, depth=depth, use_mmap=use_mmap)
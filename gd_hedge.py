@@ -0,0 +1,213 @@
+"""
+Hedge slow Range requests to cut the tail latency of downloads.
+
+The time per byte of recent Range requests is tracked for the process.
+When a request takes much longer than the recent 95th percentile, a
+duplicate request for the same range is sent on a new connection. The
+first response wins, and the connection of the other request is shut
+down. The number of hedged requests is capped to a small fraction of all
+requests, so that hedging does not use up the quota.
+"""
+
+import socket
+import threading
+import time
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Maximum fraction of the requests that are hedged
+MAX_FRACTION = 0.05
+
+# A request is hedged after FACTOR times the 95th percentile of the recent
+# time per byte, but not before MIN_DELAY seconds
+FACTOR = 3.0
+MIN_DELAY = 1.0
+
+# Number of recent requests that are tracked, and needed before hedging
+WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class LatencyTracker(object):
+    "Track the time per byte of recent requests and the hedging budget"
+
+    def __init__(self, fraction=MAX_FRACTION):
+        self.fraction = fraction
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def record(self, elapsed, nbytes):
+        "Record a successful request of nbytes that took elapsed seconds"
+
+        with self.lock:
+            self.samples.append(elapsed / max(nbytes, 1))
+
+    def deadline(self, nbytes):
+        """
+        Seconds after which a request of nbytes is hedged, or None if there
+        are not enough samples yet
+        """
+
+        with self.lock:
+            self.requests += 1
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+
+        return max(MIN_DELAY, FACTOR * p95 * nbytes)
+
+    def allow(self):
+        "Take a hedge from the budget if it is not used up"
+
+        with self.lock:
+            if self.hedges + 1 > self.fraction * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def won(self):
+        "Count a hedge that finished before the original request"
+
+        with self.lock:
+            self.wins += 1
+
+
+def get_range_size(headers):
+    "Number of bytes in the Range header, or 0 if there is none"
+
+    try:
+        start, end = headers['Range'][len('bytes='):].split('-')
+        return int(end) - int(start) + 1
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def abandon(http):
+    """
+    Shut down the connections of an HTTP object, so that a request in
+    progress in another thread fails quickly
+    """
+
+    for conn in list(getattr(http, 'connections', {}).values()):
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+
+
+class HedgedHttp(object):
+    """
+    An HTTP object that hedges slow Range requests. new_http creates the
+    HTTP object of a hedge. If the hedge wins, its HTTP object replaces the
+    one of the original request, which is abandoned. Other requests are
+    passed through.
+    """
+
+    def __init__(self, http, new_http, tracker):
+        self.http = http
+        self.new_http = new_http
+        self.tracker = tracker
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        import gd_transport
+
+        nbytes = get_range_size(headers)
+        if method != 'GET' or not nbytes:
+            return self.http.request(uri, method, headers=headers, **kwargs)
+
+        start = time.time()
+        deadline = self.tracker.deadline(nbytes)
+        if deadline is None:
+            resp, content = self.http.request(uri, method, headers=headers,
+                                              **kwargs)
+            if resp.status == 206:
+                self.tracker.record(time.time() - start, len(content))
+            return resp, content
+
+        results = queue.Queue()
+
+        def send(http, charge):
+            try:
+                results.put((http, http.request(uri, method, headers=headers,
+                                                **kwargs), None))
+            except Exception as e:
+                results.put((http, None, e))
+            finally:
+                if charge:
+                    gd_transport.budget.release(charge)
+
+        def start_thread(http, charge=0):
+            t = threading.Thread(target=send, args=(http, charge))
+            t.daemon = True
+            t.start()
+
+        start_thread(self.http)
+        try:
+            result = results.get(timeout=deadline)
+            pending = []
+        except queue.Empty:
+            pending = [self.http]
+
+            # A hedge holds another copy of the block, so it is only sent
+            # if it fits into the memory budget. It is counted only then.
+            if gd_transport.budget.acquire(nbytes, block=False):
+                if self.tracker.allow():
+                    pending.append(self.new_http())
+                    start_thread(pending[-1], nbytes)
+                else:
+                    gd_transport.budget.release(nbytes)
+
+            # Take the first successful response, or the last error
+            while True:
+                result = results.get()
+                pending.remove(result[0])
+                if result[2] is None and result[1][0].status < 400 or \
+                        not pending:
+                    break
+
+        http, response, error = result
+        for other in pending:
+            abandon(other)
+
+        if http is not self.http:
+            self.tracker.won()
+            self.http = http
+
+        if error is not None:
+            raise error
+
+        if response[0].status == 206:
+            self.tracker.record(time.time() - start, len(response[1]))
+
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+# The tracker shared by all threads of this process, or None if hedging is
+# disabled. Hedging is off unless it is configured, such as by gd-get, so
+# that other users of gd_get.get_http get plain HTTP objects.
+tracker = None
+
+
+def configure(fraction=MAX_FRACTION):
+    """
+    Enable hedging with the maximum fraction of hedged requests, where 0
+    disables hedging
+    """
+
+    global tracker
+
+    tracker = LatencyTracker(fraction) if fraction > 0 else None
@@ -6,6 +6,8 @@ List file names, their IDs and sizes in Google Drive
 
 from __future__ import print_function
 
+from gd_profile import phase, profiled
+
 
 def parse_args(description):
     "Parse command-line arguments"
@@ -72,6 +74,32 @@ def parse_args(description):
                         default=False,
                         action='store_true')
 
+    parser.add_argument('-m', '--manifest',
+                        help='Write a manifest of the listed files with their ' +
+                        'id, path, size, md5, downloadUrl and modifiedDate, ' +
+                        'which can be consumed by gd-get -m. Use -m - for ' +
+                        'writing to stdout instead of the listing.',
+                        default="")
+
+    parser.add_argument('-f', '--format',
+                        help='Format of the manifest. The default is csv if ' +
+                        'the manifest file name ends with .csv, and ndjson ' +
+                        'otherwise.',
+                        choices=['ndjson', 'csv'],
+                        default="")
+
+    parser.add_argument('--profile',
+                        help='Report the wall and CPU time of each phase ' +
+                        'and the numbers of requests.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--profile-dump',
+                        help='Also profile the run into the given file, in ' +
+                        'collapsed stacks for flame graphs if its name ends ' +
+                        'with .folded, and in pstats format otherwise.',
+                        default="")
+
     parser.add_argument('-i', '--id', dest='ids',
                         nargs='+',
                         help='List of file or folder IDs.')
@@ -169,7 +197,7 @@ def list_files(drive, parent_id, ids=None, patterns=None, parent='',
     import pydrive
     import fnmatch
     import sys
-    import googleapiclient
+    import googleapiclient.errors
 
     if ls is None:
         ls = {}
@@ -234,6 +262,24 @@ def list_files(drive, parent_id, ids=None, patterns=None, parent='',
     return ls
 
 
+def sort_files(ls, args):
+    """
+    Sort the listing of list_files by name, size, extension or modification
+    time, according to the sort options in args
+    """
+
+    if args.sort_by_name:
+        return sorted(ls.values(), key=lambda item: item['name'])
+    elif args.sort_by_size:
+        return sorted(ls.values(), reverse=True,
+                      key=lambda item: item['fileSize'])
+    elif args.sort_by_extension:
+        return sorted(ls.values(), key=lambda item: item['fileExtension'])
+    else:
+        return sorted(ls.values(), reverse=True,
+                      key=lambda item: item['modifiedDate'])
+
+
 def sizeof_fmt(num, suffix=''):
     for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
         if abs(num) < 1024.0:
@@ -242,6 +288,16 @@ def sizeof_fmt(num, suffix=''):
     return "%.1f%s%s" % (num, 'Y', suffix)
 
 
+@profiled('print')
+def print_entry(value, args, writer=None):
+    "Print a file or folder and write it into the manifest if specified"
+
+    if writer is not None:
+        writer.write(value)
+    if not args.quiet and args.manifest != '-':
+        print_file(value, args)
+
+
 def print_file(value, args):
     "Print a file or folder"
 
@@ -287,13 +343,20 @@ def print_file(value, args):
 
 if __name__ == "__main__":
     import sys
-    from pydrive.drive import GoogleDrive
     from gd_auth import authenticate
 
     args = parse_args(__doc__)
 
+    if args.profile or args.profile_dump:
+        import gd_profile
+
+        gd_profile.enable(args.profile_dump)
+
+    from pydrive.drive import GoogleDrive
+
     # Athenticate
-    gauth = authenticate(args.config)
+    with phase('authenticate'):
+        gauth = authenticate(args.config)
 
     # Create drive object
     drive = GoogleDrive(gauth)
@@ -303,31 +366,34 @@ if __name__ == "__main__":
     else:
         metadata = ('modifiedDate', 'editable', 'fileExtension')
 
+    if args.manifest:
+        from gd_manifest import ManifestWriter
+
+        writer = ManifestWriter(args.manifest, args.format)
+    else:
+        writer = None
+
     # List files
     if args.unsorted:
-        ls = list_files(drive, parent_id=args.parent,
-                        ids=args.ids, patterns=args.patterns,
-                        metadata=metadata, recursive=args.recursive,
-                        callback=print_file, callback_args=(args, ))
+        with phase('list_files'):
+            ls = list_files(drive, parent_id=args.parent,
+                            ids=args.ids, patterns=args.patterns,
+                            metadata=metadata, recursive=args.recursive,
+                            callback=print_entry, callback_args=(args, writer))
     else:
-        ls = list_files(drive, parent_id=args.parent,
-                        ids=args.ids, patterns=args.patterns,
-                        metadata=metadata, recursive=args.recursive)
-
-        if args.sort_by_name:
-            files = sorted(ls.values(), key=lambda item: item['name'])
-        elif args.sort_by_size:
-            files = sorted(ls.values(), reverse=True,
-                           key=lambda item: item['fileSize'])
-        elif args.sort_by_extension:
-            files = sorted(ls.values(),
-                           key=lambda item: item['fileExtension'])
-        else:
-            files = sorted(ls.values(), reverse=True,
-                           key=lambda item: item['modifiedDate'])
+        with phase('list_files'):
+            ls = list_files(drive, parent_id=args.parent,
+                            ids=args.ids, patterns=args.patterns,
+                            metadata=metadata, recursive=args.recursive)
+
+        with phase('sort'):
+            files = sort_files(ls, args)
 
         for f in files:
-            print_file(f, args)
+            print_entry(f, args, writer)
+
+    if writer is not None:
+        writer.close()
 
     if not ls and args.patterns and not args.quiet:
         if args.use_color:
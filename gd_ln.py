@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+Link files and folders in Google Drive into another folder, so that they
+appear in both folders without being copied.
+"""
+
+import sys
+from gd_mutate import add_arguments, connect, resolve_paths, find_sources, \
+    is_folder
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    add_arguments(parser)
+
+    parser.add_argument('paths', metavar='PATH',
+                        nargs='+',
+                        help='List of paths relative to the parent folder, ' +
+                        'which may contain Unix filename patterns, ' +
+                        'followed by the target folder.')
+
+    args = parser.parse_args()
+    if len(args.paths) < 2:
+        parser.error('the target folder is missing')
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    drive, mutator = connect(args)
+    files = drive.auth.service.files()
+
+    target = args.paths[-1].strip('/')
+    found = resolve_paths(drive, args.parent, args.paths)
+    sources = find_sources(found, args.paths[:-1])
+
+    if target not in found or not is_folder(found[target]):
+        sys.stderr.write('Target %s is not a folder\n' % target)
+        sys.exit(-1)
+    folder = found[target]
+
+    ops = []
+    for value in sources:
+        parents = [parent['id']
+                   for parent in value['fileobj'].get('parents', [])]
+        if folder['id'] in parents:
+            continue
+
+        ops.append((value['name'], files.patch(fileId=value['id'], body={},
+                                               addParents=folder['id'],
+                                               fields='id')))
+
+    results = mutator.run(ops)
+    mutator.report('Linked', len(results), len(ops))
+
+    if len(results) < len(ops):
+        sys.exit(-1)
@@ -0,0 +1,124 @@
+"""
+Read and write manifests of files listed in Google Drive.
+
+A manifest records the id, path, size, md5, downloadUrl and modifiedDate
+of each file in NDJSON or CSV format, so that a listing obtained once by
+gd-ls can be consumed by gd-get without listing the files again.
+"""
+
+import sys
+
+FIELDS = ('id', 'path', 'size', 'md5', 'downloadUrl', 'modifiedDate')
+
+
+def get_format(fname, fmt=''):
+    "Determine the manifest format from fmt or the file name extension"
+
+    if fmt:
+        return fmt.lower()
+    elif fname.lower().endswith('.csv'):
+        return 'csv'
+    else:
+        return 'ndjson'
+
+
+def manifest_entry(value):
+    "Convert a value in the listing of list_files into a manifest entry"
+
+    fileobj = value['fileobj']
+
+    def get(field):
+        try:
+            return fileobj[field]
+        except KeyError:
+            return ''
+
+    return {'id': value['id'],
+            'path': value['name'],
+            'size': value['fileSize'],
+            'md5': get('md5Checksum'),
+            'downloadUrl': get('downloadUrl'),
+            'modifiedDate': get('modifiedDate')}
+
+
+def listing_value(entry):
+    """
+    Convert a manifest entry into a value in the format of list_files,
+    which can be passed to gd_get.download_file.
+    """
+
+    size = int(entry['size']) if entry['size'] != '' else -1
+
+    fileobj = {'id': entry['id'],
+               'title': entry['path'].split('/')[-1],
+               'md5Checksum': entry['md5'],
+               'downloadUrl': entry['downloadUrl'],
+               'modifiedDate': entry['modifiedDate']}
+    if size >= 0:
+        fileobj['fileSize'] = str(size)
+
+    return {'id': entry['id'],
+            'name': entry['path'],
+            'fileSize': size,
+            'alias': None,
+            'fileobj': fileobj}
+
+
+class ManifestWriter(object):
+    """
+    Write the values in the listing of list_files into a manifest file.
+    Use '-' as the file name for writing to stdout.
+    """
+
+    def __init__(self, fname, fmt=''):
+        self.fmt = get_format(fname, fmt)
+        if fname == '-':
+            self.f = sys.stdout
+        else:
+            self.f = open(fname, 'w')
+
+        if self.fmt == 'csv':
+            import csv
+
+            self.writer = csv.DictWriter(self.f, fieldnames=FIELDS,
+                                         lineterminator='\n')
+            self.writer.writeheader()
+
+    def write(self, value):
+        "Write a value in the listing of list_files"
+        import json
+
+        entry = manifest_entry(value)
+        if self.fmt == 'csv':
+            self.writer.writerow(entry)
+        else:
+            self.f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def close(self):
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+def read_manifest(fname):
+    """
+    Read a manifest in NDJSON or CSV format and return the list of values
+    in the format of list_files. Use '-' as the file name for stdin.
+    """
+    import json
+    import csv
+
+    if fname == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(fname) as f:
+            lines = f.readlines()
+
+    lines = [line for line in lines if line.strip()]
+    if lines and lines[0].lstrip().startswith('{'):
+        entries = [json.loads(line) for line in lines]
+    else:
+        entries = list(csv.DictReader(lines))
+
+    return [listing_value(entry) for entry in entries]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+Create folders in Google Drive.
+"""
+
+import sys
+from gd_mutate import add_arguments, connect, resolve_paths
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    add_arguments(parser)
+
+    parser.add_argument('-P', '--parents',
+                        help='Create missing parent folders as needed, and ' +
+                        'do not complain about existing folders.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('paths', metavar='PATH',
+                        nargs='+',
+                        help='List of folder paths relative to the parent ' +
+                        'folder.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    drive, mutator = connect(args)
+
+    found = resolve_paths(drive, args.parent, args.paths)
+    existed = [path for path in args.paths if path.strip('/') in found]
+
+    created = mutator.make_folders(args.paths, found, args.parents)
+    mutator.report('Created', len(created), len(created), 'folders')
+
+    if any(path.strip('/') not in found for path in args.paths) or \
+            existed and not args.parents:
+        sys.exit(-1)
@@ -0,0 +1,334 @@
+"""
+Apply metadata mutations, such as moving, linking, trashing or creating
+files and folders, in bulk.
+
+Operations are coalesced into batch requests of up to BATCH_SIZE calls,
+and independent batches are sent concurrently under a quota limiter that
+is shared with other processes on the same host. Calls that fail with a
+rate-limit or server error are retried in later batches with exponential
+backoff. Paths are resolved with a single pass of list_files.
+"""
+
+import os
+import sys
+import fnmatch
+import threading
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Maximum number of calls in a batch request recommended for Drive
+BATCH_SIZE = 100
+
+# Default number of API calls per second, shared by the processes on the
+# same host
+QUOTA_RATE = 100
+
+BATCH_URI = 'https://www.googleapis.com/batch/drive/v2'
+
+
+def is_retryable(error):
+    "Check whether an error of an API call is worth retrying"
+
+    resp = getattr(error, 'resp', None)
+    if resp is None:
+        return False
+
+    status = int(resp.status)
+    if status == 403:
+        content = getattr(error, 'content', b'')
+        if not isinstance(content, str):
+            content = content.decode('utf-8', 'replace')
+        return content.find('RateLimitExceeded') >= 0 or \
+            content.find('rateLimitExceeded') >= 0
+
+    return status == 429 or status >= 500
+
+
+def new_batch(service, callback):
+    "Create a batch request for the service"
+
+    if hasattr(service, 'new_batch_http_request'):
+        return service.new_batch_http_request(callback=callback)
+
+    from googleapiclient.http import BatchHttpRequest
+
+    return BatchHttpRequest(callback=callback, batch_uri=BATCH_URI)
+
+
+def match_path(name, pattern):
+    "Check whether a path matches a pattern of Unix filename patterns"
+
+    names = name.split('/')
+    patterns = pattern.strip('/').split('/')
+
+    return len(names) == len(patterns) and \
+        all(fnmatch.fnmatch(n, p) for n, p in zip(names, patterns))
+
+
+def get_ancestors(path):
+    "Get the ancestor paths of a path, from the top"
+
+    dirs = path.strip('/').split('/')
+
+    return ['/'.join(dirs[:i]) for i in range(1, len(dirs))]
+
+
+def resolve_paths(drive, parent_id, paths):
+    """
+    Resolve paths relative to the parent folder, which may contain Unix
+    filename patterns, with one pass of list_files. Returns a dictionary
+    from the paths of the matched files and folders and of their ancestor
+    folders to their values in the listing. The parent folder has the
+    path ''.
+    """
+    from gd_list import list_files
+
+    patterns = []
+    for path in paths:
+        for pattern in get_ancestors(path) + [path.strip('/')]:
+            if pattern and pattern not in patterns:
+                patterns.append(pattern)
+
+    found = {'': {'id': parent_id, 'name': '', 'fileSize': -1,
+                  'alias': None, 'fileobj': {'mimeType': FOLDER_MIME}}}
+    if patterns:
+        ls = list_files(drive, parent_id=parent_id, patterns=patterns)
+        for value in ls.values():
+            found[value['name']] = value
+            if value['alias']:
+                found[value['alias']] = value
+
+    return found
+
+
+def is_folder(value):
+    "Check whether a value in the listing of list_files is a folder"
+
+    return value['fileobj'].get('mimeType') == FOLDER_MIME
+
+
+class Mutator(object):
+    """
+    A bulk mutation engine. Operations are pairs of a key and an
+    unexecuted API request, such as service.files().trash(fileId=id).
+    run executes them in batches with jobs concurrent batches, limited to
+    rate calls per second.
+    """
+
+    def __init__(self, auth, jobs=4, rate=QUOTA_RATE, retries=5,
+                 batch_size=BATCH_SIZE, quiet=False):
+        import atexit
+        from gd_cache import get_cache_dir
+        from gd_throttle import BandwidthLimiter
+
+        self.auth = auth
+        self.jobs = max(1, jobs)
+        self.retries = retries
+        self.batch_size = max(1, min(batch_size, BATCH_SIZE))
+        self.quiet = quiet
+        self.limiter = BandwidthLimiter(rate,
+                                        registry_dir=get_cache_dir('quota'))
+        atexit.register(self.limiter.close)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.batches = 0
+
+    def run_batch(self, task, results, retry):
+        "Execute a batch of operations and sort out their results"
+        from gd_get import get_http
+
+        ops = task['ops']
+        errors = {}
+
+        def callback(request_id, response, exception):
+            key = ops[int(request_id)][0]
+            if exception is None:
+                results[key] = response
+            else:
+                errors[int(request_id)] = exception
+
+        batch = new_batch(self.auth.service, callback)
+        for i, (key, request) in enumerate(ops):
+            batch.add(request, request_id=str(i))
+
+        self.limiter.consume(len(ops))
+        with self.lock:
+            self.calls += len(ops)
+            self.batches += 1
+
+        try:
+            batch.execute(http=get_http(self.auth))
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            errors = dict((i, e) for i in range(len(ops)))
+
+        for i, error in errors.items():
+            if is_retryable(error):
+                with self.lock:
+                    retry.append(ops[i])
+            else:
+                sys.stderr.write('Failed to update %s: %s\n' %
+                                 (ops[i][0], error))
+
+        return len(ops)
+
+    def run(self, ops):
+        """
+        Execute the operations and return a dictionary from their keys to
+        the responses of the successful ones.
+        """
+        import time
+        from gd_plan import run_tasks
+
+        results = {}
+        backoff = 0.5
+        for attempt in range(self.retries + 1):
+            if not ops:
+                break
+            elif attempt > 0:
+                if not self.quiet:
+                    sys.stderr.write('Retrying %d operations in %.1f seconds\n' %
+                                     (len(ops), backoff))
+                time.sleep(backoff)
+                backoff *= 2
+
+            tasks = [{'file': {'name': 'batch of %s' % ops[i][0]},
+                      'ops': ops[i:i + self.batch_size]}
+                     for i in range(0, len(ops), self.batch_size)]
+            retry = []
+            run_tasks(tasks, min(self.jobs, len(tasks)), self.run_batch,
+                      (results, retry))
+            ops = retry
+
+        for key, request in ops:
+            sys.stderr.write('Failed to update %s: rate limit exceeded\n' % key)
+
+        return results
+
+    def make_folders(self, paths, found, parents=False):
+        """
+        Create the folders with the given paths, where found is a
+        dictionary from paths to values in the listing, such as returned
+        by resolve_paths, which is used as the cache of the IDs of folders.
+        With parents, missing parent folders are created first, in the
+        order of depth. Returns the paths of the created folders.
+        """
+        service = self.auth.service
+
+        # Check the folders and find the missing ones
+        missing = set()
+        for path in paths:
+            path = path.strip('/')
+            if path in found:
+                if not parents:
+                    sys.stderr.write('Cannot create %s: File exists\n' % path)
+                continue
+
+            ancestors = get_ancestors(path)
+            absent = [p for p in ancestors if p not in found]
+            if absent and not parents:
+                sys.stderr.write('Cannot create %s: No such folder %s\n' %
+                                 (path, absent[0]))
+                continue
+            elif any(p in found and not is_folder(found[p])
+                     for p in ancestors):
+                sys.stderr.write('Cannot create %s: Not a folder\n' % path)
+                continue
+
+            missing.update(absent + [path])
+
+        created = []
+        depth = 0
+        while missing:
+            level = sorted(p for p in missing if p.count('/') == depth)
+            ops = []
+            for path in level:
+                dirname = os.path.dirname(path)
+                if dirname not in found:
+                    # The parent failed to be created
+                    continue
+                body = {'title': os.path.basename(path),
+                        'mimeType': FOLDER_MIME,
+                        'parents': [{'id': found[dirname]['id']}]}
+                ops.append((path, service.files().insert(body=body,
+                                                         fields='id')))
+
+            for path, folder in self.run(ops).items():
+                found[path] = {'id': folder['id'], 'name': path,
+                               'fileSize': -1, 'alias': None,
+                               'fileobj': {'mimeType': FOLDER_MIME}}
+                created.append(path)
+
+            missing.difference_update(level)
+            depth += 1
+
+        return created
+
+    def report(self, verb, done, total, noun='files'):
+        "Write a summary of the operations to stderr"
+
+        if not self.quiet:
+            sys.stderr.write('%s %d of %d %s with %d calls in %d batches\n' %
+                             (verb, done, total, noun, self.calls,
+                              self.batches))
+
+
+def add_arguments(parser):
+    "Add the command-line arguments common to the mutation commands"
+
+    parser.add_argument('-p', '--parent',
+                        help='ID of parent folder in Google Drive, relative ' +
+                        'to which the paths are resolved',
+                        default="root")
+
+    parser.add_argument('-j', '--jobs',
+                        help='Number of batch requests to send ' +
+                        'concurrently. The default is 4.',
+                        type=int,
+                        default=4)
+
+    parser.add_argument('-L', '--limit-rate',
+                        help='Limit the number of API calls per second, ' +
+                        'shared with other processes on the same host. ' +
+                        'The default is %d.' % QUOTA_RATE,
+                        type=float,
+                        default=QUOTA_RATE)
+
+    parser.add_argument('-c', '--config',
+                        help='Configuration directory containing the ' +
+                        ' credential. The default is ~/.config/gdutil/.',
+                        default="")
+
+    parser.add_argument('-q', '--quiet',
+                        help='Suppress information messages.',
+                        default=False,
+                        action='store_true')
+
+
+def connect(args):
+    "Authenticate and create the drive object and the mutation engine"
+    from gd_auth import authenticate
+    from pydrive.drive import GoogleDrive
+
+    gauth = authenticate(args.config)
+
+    return GoogleDrive(gauth), Mutator(gauth, args.jobs, args.limit_rate,
+                                       quiet=args.quiet)
+
+
+def find_sources(found, patterns):
+    "Get the values of the files and folders matching the patterns"
+
+    sources = {}
+    for value in found.values():
+        if value['name'] and value['id'] not in sources and \
+                any(match_path(value['name'], pattern) for pattern in patterns):
+            sources[value['id']] = value
+    sources = sorted(sources.values(), key=lambda value: value['name'])
+
+    for pattern in patterns:
+        if not any(match_path(value['name'], pattern) for value in sources):
+            sys.stderr.write('Not found %s\n' % pattern)
+
+    return sources
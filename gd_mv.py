@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Move or rename files and folders in Google Drive.
+"""
+
+import os
+import sys
+from gd_mutate import add_arguments, connect, resolve_paths, find_sources, \
+    is_folder
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    add_arguments(parser)
+
+    parser.add_argument('paths', metavar='PATH',
+                        nargs='+',
+                        help='List of paths relative to the parent folder, ' +
+                        'which may contain Unix filename patterns, ' +
+                        'followed by the target. If the target is a ' +
+                        'folder, the files are moved into it. Otherwise, ' +
+                        'a single file is moved to the target path.')
+
+    args = parser.parse_args()
+    if len(args.paths) < 2:
+        parser.error('the target is missing')
+
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    drive, mutator = connect(args)
+    files = drive.auth.service.files()
+
+    target = args.paths[-1].strip('/')
+    found = resolve_paths(drive, args.parent, args.paths)
+    sources = find_sources(found, args.paths[:-1])
+
+    if target in found and is_folder(found[target]):
+        # Move into the target folder
+        folder = found[target]
+        title = None
+    elif len(sources) == 1 and os.path.dirname(target) in found and \
+            is_folder(found[os.path.dirname(target)]):
+        # Move to the target path
+        folder = found[os.path.dirname(target)]
+        title = os.path.basename(target)
+    else:
+        sys.stderr.write('Target %s is not a folder\n' % target)
+        sys.exit(-1)
+
+    ops = []
+    for value in sources:
+        if value['id'] == folder['id'] or \
+                (target + '/').startswith(value['name'] + '/'):
+            sys.stderr.write('Cannot move %s into itself\n' % value['name'])
+            continue
+
+        parent = found[os.path.dirname(value['name'])]
+        kwargs = {'fileId': value['id'], 'fields': 'id',
+                  'body': {'title': title} if title else {}}
+        if parent['id'] != folder['id']:
+            kwargs['addParents'] = folder['id']
+            kwargs['removeParents'] = parent['id']
+        ops.append((value['name'], files.patch(**kwargs)))
+
+    results = mutator.run(ops)
+    mutator.report('Moved', len(results), len(ops))
+
+    if len(results) < len(ops):
+        sys.exit(-1)
@@ -0,0 +1,200 @@
+"""
+Plan and run the transfer of a list of files with concurrent workers.
+
+Files are transferred largest first, so that no large file starts last
+and leaves the other workers idle at the end. Files that are too large
+to be balanced among the workers are split into range tasks, and small
+files fill the remaining capacity of the workers. The tasks can also be
+partitioned deterministically among several nodes.
+"""
+
+import sys
+import threading
+
+# Throughput per worker in bytes per second, if it was never measured
+DEFAULT_THROUGHPUT = 10 * 1048576
+THROUGHPUT_TTL = 30 * 86400
+
+# Latency of starting a task in seconds
+TASK_OVERHEAD = 0.2
+
+
+def make_tasks(files, nworkers, chunksize, split_size=0, splittable=None):
+    """
+    Create the tasks for a list of values in the listing of list_files.
+
+    Each task is a dictionary with the file, the byte range [start, end)
+    and whether it covers the whole file. Files larger than split_size
+    are split into ranges of split_size bytes, rounded up to a multiple
+    of chunksize. If split_size is 0, it is chosen so that no task is
+    larger than half of the average load of a worker. Files for which
+    splittable returns False, if given, are never split. Folders are skipped.
+    """
+
+    files = [file1 for file1 in files if file1['fileSize'] >= 0]
+
+    if not split_size and nworkers > 1:
+        total = sum(file1['fileSize'] for file1 in files)
+        split_size = max(4 * chunksize, total // (2 * nworkers))
+    if split_size:
+        split_size = (split_size + chunksize - 1) // chunksize * chunksize
+
+    tasks = []
+    for file1 in files:
+        fileSize = file1['fileSize']
+        if not split_size or fileSize <= split_size or \
+                splittable and not splittable(file1):
+            tasks.append({'file': file1, 'start': 0, 'end': fileSize,
+                          'whole': True})
+        else:
+            for start in range(0, fileSize, split_size):
+                tasks.append({'file': file1, 'start': start,
+                              'end': min(start + split_size, fileSize),
+                              'whole': False})
+
+    return tasks
+
+
+def order_tasks(tasks):
+    "Order the tasks largest first"
+
+    return sorted(tasks, reverse=True,
+                  key=lambda task: task['end'] - task['start'])
+
+
+def estimate_makespan(tasks, nworkers, throughput, overhead=TASK_OVERHEAD):
+    """
+    Estimate the completion time in seconds of running the tasks in order,
+    with each task going to the first idle worker.
+    """
+    import heapq
+
+    workers = [0.0] * max(1, nworkers)
+    for task in tasks:
+        finish = heapq.heappop(workers)
+        heapq.heappush(workers, finish + overhead +
+                       float(task['end'] - task['start']) / throughput)
+
+    return max(workers)
+
+
+def shard_tasks(tasks, shard_index, shard_count):
+    """
+    Select the tasks of a shard among shard_count shards, such as the
+    nodes of a cluster transferring the same files. The tasks are assigned
+    largest first to the shard with the least load, with ties broken by
+    the ID of the file, the start of the range and the index of the shard,
+    so that every shard computes the same partition from the same list.
+    """
+    import heapq
+
+    tasks = sorted(tasks, key=lambda task: (task['start'] - task['end'],
+                                            task['file']['id'],
+                                            task['start']))
+    shards = [(0, i) for i in range(shard_count)]
+    selected = []
+    for task in tasks:
+        load, i = heapq.heappop(shards)
+        if i == shard_index:
+            selected.append(task)
+
+        # Count every task as at least one byte to spread empty files
+        heapq.heappush(shards, (load + max(1, task['end'] - task['start']),
+                                i))
+
+    return selected
+
+
+def plan_transfers(files, nworkers, chunksize, split_size=0, throughput=0,
+                   splittable=None, shard_index=0, shard_count=1):
+    """
+    Plan the transfer of files with nworkers workers. Returns the ordered
+    list of tasks and the estimated completion time in seconds, based on
+    the throughput per worker measured in previous runs. If shard_count
+    is greater than 1, the files are split for shard_count * nworkers
+    workers, and only the tasks of the shard shard_index are returned.
+    """
+
+    if not throughput:
+        throughput = load_throughput()
+
+    tasks = make_tasks(files, nworkers * max(1, shard_count), chunksize,
+                       split_size, splittable)
+    if shard_count > 1:
+        tasks = shard_tasks(tasks, shard_index, shard_count)
+    tasks = order_tasks(tasks)
+
+    return tasks, estimate_makespan(tasks, nworkers, throughput)
+
+
+def load_throughput():
+    "Load the throughput per worker measured on this host"
+    import socket
+    from gd_cache import load_cached
+
+    throughput = load_cached('throughput-' + socket.gethostname(),
+                             THROUGHPUT_TTL)
+
+    return throughput or DEFAULT_THROUGHPUT
+
+
+def save_throughput(throughput):
+    "Save the throughput per worker measured on this host"
+    import socket
+    from gd_cache import save_cached
+
+    if throughput > 0:
+        save_cached('throughput-' + socket.gethostname(), throughput)
+
+
+def run_tasks(tasks, nworkers, func, args=()):
+    """
+    Run func(task, *args) for the tasks in order with nworkers threads,
+    where func returns the number of bytes transferred. Returns the total
+    number of bytes and the throughput per worker in bytes per second.
+    """
+    import time
+
+    lock = threading.Lock()
+    pending = list(reversed(tasks))
+    stats = {'bytes': 0, 'busy': 0.0}
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                task = pending.pop()
+
+            start = time.time()
+            try:
+                nbytes = func(task, *args) or 0
+            except Exception as e:
+                sys.stderr.write('Failed to transfer %s: %s\n' %
+                                 (task['file']['name'], e))
+                nbytes = 0
+
+            with lock:
+                stats['bytes'] += nbytes
+                stats['busy'] += time.time() - start
+
+    threads = [threading.Thread(target=worker) for i in range(nworkers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        with lock:
+            del pending[:]
+        raise
+
+    if stats['busy'] > 0:
+        throughput = stats['bytes'] / stats['busy']
+    else:
+        throughput = 0
+
+    return stats['bytes'], throughput
@@ -0,0 +1,179 @@
+"""
+Spread transfers among several credentials to scale beyond the rate limits
+of a single user.
+
+Each credential, for example of several users with access to the same
+shared folder, is tracked separately: the requests it made recently, its
+number of active tasks, and whether it was rate limited or failed. New
+tasks go to the healthy credential with the least load, and a credential
+that hits "Rate Limit Exceeded" cools down before it gets new tasks.
+"""
+
+import sys
+import time
+import threading
+
+# Window in seconds for counting recent requests of a credential
+RATE_WINDOW = 60.0
+
+# Cool-down in seconds after a rate-limit error, doubled on each repeat
+COOLDOWN = 1.0
+MAX_COOLDOWN = 64.0
+
+# Consecutive errors after which a credential is unhealthy, and seconds
+# after which an unhealthy credential is tried again
+MAX_ERRORS = 3
+HEALTH_RETRY = 300.0
+
+
+class CredentialState(object):
+    "The load and health of a credential"
+
+    def __init__(self, auth, name):
+        self.auth = auth
+        self.name = name
+        self.lock = threading.Lock()
+        self.active = 0
+        self.requests = 0
+        self.recent = []
+        self.rate_limited = 0
+        self.limited_until = 0
+        self.cooldown = COOLDOWN
+        self.errors = 0
+        self.unhealthy_since = 0
+
+    def record(self, status, reason=''):
+        "Record the response status of a request made with the credential"
+
+        now = time.time()
+        with self.lock:
+            self.requests += 1
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - RATE_WINDOW:
+                self.recent.pop(0)
+
+            if status == 429 or status == 403 and \
+                    (reason.find('Rate Limit Exceeded') >= 0 or
+                     reason.find('Too Many Requests') >= 0):
+                self.rate_limited += 1
+                self.limited_until = now + self.cooldown
+                self.cooldown = min(2 * self.cooldown, MAX_COOLDOWN)
+            elif status == 401 or status == 403 or status >= 500:
+                self.errors += 1
+                if self.errors >= MAX_ERRORS and not self.unhealthy_since:
+                    self.unhealthy_since = now
+                    sys.stderr.write('Credential %s is unhealthy.\n' %
+                                     self.name)
+            elif status < 400:
+                self.errors = 0
+                self.unhealthy_since = 0
+                self.cooldown = COOLDOWN
+
+    def available(self, now):
+        "Check whether the credential can take new tasks"
+
+        if self.unhealthy_since:
+            return now - self.unhealthy_since > HEALTH_RETRY
+
+        return now >= self.limited_until
+
+    def load(self):
+        "The load of the credential for choosing among credentials"
+
+        return (self.active, len(self.recent))
+
+
+class TrackedHttp(object):
+    "An HTTP object that records the responses for a credential"
+
+    def __init__(self, http, state):
+        self.http = http
+        self.state = state
+
+    def request(self, *args, **kwargs):
+        resp, content = self.http.request(*args, **kwargs)
+        self.state.record(resp.status, resp.reason or '')
+
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+class CredentialPool(object):
+    """
+    A pool of authenticated credentials, such as returned by authenticate.
+    Use acquire to get the credential for a task and release it when done.
+    """
+
+    def __init__(self, auths, names=None):
+        if not names:
+            names = [str(i) for i in range(len(auths))]
+
+        self.states = [CredentialState(auth, name)
+                       for auth, name in zip(auths, names)]
+        self.lock = threading.Lock()
+
+        for state in self.states:
+            # Used by gd_get.get_http to track the responses
+            state.auth.tracker = state
+
+    def __len__(self):
+        return len(self.states)
+
+    def check_health(self):
+        """
+        Check each credential with a cheap API call and mark the failing
+        ones as unhealthy. Returns the number of healthy credentials.
+        """
+        from gd_get import get_http
+
+        healthy = 0
+        for state in self.states:
+            try:
+                state.auth.service.about().get().execute(
+                    http=get_http(state.auth))
+                healthy += 1
+            except Exception as e:
+                state.unhealthy_since = time.time()
+                sys.stderr.write('Credential %s failed the health check: %s\n' %
+                                 (state.name, e))
+
+        return healthy
+
+    def acquire(self):
+        """
+        Get the least loaded available credential, waiting if all of them
+        are cooling down after rate-limit errors.
+        """
+
+        while True:
+            now = time.time()
+            with self.lock:
+                available = [state for state in self.states
+                             if state.available(now)]
+                if available:
+                    state = min(available, key=CredentialState.load)
+                    state.active += 1
+                    return state.auth
+
+                limited = [state.limited_until for state in self.states
+                           if not state.unhealthy_since]
+
+            if not limited:
+                raise IOError('None of the credentials is healthy')
+            time.sleep(max(0.01, min(min(limited) - now, MAX_COOLDOWN)))
+
+    def release(self, auth):
+        "Return a credential obtained by acquire"
+
+        with self.lock:
+            auth.tracker.active -= 1
+
+    def report(self):
+        "Write a summary of the requests of each credential to stderr"
+
+        for state in self.states:
+            sys.stderr.write('Credential %s: %d requests, %d rate limited%s\n' %
+                             (state.name, state.requests, state.rate_limited,
+                              ', unhealthy' if state.unhealthy_since else ''))
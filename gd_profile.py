@@ -0,0 +1,262 @@
+"""
+Profile the phases of a command, such as authenticating, listing,
+checking checksums, transferring and verifying files.
+
+The wall and CPU time spent in each phase are measured per thread, and
+nested phases are excluded from the time of the enclosing phase. The
+HTTP requests made with httplib2 or requests are counted by kind, along
+with the bytes transferred and hashed. Optionally, the whole run is
+profiled with cProfile and dumped in pstats format, or sampled into
+collapsed stacks for flame graphs.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Seconds between samples of the stacks of all threads
+SAMPLE_INTERVAL = 0.005
+
+if hasattr(time, 'thread_time'):
+    cpu_time = time.thread_time
+elif hasattr(time, 'clock'):
+    # Process time, which includes all threads
+    cpu_time = time.clock
+else:
+    cpu_time = time.process_time
+
+
+def get_request_kind(uri, headers):
+    "Classify an HTTP request for counting"
+
+    if headers and ('Range' in headers or 'range' in headers) or \
+            uri.find('alt=media') >= 0 or uri.find('export=download') >= 0:
+        return 'download requests'
+    elif uri.find('oauth2') >= 0 or uri.find('/token') >= 0:
+        return 'auth requests'
+    else:
+        return 'API calls'
+
+
+class Profiler(object):
+    "Accumulate the time of phases and counters of events"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.start = time.time()
+
+    def charge(self, name, since, now, calls=0):
+        with self.lock:
+            stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += calls
+            stats[1] += now[0] - since[0]
+            stats[2] += now[1] - since[1]
+
+    def enter(self, name):
+        "Enter a phase, pausing the enclosing phase of this thread"
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        now = (time.time(), cpu_time())
+        if stack:
+            self.charge(stack[-1][0], stack[-1][1], now)
+        stack.append([name, now])
+
+    def exit(self):
+        "Exit the current phase, resuming the enclosing phase"
+
+        stack = self.local.stack
+        name, since = stack.pop()
+        now = (time.time(), cpu_time())
+        self.charge(name, since, now, 1)
+        if stack:
+            stack[-1][1] = now
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self, f=sys.stderr):
+        "Write the time of the phases and the counters"
+
+        f.write('%-16s %8s %10s %10s\n' % ('Phase', 'Calls', 'Wall (s)',
+                                           'CPU (s)'))
+        for name, (calls, wall, cpu) in self.phases.items():
+            f.write('%-16s %8d %10.3f %10.3f\n' % (name, calls, wall, cpu))
+        f.write('Elapsed %.3f seconds. The time of concurrent phases is '
+                'summed over threads.\n' % (time.time() - self.start))
+
+        for name, n in self.counters.items():
+            f.write('%s: %d\n' % (name.capitalize(), n))
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the stacks of all threads periodically and count the collapsed
+    stacks, which are written in the input format of flamegraph.pl
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        me = threading.current_thread().ident
+        while not self.stopped.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name,
+                                                 code.co_filename,
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'Thread'))
+
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def dump(self, fname):
+        self.stopped.set()
+        self.join()
+
+        with open(fname, 'w') as f:
+            for stack, n in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, n))
+
+
+def instrument_http(profiler):
+    "Count the requests made with httplib2 and requests"
+
+    try:
+        import httplib2
+
+        request = httplib2.Http.request
+
+        def counted_request(self, uri, method='GET', body=None,
+                            headers=None, *args, **kwargs):
+            resp, content = request(self, uri, method, body, headers,
+                                    *args, **kwargs)
+            kind = get_request_kind(uri, headers)
+            profiler.count(kind)
+            if kind == 'download requests' and content:
+                profiler.count('bytes transferred', len(content))
+            return resp, content
+
+        httplib2.Http.request = counted_request
+    except ImportError:
+        pass
+
+    try:
+        import requests
+
+        send = requests.Session.send
+        iter_content = requests.Response.iter_content
+
+        def counted_send(self, request, **kwargs):
+            profiler.count(get_request_kind(request.url, request.headers))
+            return send(self, request, **kwargs)
+
+        def counted_iter_content(self, *args, **kwargs):
+            for chunk in iter_content(self, *args, **kwargs):
+                profiler.count('bytes transferred', len(chunk))
+                yield chunk
+
+        requests.Session.send = counted_send
+        requests.Response.iter_content = counted_iter_content
+    except ImportError:
+        pass
+
+
+# The profiler of this process, or None if profiling is disabled
+profiler = None
+
+
+def enable(dump=''):
+    """
+    Enable profiling and report at exit. If dump is given, the run is also
+    profiled and dumped into it: in collapsed stacks of all threads if it
+    ends with .folded, and otherwise in pstats format with cProfile, which
+    profiles only the main thread. Must be called before authenticating,
+    so that all HTTP requests are counted.
+    """
+    import atexit
+
+    global profiler
+
+    profiler = Profiler()
+    instrument_http(profiler)
+
+    if dump.endswith('.folded'):
+        sampler = StackSampler()
+        sampler.start()
+        finish = lambda: sampler.dump(dump)
+    elif dump:
+        import cProfile
+
+        prof = cProfile.Profile()
+        prof.enable()
+
+        def finish():
+            prof.disable()
+            prof.dump_stats(dump)
+    else:
+        finish = None
+
+    def report():
+        if finish is not None:
+            finish()
+        profiler.report()
+
+    atexit.register(report)
+
+
+def profiled(name):
+    "Decorator attributing the time spent in a function to a phase"
+    import functools
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def phase(name):
+    "Attribute the time spent in the block to a phase"
+
+    if profiler is None:
+        yield
+        return
+
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+
+def count(name, n=1):
+    "Count n events, such as bytes hashed"
+
+    if profiler is not None:
+        profiler.count(name, n)
@@ -0,0 +1,686 @@
+#!/usr/bin/env python
+
+"""
+Upload a list of files to Google Drive.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from gd_auth import authenticate, get_config_dir
+from gd_throttle import throttle
+
+UPLOAD_URI = 'https://www.googleapis.com/upload/drive/v2/files'
+
+# Size of the chunks sent in a resumable upload, which must be a multiple
+# of 256 KB
+CHUNKSIZE = 8 * 1024 * 1024
+CHUNK_ALIGN = 256 * 1024
+
+# Seconds for which a resumable session is kept. Drive expires the
+# sessions after a week.
+SESSION_TTL = 6 * 86400
+
+# Number of consecutive failed requests before an upload is given up
+MAX_RETRIES = 10
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-p', '--parent',
+                        help='ID of parent folder in Google Drive',
+                        default="root")
+
+    parser.add_argument('-d', '--localdir',
+                        help='Local directory relative to which the file ' +
+                        'names are given. The default is current directory.',
+                        default="")
+
+    parser.add_argument('-R', '--resume',
+                        help='Resume the interrupted uploads of the files ' +
+                        'from the offsets confirmed by Google Drive.',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-j', '--jobs',
+                        help='Number of files to upload concurrently. ' +
+                        'The default is 4.',
+                        type=int,
+                        default=4)
+
+    parser.add_argument('--chunk-size',
+                        help='Size of the chunks of the resumable uploads, ' +
+                        'e.g. 32M, rounded to a multiple of 256K. An ' +
+                        'interrupted upload is resumed from the last ' +
+                        'complete chunk. The default is 8M.',
+                        default=CHUNKSIZE)
+
+    parser.add_argument('-o', '--outfile',
+                        help='Name of the file in Google Drive when ' +
+                        'uploading from stdin with the file name -, e.g. ' +
+                        'tar c data | gd-put -o data.tar -. It may contain ' +
+                        'a relative path.',
+                        default="")
+
+    parser.add_argument('-c', '--config',
+                        help='Configuration directory containing the ' +
+                        ' credential. The default is ~/.config/gdutil/.',
+                        default="")
+
+    parser.add_argument('-n', '--no-chksum',
+                        help='Do not check the chksum of the file. Default is to check.',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-q', '--quiet',
+                        help='Suppress information and error messages.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('files', metavar='FILENAME',
+                        nargs='+',
+                        help='List of local files to be uploaded. Their ' +
+                        'relative paths are preserved in Google Drive.')
+
+    args = parser.parse_args()
+
+    if args.localdir and args.localdir[-1] != '/':
+        args.localdir = args.localdir + '/'
+    if args.jobs < 1:
+        args.jobs = 1
+    if '-' in args.files and (len(args.files) > 1 or not args.outfile):
+        parser.error('Uploading from stdin requires -o and no other files')
+
+    from gd_throttle import parse_rate
+
+    args.chunk_size = max(CHUNK_ALIGN, int(parse_rate(args.chunk_size)) //
+                          CHUNK_ALIGN * CHUNK_ALIGN)
+
+    return args
+
+
+class UploadError(IOError):
+    "A resumable upload failed"
+
+    # Whether the request is worth retrying
+    retryable = False
+
+
+def get_identity(fname):
+    "Get the size, modification time and inode of a local file"
+
+    st = os.stat(fname)
+
+    return {'size': st.st_size, 'mtime': st.st_mtime,
+            'device': st.st_dev, 'inode': st.st_ino}
+
+
+class UploadJournal(object):
+    """
+    Persist the sessions of resumable uploads in the uploads subdirectory
+    of the configuration directory, one JSON file per upload, so that an
+    interrupted upload can be resumed by another process. A session records
+    its URI, the offset confirmed by Google Drive and the identity of the
+    local file, and is discarded if the file changed.
+    """
+
+    def __init__(self, conf_dir=''):
+        self.dir = get_config_dir(conf_dir) + '/uploads'
+        if not os.path.isdir(self.dir):
+            try:
+                os.makedirs(self.dir, 0o700)
+            except OSError:
+                # Created by another process
+                pass
+
+    def get_fname(self, key):
+        return self.dir + '/' + \
+            hashlib.md5(key.encode('utf-8')).hexdigest() + '.json'
+
+    def load(self, key, identity):
+        "Load the valid session of an upload, or None"
+        import time
+
+        try:
+            with open(self.get_fname(key)) as f:
+                session = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if session.get('key') != key or \
+                session.get('identity') != identity or \
+                time.time() - session.get('saved', 0) > SESSION_TTL:
+            return None
+
+        return session
+
+    def save(self, key, session):
+        "Save a session atomically"
+        import time
+
+        session['key'] = key
+        session['saved'] = time.time()
+
+        fname = self.get_fname(key)
+        tmpfile = '%s.%d.%d' % (fname, os.getpid(),
+                                threading.current_thread().ident)
+        with open(tmpfile, 'w') as f:
+            json.dump(session, f)
+        getattr(os, 'replace', os.rename)(tmpfile, fname)
+
+    def remove(self, key):
+        try:
+            os.remove(self.get_fname(key))
+        except OSError:
+            pass
+
+
+def get_upload_http(auth):
+    """
+    Get an authorized HTTP object of the current thread for uploading. It
+    is not wrapped like the HTTP objects of get_http, since Drive answers
+    an incomplete upload with 308, which httplib2 must not follow as a
+    redirect.
+    """
+    import httplib2
+
+    https = getattr(get_upload_http.local, 'https', None)
+    if https is None:
+        https = get_upload_http.local.https = {}
+
+    if id(auth) not in https:
+        http = httplib2.Http()
+        if 308 in getattr(http, 'redirect_codes', ()):
+            http.redirect_codes = http.redirect_codes - set([308])
+        https[id(auth)] = auth.credentials.authorize(http)
+
+    return https[id(auth)]
+
+
+get_upload_http.local = threading.local()
+
+
+def start_session(http, body, size, file_id=None):
+    """
+    Start a resumable upload of size bytes and return the session URI. The
+    file with file_id is updated if given, and otherwise a file is created
+    with the metadata in body.
+    """
+
+    headers = {'Content-Type': 'application/json; charset=UTF-8',
+               'X-Upload-Content-Type': body.get('mimeType',
+                                                 'application/octet-stream')}
+    if size is not None:
+        headers['X-Upload-Content-Length'] = str(size)
+
+    if file_id:
+        uri, method = UPLOAD_URI + '/' + file_id, 'PUT'
+    else:
+        uri, method = UPLOAD_URI, 'POST'
+
+    resp, content = http.request(uri + '?uploadType=resumable', method,
+                                 body=json.dumps(body), headers=headers)
+    if resp.status != 200 or 'location' not in resp:
+        raise UploadError('cannot start the upload: %s %s' %
+                          (resp.status, resp.reason))
+
+    return resp['location']
+
+
+def parse_offset(resp):
+    "Get the offset confirmed by a 308 response of a resumable upload"
+
+    # The Range header is 'bytes=0-<last byte>', and missing if no bytes
+    # were received
+    if 'range' not in resp:
+        return 0
+
+    return int(resp['range'].split('-')[-1]) + 1
+
+
+def send_request(http, uri, body, content_range):
+    """
+    Send a chunk or a status query of a resumable upload. Returns the
+    confirmed offset and the metadata of the file if the upload completed,
+    or raises UploadError.
+    """
+
+    headers = {'Content-Length': str(len(body)),
+               'Content-Range': content_range}
+    resp, content = http.request(uri, 'PUT', body=body, headers=headers)
+
+    if resp.status == 308:
+        return parse_offset(resp), None
+    elif resp.status in (200, 201):
+        if not isinstance(content, str):
+            content = content.decode('utf-8')
+        file1 = json.loads(content)
+        return int(file1.get('fileSize', 0)), file1
+    elif resp.status in (404, 410):
+        raise UploadError('the upload session expired')
+
+    error = UploadError('error %s %s' % (resp.status, resp.reason))
+    error.retryable = resp.status == 429 or resp.status >= 500
+
+    raise error
+
+
+class FileChunks(object):
+    "The chunks of a seekable file of a known size"
+
+    def __init__(self, f, size, chunksize):
+        self.f = f
+        self.size = size
+        self.chunksize = chunksize
+
+    def get(self, offset):
+        """
+        Get the chunk starting at the confirmed offset and its Content-Range
+        """
+
+        self.f.seek(offset)
+        data = self.f.read(min(self.chunksize, self.size - offset))
+        if data:
+            return data, 'bytes %d-%d/%d' % (offset, offset + len(data) - 1,
+                                             self.size)
+
+        return data, 'bytes */%d' % self.size
+
+    def query(self):
+        "Get the Content-Range of a status query"
+
+        return 'bytes */%d' % self.size
+
+
+class StreamChunks(object):
+    """
+    The chunks of a stream of unknown size, such as stdin. The bytes are
+    kept in a buffer of one chunk until they are confirmed by the server,
+    so that a failed chunk can be sent again without seeking.
+    """
+
+    def __init__(self, f, chunksize):
+        self.f = f
+        self.chunksize = chunksize
+        self.buffer = bytearray()
+        self.start = 0
+        self.size = None
+
+    def get(self, offset):
+        if not self.start <= offset <= self.start + len(self.buffer):
+            raise UploadError('the server confirmed an unexpected offset %d' %
+                              offset)
+
+        # Drop the confirmed bytes and read the rest of the chunk
+        del self.buffer[:offset - self.start]
+        self.start = offset
+        while self.size is None and len(self.buffer) < self.chunksize:
+            data = self.f.read(self.chunksize - len(self.buffer))
+            if not data:
+                self.size = self.start + len(self.buffer)
+            self.buffer += data
+
+        data = bytes(self.buffer)
+        total = '*' if self.size is None else str(self.size)
+        if data:
+            return data, 'bytes %d-%d/%s' % (offset, offset + len(data) - 1,
+                                             total)
+
+        return data, 'bytes */' + total
+
+    def query(self):
+        return 'bytes */' + ('*' if self.size is None else str(self.size))
+
+
+def query_offset(http, uri, chunks):
+    "Query the offset confirmed by Google Drive for a resumable upload"
+
+    return send_request(http, uri, b'', chunks.query())
+
+
+def upload_chunks(http, uri, chunks, offset, md5=None, callback=None):
+    """
+    Upload the chunks of a FileChunks or StreamChunks into the session,
+    starting from the confirmed offset. md5 is updated with the confirmed
+    bytes, and callback(offset) is called after each chunk. Failed requests
+    are retried with exponential backoff from the offset queried from the
+    server. Returns the metadata of the uploaded file.
+    """
+    import time
+    import socket
+    import httplib2
+
+    # The bytes sent in the last request, starting at offset
+    data = b''
+    file1 = None
+    failures = 0
+    backoff = 1
+    while True:
+        try:
+            if failures:
+                # The server may have kept some of the bytes of the failed
+                # request, or all of them if only the response was lost
+                confirmed, file1 = query_offset(http, uri, chunks)
+            else:
+                data, content_range = chunks.get(offset)
+                throttle(len(data))
+                confirmed, file1 = send_request(http, uri, data,
+                                                content_range)
+        except (UploadError, socket.error, httplib2.HttpLib2Error) as e:
+            if not getattr(e, 'retryable', True) or failures >= MAX_RETRIES:
+                raise
+            sys.stderr.write('Upload failed: %s. Retrying in %d seconds.\n' %
+                             (e, backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 64)
+            failures += 1
+            continue
+
+        # The server may confirm fewer bytes than sent, and a completed
+        # upload confirms all of them
+        if file1 is not None:
+            confirmed = offset + len(data)
+        if not offset <= confirmed <= offset + len(data):
+            raise UploadError('the server confirmed an unexpected offset %d' %
+                              confirmed)
+
+        # Hash the confirmed bytes, including those confirmed by a query
+        if md5 is not None:
+            md5.update(data[:confirmed - offset])
+        data = data[confirmed - offset:]
+        offset = confirmed
+        failures = 0
+        backoff = 1
+
+        if callback is not None:
+            callback(offset)
+        if file1 is not None:
+            return file1
+
+
+def upload_file(task, auth, args, journal):
+    """
+    Upload a local file with a resumable upload, whose session is kept in
+    the journal until the upload completes. With args.resume, an upload
+    of the same file into the same folder is resumed from the offset
+    confirmed by Google Drive. Returns the number of bytes uploaded.
+    """
+    import time
+    from gd_get import sizeof_fmt, md5chksum
+
+    file1 = task['file']
+    fname = args.localdir + file1['name']
+    identity = get_identity(fname)
+    size = identity['size']
+    key = '%s %s %s' % (os.path.abspath(fname), file1['parent'],
+                        file1['title'])
+    http = get_upload_http(auth)
+    show_bar = not args.quiet and args.jobs <= 1
+
+    offset = 0
+    uploaded = None
+    session = journal.load(key, identity) if args.resume else None
+    if session is not None:
+        try:
+            offset, uploaded = query_offset(http, session['uri'],
+                                            FileChunks(None, size, 0))
+        except UploadError:
+            # Start over if the session expired
+            session = None
+
+    if session is None:
+        body = {'title': file1['title'], 'parents': [{'id': file1['parent']}]}
+        session = {'uri': start_session(http, body, size, file1['id']),
+                   'offset': 0, 'identity': identity}
+        journal.save(key, session)
+
+    if not args.quiet:
+        if offset > 0:
+            sys.stderr.write("Resume uploading file %s from %s ...\n" %
+                             (file1['name'], sizeof_fmt(offset, 'B')))
+        else:
+            sys.stderr.write("Uploading file %s ...\n" % file1['name'])
+        sys.stderr.flush()
+
+    if show_bar:
+        from progress import ResumableBar
+
+        bar = ResumableBar(maxval=size, initial_value=offset)
+        bar.start()
+
+    def record(confirmed):
+        session['offset'] = confirmed
+        journal.save(key, session)
+        if show_bar:
+            bar.update(confirmed)
+
+    # Hash the file while uploading it, unless only the rest of the file
+    # is uploaded
+    md5 = hashlib.md5() if offset == 0 and not args.no_chksum else None
+
+    start = time.time()
+    pstart = offset
+    try:
+        with open(fname, 'rb') as f:
+            if uploaded is None:
+                chunks = FileChunks(f, size, args.chunk_size)
+                uploaded = upload_chunks(http, session['uri'], chunks,
+                                         offset, md5, record)
+    except KeyboardInterrupt:
+        sys.stderr.write(
+            "\nUpload interrupted. You can resume it using the -R option.\n")
+        raise
+    elapsed = time.time() - start
+
+    if show_bar:
+        bar.finish()
+    journal.remove(key)
+
+    if not args.quiet:
+        sys.stderr.write("Uploaded %s in %.1f seconds at %s\n" %
+                         (sizeof_fmt(size - pstart, 'B'), elapsed,
+                          sizeof_fmt((size - pstart) / max(elapsed, 1e-6))))
+
+    # Check the checksum of the uploaded file for integrity
+    if not args.no_chksum:
+        if md5 is not None:
+            md5 = md5.hexdigest()
+        else:
+            md5 = md5chksum(fname, 'verify')
+
+        if md5 != uploaded.get('md5Checksum'):
+            raise UploadError('checksum of the uploaded file does not ' +
+                              'match. The file might have been changed ' +
+                              'during the upload.')
+
+    return size - pstart
+
+
+def upload_fileobj(f, auth, title, parent_id='root', file_id=None,
+                   chunksize=CHUNKSIZE, callback=None):
+    """
+    Upload a file-like object of unknown size, such as stdin or a pipe,
+    into a file in the parent folder, or into the file with file_id if
+    given. Only one chunk is held in memory, and the MD5 checksum is
+    computed on the fly and compared with the checksum reported by Google
+    Drive. callback(offset) is called after each chunk. Returns the
+    metadata of the uploaded file, or raises UploadError.
+    """
+
+    http = get_upload_http(auth)
+    body = {'title': title, 'parents': [{'id': parent_id}]}
+    uri = start_session(http, body, None, file_id)
+
+    md5 = hashlib.md5()
+    file1 = upload_chunks(http, uri, StreamChunks(f, chunksize), 0, md5,
+                          callback)
+    if md5.hexdigest() != file1.get('md5Checksum'):
+        raise UploadError('checksum of the uploaded stream does not match')
+
+    return file1
+
+
+def upload_stream(task, auth, args):
+    """
+    Upload stdin into the file of the task. A stream cannot be resumed
+    after the process exits. Returns the number of bytes uploaded.
+    """
+    import time
+    from gd_get import sizeof_fmt
+
+    file1 = task['file']
+    if sys.version_info[0] > 2:
+        f = sys.stdin.buffer
+    else:
+        f = sys.stdin
+        if sys.platform in ["win32", "win64"]:
+            import msvcrt
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+
+    if not args.quiet:
+        sys.stderr.write("Uploading stdin to %s ...\n" % file1['name'])
+        sys.stderr.flush()
+
+    def report(offset):
+        if not args.quiet:
+            sys.stderr.write('\rUploaded %s' % sizeof_fmt(offset, 'B'))
+
+    start = time.time()
+    try:
+        uploaded = upload_fileobj(f, auth, file1['title'], file1['parent'],
+                                  file1['id'], args.chunk_size, report)
+    except KeyboardInterrupt:
+        sys.stderr.write("\nUpload interrupted.\n")
+        raise
+    elapsed = time.time() - start
+
+    size = int(uploaded.get('fileSize', 0))
+    if not args.quiet:
+        sys.stderr.write("\rUploaded %s in %.1f seconds at %s\n" %
+                         (sizeof_fmt(size, 'B'), elapsed,
+                          sizeof_fmt(size / max(elapsed, 1e-6))))
+
+    return size
+
+
+def plan_uploads(drive, mutator, parent_id, names):
+    """
+    Resolve the folders in Google Drive into which the local files with
+    the given relative paths are uploaded, creating missing folders, and
+    find the files that are overwritten. Returns the tasks for upload_file.
+    """
+    from gd_mutate import resolve_paths, is_folder
+
+    names = [os.path.normpath(name).lstrip('/') for name in names]
+    found = resolve_paths(drive, parent_id, names)
+
+    dirnames = set(os.path.dirname(name) for name in names)
+    mutator.make_folders([d for d in dirnames if d and d not in found],
+                         found, parents=True)
+
+    tasks = []
+    for name in names:
+        dirname = os.path.dirname(name)
+        if dirname not in found or not is_folder(found[dirname]):
+            sys.stderr.write('Cannot upload %s: No such folder %s\n' %
+                             (name, dirname))
+            continue
+
+        existing = found.get(name)
+        if existing is not None and is_folder(existing):
+            sys.stderr.write('Cannot upload %s: Is a folder\n' % name)
+            continue
+
+        tasks.append({'file': {'name': name,
+                               'title': os.path.basename(name),
+                               'parent': found[dirname]['id'],
+                               'id': existing and existing['id']}})
+
+    return tasks
+
+
+def upload_files(tasks, auth, args):
+    """
+    Upload the files with args.jobs concurrent workers. Returns the number
+    of bytes uploaded, the elapsed time and the tasks that failed.
+    """
+    import time
+    from gd_plan import run_tasks
+    from gd_get import sizeof_fmt
+
+    journal = UploadJournal(args.config)
+    failed = []
+
+    def upload(task):
+        "Upload the file of a task, and record it if it fails"
+
+        try:
+            return upload_file(task, auth, args, journal)
+        except Exception as e:
+            sys.stderr.write('Failed to upload %s: %s\n' %
+                             (task['file']['name'], e))
+            failed.append(task)
+            return 0
+
+    start = time.time()
+    if args.jobs > 1:
+        nbytes = run_tasks(tasks, min(args.jobs, len(tasks)), upload)[0]
+    else:
+        nbytes = sum(upload(task) for task in tasks)
+    elapsed = time.time() - start
+
+    if not args.quiet and len(tasks) > 1 and elapsed > 0:
+        sys.stderr.write("Uploaded %s in %.1f seconds at %s\n" %
+                         (sizeof_fmt(nbytes, 'B'), elapsed,
+                          sizeof_fmt(nbytes / elapsed)))
+
+    return nbytes, elapsed, failed
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    from pydrive.drive import GoogleDrive
+    from gd_mutate import Mutator
+
+    # Athenticate
+    gauth = authenticate(args.config)
+
+    for name in args.files:
+        if name != '-' and not os.path.isfile(args.localdir + name):
+            sys.stderr.write('Cannot upload %s: No such file\n' % name)
+            sys.exit(-1)
+
+    if args.files == ['-']:
+        tasks = plan_uploads(GoogleDrive(gauth), Mutator(gauth, quiet=True),
+                             args.parent, [args.outfile])
+    else:
+        tasks = plan_uploads(GoogleDrive(gauth), Mutator(gauth, quiet=True),
+                             args.parent, args.files)
+
+    try:
+        if args.files == ['-']:
+            # Stream stdin without a temporary file
+            for task in tasks:
+                upload_stream(task, gauth, args)
+        else:
+            failed = upload_files(tasks, gauth, args)[2]
+            if failed:
+                sys.stderr.write('Failed to upload %d of %d files\n' %
+                                 (len(failed), len(tasks)))
+                sys.exit(-1)
+    except KeyboardInterrupt:
+        sys.exit(-1)
+    except UploadError as e:
+        sys.stderr.write('Failed to upload: %s\n' % e)
+        sys.exit(-1)
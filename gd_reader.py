@@ -0,0 +1,264 @@
+"""
+Random-access reading of files in Google Drive.
+
+open_file returns a seekable, read-only file-like object over a file in
+Google Drive, which fetches aligned blocks of the file with Range requests
+and keeps them in a bounded LRU cache. Sequential reads fetch several
+blocks ahead in one request. This allows readers of formats such as
+Parquet, HDF5 or Zarr to read the parts of a large file they need without
+downloading all of it. For example,
+
+    from gd_auth import authenticate
+    from gd_reader import open_file
+
+    f = open_file(authenticate(''), file_id)
+    f.seek(-8, 2)
+    footer = f.read(8)
+
+download_into downloads a file, or a byte range of it, directly into a
+caller-provided buffer, such as a NumPy array, with concurrent requests.
+"""
+
+import io
+from collections import OrderedDict
+
+BLOCK_SIZE = 4 * 1048576
+CACHE_BLOCKS = 32
+READAHEAD = 8
+
+
+def get_metadata(auth, file_id):
+    "Fetch the metadata of a file in Google Drive"
+    from gd_get import get_http
+
+    return auth.service.files().get(fileId=file_id).execute(
+        http=get_http(auth))
+
+
+class DriveFile(io.RawIOBase):
+    """
+    A seekable, read-only file-like object over a file in Google Drive,
+    given the authentication and the metadata of the file, which must
+    contain fileSize and downloadUrl. It is not thread-safe.
+
+    Blocks of blocksize bytes are cached in an LRU cache of at most
+    cache_blocks blocks. Sequential reads fetch up to readahead blocks
+    per request. The numbers of requests and fetched bytes are counted
+    in the attributes requests and fetched.
+    """
+
+    def __init__(self, auth, fileobj, blocksize=BLOCK_SIZE,
+                 cache_blocks=CACHE_BLOCKS, readahead=READAHEAD):
+        io.RawIOBase.__init__(self)
+
+        self.auth = auth
+        self.name = fileobj.get('title', fileobj.get('id', ''))
+        self.size = int(fileobj['fileSize'])
+        self.url = fileobj['downloadUrl']
+        self.blocksize = blocksize
+        self.cache_blocks = max(1, cache_blocks)
+        self.readahead = max(1, min(readahead, self.cache_blocks))
+
+        self.cache = OrderedDict()
+        self.pos = 0
+        self.last_end = -1
+        self.window = 1
+
+        self.requests = 0
+        self.fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence %s' % whence)
+
+        if pos < 0:
+            raise ValueError('Negative seek position %d' % pos)
+        self.pos = pos
+
+        return self.pos
+
+    def fetch(self, first, last):
+        "Fetch blocks first to last in one Range request and cache them"
+        from gd_get import get_http, get_next_block
+        from gd_throttle import throttle
+        import gd_transport
+
+        start = first * self.blocksize
+        end = min((last + 1) * self.blocksize, self.size)
+        headers = {"Range": 'bytes=%s-%s' % (start, end - 1)}
+
+        throttle(end - start)
+        with gd_transport.budget.reserve(end - start):
+            status, content, backoff = get_next_block(
+                get_http(self.auth), self.url, headers, self.size,
+                self.blocksize, 0)
+            if status:
+                raise IOError('Could not read bytes %d-%d of %s' %
+                              (start, end - 1, self.name))
+
+            self.requests += 1
+            self.fetched += len(content)
+
+            for index in range(first, last + 1):
+                offset = (index - first) * self.blocksize
+                self.cache[index] = content[offset:offset + self.blocksize]
+
+        while len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+
+    def get_block(self, index, last, sequential):
+        """
+        Get the block with the given index, which is needed together with
+        the blocks up to last. Missing blocks are fetched in one request,
+        extended by the readahead window for sequential reads.
+        """
+
+        if index in self.cache:
+            # Mark as most recently used
+            block = self.cache.pop(index)
+            self.cache[index] = block
+            return block
+
+        if sequential:
+            last = max(last, index + self.window - 1)
+            self.window = min(2 * self.window, self.readahead)
+        else:
+            self.window = 1
+
+        # Do not fetch beyond the end of the file, the capacity of the
+        # cache, or blocks that are already cached
+        last = min(last, (self.size - 1) // self.blocksize,
+                   index + self.cache_blocks - 1)
+        for i in range(index + 1, last + 1):
+            if i in self.cache:
+                last = i - 1
+                break
+
+        self.fetch(index, last)
+
+        return self.cache[index]
+
+    def readinto(self, b):
+        view = memoryview(b)
+        if hasattr(view, 'cast'):
+            view = view.cast('B')
+
+        n = max(0, min(len(view), self.size - self.pos))
+        if n == 0:
+            return 0
+
+        sequential = self.pos == self.last_end
+        last = (self.pos + n - 1) // self.blocksize
+
+        copied = 0
+        while copied < n:
+            index = self.pos // self.blocksize
+            block = self.get_block(index, last, sequential)
+
+            offset = self.pos - index * self.blocksize
+            k = min(len(block) - offset, n - copied)
+            view[copied:copied + k] = block[offset:offset + k]
+
+            copied += k
+            self.pos += k
+
+        self.last_end = self.pos
+
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self.pos)
+
+        b = bytearray(min(size, max(0, self.size - self.pos)))
+        n = self.readinto(b)
+
+        return bytes(b[:n])
+
+    def readall(self):
+        return self.read()
+
+
+def open_file(auth, file_id=None, fileobj=None, blocksize=BLOCK_SIZE,
+              cache_blocks=CACHE_BLOCKS, readahead=READAHEAD):
+    """
+    Open a file in Google Drive for random-access reading, given its ID or
+    its metadata, such as the fileobj of a value in the listing of
+    list_files. Returns a DriveFile.
+    """
+
+    if fileobj is None:
+        fileobj = get_metadata(auth, file_id)
+
+    return DriveFile(auth, fileobj, blocksize, cache_blocks, readahead)
+
+
+def download_into(auth, buf, file_id=None, fileobj=None, offset=0,
+                  nthreads=4, blocksize=BLOCK_SIZE):
+    """
+    Download bytes of a file in Google Drive starting at offset directly
+    into a writable buffer, such as a bytearray, memoryview, mmap or
+    C-contiguous NumPy array, without writing them to disk. The buffer is
+    filled in disjoint slices of blocksize bytes by nthreads threads, which
+    read the responses directly into the slices with the StreamingTransport
+    of gd_transport. Returns the number of bytes downloaded, which is less
+    than the size of the buffer if the file ends first. Raises IOError on
+    failure.
+    """
+    from gd_get import get_transport
+    from gd_plan import run_tasks
+    from gd_throttle import throttle
+    from gd_transport import fetch_block
+
+    if fileobj is None:
+        fileobj = get_metadata(auth, file_id)
+
+    view = memoryview(buf)
+    if hasattr(view, 'cast'):
+        view = view.cast('B')
+    if view.readonly:
+        raise TypeError('The buffer is not writable')
+
+    size = int(fileobj['fileSize'])
+    url = fileobj['downloadUrl']
+    name = fileobj.get('title', fileobj.get('id', ''))
+
+    n = max(0, min(len(view), size - offset))
+    tasks = [{'file': {'name': name}, 'start': p, 'end': min(p + blocksize, n)}
+             for p in range(0, n, blocksize)]
+
+    def fill(task):
+        start = offset + task['start']
+        end = offset + task['end']
+
+        # The slice is the buffer, so nothing is charged to the budget
+        throttle(end - start)
+        status, n, backoff = fetch_block(
+            get_transport(auth), url, start, end,
+            view[task['start']:task['end']], 0)
+        if status or n != end - start:
+            raise IOError('could not download bytes %d-%d' %
+                          (start, end - 1))
+
+        return n
+
+    nbytes = run_tasks(tasks, max(1, min(nthreads, len(tasks))), fill)[0]
+    if nbytes != n:
+        raise IOError('Could not download %s into the buffer' % name)
+
+    return n
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+Move files and folders in Google Drive to the trash, or delete them.
+"""
+
+import sys
+from gd_mutate import add_arguments, connect, resolve_paths, find_sources, \
+    get_ancestors, is_folder
+
+
+def parse_args(description):
+    "Parse command-line arguments"
+
+    import argparse
+
+    # Process command-line arguments
+    parser = argparse.ArgumentParser(description=description)
+
+    add_arguments(parser)
+
+    parser.add_argument('-r', '--recursive',
+                        help='Remove folders and their contents.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('--permanent',
+                        help='Delete the files permanently instead of ' +
+                        'moving them to the trash.',
+                        default=False,
+                        action='store_true')
+
+    parser.add_argument('paths', metavar='PATH',
+                        nargs='+',
+                        help='List of paths relative to the parent folder, ' +
+                        'which may contain Unix filename patterns. ' +
+                        '(Each name pattern must be enclosed in quotes).')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args(description=__doc__)
+
+    drive, mutator = connect(args)
+    files = drive.auth.service.files()
+
+    found = resolve_paths(drive, args.parent, args.paths)
+
+    ops = []
+    removed = set()
+    for value in find_sources(found, args.paths):
+        if is_folder(value) and not args.recursive:
+            sys.stderr.write('Cannot remove %s: Is a folder\n' % value['name'])
+            continue
+
+        # The contents of a removed folder are removed with it
+        removed.add(value['name'])
+        if any(path in removed for path in get_ancestors(value['name'])):
+            continue
+
+        if args.permanent:
+            request = files.delete(fileId=value['id'])
+        else:
+            request = files.trash(fileId=value['id'])
+        ops.append((value['name'], request))
+
+    results = mutator.run(ops)
+    mutator.report('Removed', len(results), len(ops))
+
+    if len(results) < len(ops):
+        sys.exit(-1)
@@ -0,0 +1,250 @@
+"""
+Processing stages applied to the byte stream of a file while it is being
+downloaded, so that the downloaded file need not be written to disk first.
+"""
+
+import hashlib
+
+COMPRESSIONS = ('.gz', '.bz2', '.xz', '.zst')
+
+
+def get_compression(name):
+    "Get the compression extension of a file name, or '' if not compressed"
+
+    for ext in COMPRESSIONS:
+        if name.lower().endswith(ext):
+            return ext
+
+    return ''
+
+
+def strip_compression(name):
+    "Strip the compression extension from a file name"
+
+    ext = get_compression(name)
+    if ext:
+        return name[:-len(ext)]
+
+    return name
+
+
+def new_decompressor(ext):
+    "Create a decompressor object for the given compression extension"
+
+    if ext == '.gz':
+        import zlib
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif ext == '.bz2':
+        import bz2
+        return bz2.BZ2Decompressor()
+    elif ext == '.xz':
+        try:
+            import lzma
+        except ImportError:
+            from backports import lzma
+        return lzma.LZMADecompressor()
+    elif ext == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Decompressing .zst files requires zstandard. ' +
+                              'Install it using pip install zstandard.')
+        return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError('Unsupported compression %s' % ext)
+
+
+class DecompressError(IOError):
+    "A compressed stream is corrupt or truncated"
+
+
+class DecompressWriter(object):
+    """
+    Decompress a byte stream while writing it into a file object, and
+    compute the MD5 checksum of the compressed stream for verification.
+    Concatenated streams, such as multi-member gzip files, are supported.
+    Corrupt streams raise DecompressError.
+    """
+
+    def __init__(self, f, ext):
+        self.f = f
+        self.ext = ext
+        self.md5 = hashlib.md5()
+        self.decompressor = new_decompressor(ext)
+
+    def write(self, data):
+        self.md5.update(data)
+
+        while data:
+            try:
+                out = self.decompressor.decompress(data)
+            except Exception as e:
+                # zlib.error, OSError, LZMAError, ZstdError or EOFError
+                raise DecompressError('Corrupt %s stream: %s' % (self.ext, e))
+            if out:
+                self.f.write(out)
+
+            # Start a new decompressor for the next concatenated stream.
+            # Decompressors leave the data after the end of a stream in
+            # unused_data, while eof is missing in Python 2
+            data = getattr(self.decompressor, 'unused_data', b'')
+            if data:
+                self.decompressor = new_decompressor(self.ext)
+
+    def finish(self):
+        "Write out the remaining decompressed data"
+
+        if hasattr(self.decompressor, 'flush'):
+            try:
+                out = self.decompressor.flush()
+            except Exception as e:
+                raise DecompressError('Corrupt %s stream: %s' % (self.ext, e))
+            if out:
+                self.f.write(out)
+
+        if not getattr(self.decompressor, 'eof', True):
+            raise DecompressError('Truncated %s stream' % self.ext)
+
+    def hexdigest(self):
+        "MD5 checksum of the compressed stream written so far"
+
+        return self.md5.hexdigest()
+
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                  '.txz')
+
+
+def is_tar(name):
+    "Check whether a file name is a tar archive, possibly compressed"
+
+    return name.lower().endswith(TAR_EXTENSIONS)
+
+
+class BlockReader(object):
+    """
+    A read-only, non-seekable file-like object over an iterator of blocks
+    of bytes, which computes the MD5 checksum of the stream as it is read.
+    The blocks may be memoryviews that are only valid until the next block
+    is requested.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.md5 = hashlib.md5()
+        self.count = 0
+
+        # The current block and the offset of its unread bytes, so that a
+        # read copies only the bytes it returns
+        self.block = b''
+        self.pos = 0
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self.pos >= len(self.block):
+                try:
+                    self.block = next(self.blocks)
+                except StopIteration:
+                    self.block = b''
+                    break
+
+                self.pos = 0
+                self.md5.update(self.block)
+                self.count += len(self.block)
+                continue
+
+            end = len(self.block) if size < 0 else \
+                min(len(self.block), self.pos + size)
+            # Copy the piece out of a view before its buffer is reused
+            pieces.append(bytes(self.block[self.pos:end]))
+            if size > 0:
+                size -= end - self.pos
+            self.pos = end
+
+        return b''.join(pieces)
+
+    def drain(self):
+        "Read the rest of the stream, so that its checksum is complete"
+
+        for block in self.blocks:
+            self.md5.update(block)
+            self.count += len(block)
+        self.block = b''
+        self.pos = 0
+
+    def hexdigest(self):
+        "MD5 checksum of the stream read so far"
+
+        return self.md5.hexdigest()
+
+
+def is_within(path, root):
+    "Check whether a real path is root or under it"
+    import os
+
+    return path == root or path.startswith(os.path.join(root, ''))
+
+
+def is_safe_member(member, outdir):
+    """
+    Check whether a tar member is extracted under outdir, also through the
+    links extracted before it, and whether a link member points under it.
+    Links with absolute targets and device files are unsafe.
+    """
+    import os
+
+    root = os.path.realpath(outdir)
+    path = os.path.join(root, member.name)
+    if os.path.isabs(member.name) or member.isdev() or \
+            not is_within(os.path.realpath(path), root):
+        return False
+
+    if member.issym():
+        target = os.path.join(os.path.dirname(path), member.linkname)
+    elif member.islnk():
+        target = os.path.join(root, member.linkname)
+    else:
+        return True
+
+    return not os.path.isabs(member.linkname) and \
+        is_within(os.path.realpath(target), root)
+
+
+def extract_tar(reader, outdir, members=None, quiet=True):
+    """
+    Extract a tar archive, possibly compressed, from the reader into outdir
+    while it is being read. If members is given, only the members matching
+    one of its Unix filename patterns are extracted. Members that would be
+    written outside outdir, such as through a link, are skipped also
+    without the extraction filters of newer Pythons. Returns the number of
+    extracted members.
+    """
+    import sys
+    import fnmatch
+    import tarfile
+
+    count = 0
+    tar = tarfile.open(fileobj=reader, mode='r|*')
+    if hasattr(tarfile, 'data_filter'):
+        tar.extraction_filter = tarfile.data_filter
+
+    try:
+        for member in tar:
+            if members and not any(fnmatch.fnmatch(member.name, pattern)
+                                   for pattern in members):
+                continue
+
+            if not is_safe_member(member, outdir):
+                sys.stderr.write('Skipped unsafe member %s\n' % member.name)
+                continue
+
+            tar.extract(member, path=outdir)
+            count += 1
+
+            if not quiet:
+                sys.stderr.write('Extracted %s\n' % member.name)
+    finally:
+        tar.close()
+
+    return count
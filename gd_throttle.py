@@ -0,0 +1,194 @@
+"""
+Limit the bandwidth of transfers with a token bucket.
+
+The limiter enforces an aggregate cap on all transfer threads of a process.
+Processes on the same host register their priority in a shared directory,
+and the cap is divided among them in proportion to the weights of their
+priority classes, so that urgent jobs get most of the link. The cap can be
+adjusted at runtime by editing a control file, or by sending SIGUSR1 to
+halve it or SIGUSR2 to double it.
+"""
+
+import os
+import threading
+
+PRIORITIES = {'urgent': 8, 'high': 4, 'normal': 2, 'low': 1}
+
+# Seconds between checks of the control file and the registry
+REFRESH_INTERVAL = 1.0
+
+# Registry entries not refreshed within this many seconds are stale
+REGISTRY_TIMEOUT = 10.0
+
+# Maximum burst in seconds of the rate
+BURST = 1.0
+
+
+def parse_rate(rate):
+    "Parse a rate in bytes per second with an optional K, M or G suffix"
+
+    rate = str(rate).strip().upper().rstrip('B/S')
+    scale = 1
+    for i, unit in enumerate(['K', 'M', 'G', 'T']):
+        if rate.endswith(unit):
+            rate = rate[:-1]
+            scale = 1024 ** (i + 1)
+            break
+
+    return int(float(rate) * scale)
+
+
+class BandwidthLimiter(object):
+    """
+    A thread-safe token bucket limiting the bandwidth of this process to
+    its share of the aggregate rate. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate=0, priority='normal', control_file='',
+                 registry_dir=''):
+        import time
+        import socket
+
+        self.rate = rate
+        self.weight = PRIORITIES[priority]
+        self.control_file = control_file
+        self.control_mtime = None
+        if registry_dir:
+            self.registry = registry_dir + '/%s-%d' % (socket.gethostname(),
+                                                       os.getpid())
+        else:
+            self.registry = ''
+
+        self.share = rate
+        self.tokens = 0.0
+        self.last = time.time()
+        self.checked = 0
+        self.new_rate = None
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """
+        Set the aggregate rate. This only records the new rate, which is
+        applied at the next refresh, so it is safe to call from a signal
+        handler.
+        """
+
+        self.new_rate = rate
+        self.checked = 0
+
+    def refresh(self):
+        "Reload the control file and recompute the share of this process"
+        import time
+
+        if self.new_rate is not None:
+            self.rate, self.new_rate = self.new_rate, None
+
+        if self.control_file:
+            try:
+                mtime = os.path.getmtime(self.control_file)
+                if mtime != self.control_mtime:
+                    with open(self.control_file) as f:
+                        self.rate = parse_rate(f.read() or 0)
+                    self.control_mtime = mtime
+            except (OSError, IOError, ValueError):
+                pass
+
+        if not self.registry or self.rate <= 0:
+            self.share = self.rate
+            return
+
+        # Register this process and sum up the weights of live processes
+        try:
+            with open(self.registry, 'w') as f:
+                f.write(str(self.weight))
+        except (OSError, IOError):
+            pass
+
+        total = 0
+        now = time.time()
+        registry_dir = os.path.dirname(self.registry)
+        for fname in os.listdir(registry_dir):
+            path = registry_dir + '/' + fname
+            try:
+                if now - os.path.getmtime(path) > REGISTRY_TIMEOUT:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    total += int(f.read())
+            except (OSError, IOError, ValueError):
+                pass
+
+        self.share = self.rate * self.weight / float(max(total, self.weight))
+
+    def consume(self, nbytes):
+        """
+        Take nbytes tokens from the bucket, and sleep if the bucket is in
+        deficit. Blocks of any size are allowed, so the long-term rate is
+        enforced even if blocks are larger than the bucket.
+        """
+        import time
+
+        with self.lock:
+            now = time.time()
+            if now - self.checked >= REFRESH_INTERVAL:
+                self.refresh()
+                self.checked = now
+
+            if self.share <= 0:
+                return
+
+            self.tokens = min(self.tokens + (now - self.last) * self.share,
+                              self.share * BURST)
+            self.last = now
+            self.tokens -= nbytes
+
+            wait = -self.tokens / self.share if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def close(self):
+        "Unregister this process"
+
+        if self.registry:
+            try:
+                os.remove(self.registry)
+            except OSError:
+                pass
+
+
+# The limiter shared by all transfers of this process
+limiter = None
+
+
+def configure(rate=0, priority='normal', control_file=''):
+    """
+    Configure the bandwidth limiter of this process. Must be called from
+    the main thread, because it installs the signal handlers.
+    """
+    import atexit
+    import signal
+    from gd_cache import get_cache_dir
+
+    global limiter
+
+    if not rate and not control_file:
+        limiter = None
+        return
+
+    limiter = BandwidthLimiter(rate, priority, control_file,
+                               get_cache_dir('bwlimit'))
+    atexit.register(limiter.close)
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1,
+                      lambda signum, frame: limiter.set_rate(limiter.rate // 2))
+        signal.signal(signal.SIGUSR2,
+                      lambda signum, frame: limiter.set_rate(limiter.rate * 2))
+
+
+def throttle(nbytes):
+    "Account for nbytes transferred, and sleep if over the limit"
+
+    if limiter is not None:
+        limiter.consume(nbytes)
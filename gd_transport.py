@@ -0,0 +1,408 @@
+"""
+Transports for downloading byte ranges of files into reusable buffers.
+
+A Transport generates the blocks of a byte range of a file, and reads a
+range into a caller-provided buffer. StreamingTransport reads the body of
+a Range response with http.client directly into the buffer, so a block is
+never held twice in memory, unlike the bytes object returned for each body
+by httplib2. Buffers are taken from a fixed BufferPool, and iter_views
+hands memoryviews of them to the writer and the hasher, which keeps the
+memory of concurrent downloads bounded. A connection lost in the middle of
+a block is reestablished, and the rest of the block is requested again.
+
+The memory of the buffers and of other blocks in flight is charged to the
+MemoryBudget of the process, which makes new requests wait while the
+budget is used up and records the peak usage.
+"""
+
+import sys
+import socket
+import threading
+from contextlib import contextmanager
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit, urljoin
+except ImportError:
+    import httplib
+    from urlparse import urlsplit, urljoin
+
+MAX_REDIRECTS = 5
+TIMEOUT = 60
+
+# Number of times a block is resumed after the connection was lost
+MAX_RECONNECTS = 3
+
+
+class TransportError(IOError):
+    "A byte range could not be downloaded"
+
+
+class MemoryBudget(object):
+    """
+    A budget of bytes held by transfers, shared by all threads. acquire
+    blocks while the budget would be exceeded, except that a request
+    larger than the whole budget is admitted when nothing else is held.
+    A limit of 0 means unlimited. The peak usage is recorded either way.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+
+        # Number of requests that did not fit into the budget at first
+        self.waits = 0
+        self.cond = threading.Condition()
+
+    def fits(self, n):
+        return not self.limit or self.used + n <= self.limit or \
+            self.used == 0
+
+    def acquire(self, n, block=True):
+        "Charge n bytes, and return whether they were charged"
+
+        with self.cond:
+            if not self.fits(n):
+                self.waits += 1
+                if not block:
+                    return False
+
+                while not self.fits(n):
+                    self.cond.wait()
+
+            self.used += n
+            self.peak = max(self.peak, self.used)
+
+            return True
+
+    def release(self, n):
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+    @contextmanager
+    def reserve(self, n):
+        "Charge n bytes for the duration of the block"
+
+        self.acquire(n)
+        try:
+            yield
+        finally:
+            self.release(n)
+
+
+# The memory budget of this process
+budget = MemoryBudget()
+
+
+def configure_budget(limit):
+    "Set the memory budget of this process in bytes, where 0 is unlimited"
+    global budget
+
+    budget = MemoryBudget(limit)
+
+
+class BufferPool(object):
+    """
+    A pool of up to nbuffers buffers of size bytes, which are allocated on
+    demand. A buffer is charged copies times its size to the memory budget
+    while it is checked out, which covers the copies of a block made by the
+    transport, so that idle buffers do not hold the budget. acquire blocks
+    until a buffer is released if all of them are in use, or until the
+    budget allows another one.
+    """
+
+    def __init__(self, size, nbuffers, copies=1):
+        self.size = size
+        self.nbuffers = max(1, nbuffers)
+        self.charge = size * copies
+        self.buffers = []
+        self.available = self.nbuffers
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.available:
+                self.cond.wait()
+            self.available -= 1
+            buf = self.buffers.pop() if self.buffers else None
+
+        # Wait for the budget without holding the pool
+        try:
+            budget.acquire(self.charge)
+        except BaseException:
+            self.put(buf)
+            raise
+
+        return buf if buf is not None else bytearray(self.size)
+
+    def release(self, buf):
+        budget.release(self.charge)
+        self.put(buf)
+
+    def put(self, buf):
+        "Return a buffer, or None if it was not allocated, to the pool"
+
+        with self.cond:
+            if buf is not None:
+                self.buffers.append(buf)
+            self.available += 1
+            self.cond.notify()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_buffer_pool(size, nbuffers, copies=1):
+    """
+    Get the buffer pool of this process for buffers of size bytes, which
+    is created with up to nbuffers buffers on first use
+    """
+
+    with pools_lock:
+        if size not in pools:
+            pools[size] = BufferPool(size, nbuffers, copies)
+
+        return pools[size]
+
+
+class Transport(object):
+    "Interface of the transports"
+
+    def fetch(self, url, start, end, buf):
+        """
+        Read bytes start to end-1 of url into the writable memoryview buf.
+        Returns the status and reason of the response and the number of
+        bytes read, which is 0 unless the status is 206.
+        """
+        raise NotImplementedError
+
+    def iter_blocks(self, url, end, chunksize, start=0):
+        """
+        Generate the blocks of bytes start to end-1 of url as bytes-like
+        objects, which are only valid until the next block is requested.
+        Raises IOError if a block cannot be downloaded.
+        """
+        raise NotImplementedError
+
+
+class StreamingTransport(Transport):
+    """
+    A transport reading the responses with http.client into the buffer,
+    authorized with oauth2client credentials. Connections are kept alive
+    per host, so a transport must be used by one thread only. If tracker is
+    given, the responses are recorded with tracker.record(status, reason),
+    such as for a gd_pool.CredentialState. The blocks are read into the
+    buffers of a pool of nbuffers buffers per block size.
+    """
+
+    def __init__(self, credentials, tracker=None, timeout=TIMEOUT,
+                 nbuffers=2):
+        self.credentials = credentials
+        self.tracker = tracker
+        self.timeout = timeout
+        self.nbuffers = nbuffers
+        self.connections = {}
+
+    def connect(self, scheme, host):
+        "Get the kept-alive connection to a host"
+
+        key = (scheme, host)
+        if key not in self.connections:
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = httplib.HTTPConnection(host, timeout=self.timeout)
+            self.connections[key] = conn
+
+        return self.connections[key]
+
+    def refresh(self):
+        "Refresh the access token of the credentials"
+        import httplib2
+
+        self.credentials.refresh(httplib2.Http())
+
+    def request(self, url, headers):
+        """
+        Send a GET request and return the response, reconnecting once if a
+        kept-alive connection was closed by the server
+        """
+
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        conn = self.connect(parts.scheme, parts.netloc)
+
+        for i in range(2):
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn.getresponse()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if i > 0:
+                    raise
+
+    def fetch(self, url, start, end, buf):
+        """
+        Read bytes start to end-1 of url into the writable memoryview buf.
+        Returns the status and reason of the response and the number of
+        bytes read, which is 0 unless the status is 206.
+        """
+        from gd_profile import count
+
+        if self.credentials.access_token_expired:
+            self.refresh()
+
+        refreshed = False
+        for i in range(MAX_REDIRECTS + 2):
+            headers = {"Range": 'bytes=%s-%s' % (start, end - 1)}
+            self.credentials.apply(headers)
+            resp = self.request(url, headers)
+            count('download requests')
+
+            if resp.status in (301, 302, 303, 307, 308):
+                resp.read()
+                url = urljoin(url, resp.getheader('Location'))
+                continue
+            elif resp.status == 401 and not refreshed:
+                resp.read()
+                self.refresh()
+                refreshed = True
+                continue
+            break
+
+        if self.tracker is not None:
+            self.tracker.record(resp.status, resp.reason or '')
+
+        if resp.status != 206:
+            resp.read()
+            return resp.status, resp.reason or '', 0
+
+        view = buf[:end - start]
+        n = 0
+        try:
+            while n < len(view):
+                k = readinto(resp, view[n:])
+                if not k:
+                    break
+                n += k
+        except (socket.error, httplib.HTTPException) as e:
+            sys.stderr.write('Connection lost: %s\n' % e)
+
+        if n < len(view) or not resp.isclosed():
+            # Do not reuse a connection with a partially read response
+            self.connections.pop((urlsplit(url).scheme,
+                                  urlsplit(url).netloc)).close()
+        count('bytes transferred', n)
+
+        return resp.status, resp.reason or '', n
+
+    def iter_blocks(self, url, end, chunksize, start=0):
+        pool = get_buffer_pool(chunksize, self.nbuffers)
+
+        return iter_views(self, url, end, chunksize, pool, start)
+
+
+def readinto(resp, view):
+    """
+    Read the body of a response into a memoryview, and return the number of
+    bytes read. The responses of httplib in Python 2 have no readinto.
+    """
+
+    if hasattr(resp, 'readinto'):
+        return resp.readinto(view)
+
+    data = resp.read(len(view))
+    view[:len(data)] = data
+
+    return len(data)
+
+
+def fetch_block(transport, url, start, end, buf, backoff):
+    """
+    Read bytes start to end-1 of url into buf, retrying with exponential
+    backoff on rate-limit errors like get_next_block. If the connection is
+    lost, the rest of the block is requested again over a new connection.
+    Returns the status, which is 0 on success, the number of bytes read and
+    the backoff.
+    """
+    import time
+
+    n = 0
+    lost = 0
+    attempts = 0
+    while attempts < 10:
+        try:
+            status, reason, k = transport.fetch(url, start + n, end, buf[n:])
+        except (socket.error, httplib.HTTPException) as e:
+            # The request failed also after reconnecting
+            status, reason, k = None, str(e), 0
+        n += k
+
+        if backoff > 0:
+            time.sleep(backoff)
+
+        if status == 206 and n == end - start:
+            return 0, n, backoff
+        elif status == 206 or status is None:
+            lost += 1
+            if lost > MAX_RECONNECTS:
+                sys.stderr.write("Connection lost too often: %s\n" % reason)
+                break
+            sys.stderr.write("Resuming bytes %d-%d after the connection "
+                             "was lost\n" % (start + n, end - 1))
+            time.sleep(0.1 * 2 ** lost)
+            continue
+
+        attempts += 1
+        if backoff >= 2 or status != 429 and status != 403 or \
+                status == 403 and \
+                reason.find('Rate Limit Exceeded') < 0 and \
+                reason.find('Too Many Requests') < 0:
+            sys.stderr.write("Error %s cannot be recovered\n" % status)
+            break
+        else:
+            sys.stderr.write("Got error " + reason +
+                             ". Trying to recover with exponential backoff.\n")
+
+            # Use exponential backoff
+            if backoff == 0:
+                backoff = 0.1
+            else:
+                backoff *= 2
+            time.sleep(backoff)
+
+    return -1, 0, backoff
+
+
+def iter_views(transport, url, end, chunksize, pool, start=0):
+    """
+    Generate memoryviews of the blocks of bytes start to end-1 of url,
+    read into a buffer of the pool. A view is only valid until the next
+    block is requested. Raises TransportError if a block cannot be read.
+    """
+    from gd_throttle import throttle
+
+    buf = pool.acquire()
+    try:
+        view = memoryview(buf)
+        blocksize = min(chunksize, len(buf))
+
+        sz = start
+        backoff = 0
+        while sz < end:
+            pnext = min(sz + blocksize, end)
+
+            throttle(pnext - sz)
+            status, n, backoff = fetch_block(transport, url, sz, pnext,
+                                             view, backoff)
+            if status or n != pnext - sz:
+                raise TransportError('could not download bytes %d-%d' %
+                                     (sz, pnext - 1))
+
+            yield view[:n]
+            sz = pnext
+    finally:
+        pool.release(buf)
@@ -0,0 +1,396 @@
+"""
+Watch a folder in Google Drive and download new or modified files as
+soon as they appear.
+
+The folder is listed once, and then only the changes are polled, through
+the changes feed of Drive, or through a query for files modified since
+the last poll if the changes feed is not available. A file is downloaded
+once it has not changed for the debounce interval, so that files that
+are being updated repeatedly are downloaded only once. The cursor, the
+paths of the folders and the files waiting to be downloaded are saved, so
+that a restarted watch resumes without listing the folder again. Files
+that fail to download are tried again after the debounce interval.
+"""
+
+import sys
+import time
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+# Seconds without changes before a file is downloaded
+DEBOUNCE = 2.0
+
+# Seconds for which the saved state of a watch is valid
+STATE_TTL = 7 * 86400
+
+
+class Watcher(object):
+    """
+    Track the files under a folder in Google Drive incrementally. The
+    paths of the folders are kept by their IDs, so that the path of a
+    changed file can be derived from its parents.
+    """
+
+    def __init__(self, auth, parent_id, patterns=None, recursive=False,
+                 debounce=DEBOUNCE):
+        self.auth = auth
+        self.service = auth.service
+        self.parent_id = parent_id
+        self.name = parent_id
+        self.patterns = patterns or []
+        self.recursive = recursive
+        self.debounce = debounce
+
+        self.folders = {}
+        self.pending = {}
+        self.cursor = None
+        self.feed = 'changes'
+
+        # The modifiedDate of the files reported by the polls of the
+        # modified feed, which overlap
+        self.reported = {}
+
+    def execute(self, request):
+        from gd_get import get_http
+
+        return request.execute(http=get_http(self.auth), num_retries=3)
+
+    def start(self, ls):
+        """
+        Start watching after the folder was listed by list_files into ls,
+        whose folders are tracked. The cursor is taken before, so that no
+        change is missed.
+        """
+
+        self.folders = {self.parent_id: ''}
+        for value in ls.values():
+            if value['fileSize'] < 0 and \
+                    value['fileobj'].get('mimeType') == FOLDER_MIME:
+                self.folders[value['id']] = value['name']
+
+    def get_cursor(self):
+        "Get the cursor for the changes from now on"
+        from googleapiclient.errors import HttpError
+
+        if self.parent_id == 'root':
+            # Changed files refer to the root folder by its ID
+            about = self.execute(self.service.about().get())
+            self.parent_id = about['rootFolderId']
+
+        changes = self.service.changes()
+        if hasattr(changes, 'getStartPageToken'):
+            try:
+                self.cursor = self.execute(
+                    changes.getStartPageToken())['startPageToken']
+                self.feed = 'changes'
+                return
+            except HttpError:
+                pass
+
+        # Poll for the files modified since the cursor instead
+        self.cursor = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+        self.feed = 'modified'
+
+    def poll(self):
+        "Get the files changed since the cursor and advance it"
+
+        files = []
+        if self.feed == 'changes':
+            token = self.cursor
+            while token:
+                result = self.execute(self.service.changes().list(
+                    pageToken=token, includeDeleted=False, maxResults=1000))
+                files += [item['file'] for item in result.get('items', [])
+                          if 'file' in item and not item.get('deleted')]
+                token = result.get('nextPageToken')
+                if 'newStartPageToken' in result:
+                    self.cursor = result['newStartPageToken']
+        else:
+            # Allow for clock skew and modifications during the poll
+            now = time.strftime('%Y-%m-%dT%H:%M:%S',
+                                time.gmtime(time.time() - 60))
+            token = None
+            while True:
+                result = self.execute(self.service.files().list(
+                    q="modifiedDate > '%s' and trashed=false" % self.cursor,
+                    maxResults=1000, pageToken=token))
+                files += result.get('items', [])
+                token = result.get('nextPageToken')
+                if not token:
+                    break
+            self.cursor = max(self.cursor, now)
+
+            # Files modified before the cursor are not reported again
+            self.reported = dict(
+                (id, modified) for id, modified in self.reported.items()
+                if modified >= self.cursor)
+
+        return files
+
+    def resolve_folder(self, id):
+        """
+        Get the path of a folder relative to the parent, or None if it is
+        outside. Folders that were not listed, such as the folders on the
+        way to files matching a pattern, are looked up once and remembered.
+        """
+        from googleapiclient.errors import HttpError
+
+        if id in self.folders:
+            return self.folders[id]
+
+        # Remember the folder as outside while looking it up, which also
+        # stops cycles
+        self.folders[id] = None
+        try:
+            folder = self.execute(self.service.files().get(
+                fileId=id, fields='id,title,parents'))
+        except HttpError:
+            return None
+
+        self.folders[id] = self.get_path(folder)
+
+        return self.folders[id]
+
+    def get_path(self, file1):
+        "Get the path of a file relative to the parent, or None if outside"
+
+        for parent in file1.get('parents', []):
+            dirname = self.resolve_folder(parent['id'])
+            if dirname is not None:
+                return dirname + '/' + file1['title'] if dirname \
+                    else file1['title']
+
+        return None
+
+    def matches(self, path):
+        """
+        Check whether a file is selected like by list_files: it matches
+        one of the patterns, or it is under a matching folder if recursive
+        """
+        from gd_mutate import get_ancestors, match_path
+
+        if not self.patterns:
+            return self.recursive or path.find('/') < 0
+
+        for pattern in self.patterns:
+            if match_path(path, pattern) or self.recursive and \
+                    any(match_path(dirname, pattern)
+                        for dirname in get_ancestors(path)):
+                return True
+
+        return False
+
+    def move_folder(self, id, path):
+        "Set the path of a created, renamed or moved folder and its subfolders"
+
+        old = self.folders.get(id)
+        self.folders[id] = path
+        if old is None or old == path:
+            return
+
+        for key, dirname in list(self.folders.items()):
+            if dirname is not None and dirname.startswith(old + '/'):
+                if path is None:
+                    # Look the subfolders up again if they are moved back
+                    del self.folders[key]
+                else:
+                    self.folders[key] = path + dirname[len(old):]
+
+    def update(self, files):
+        "Track the changed files, which are downloaded after the debounce"
+
+        # Update the folders before the files in them
+        files = sorted(files, key=lambda file1:
+                       file1.get('mimeType') != FOLDER_MIME)
+
+        now = time.time()
+        for file1 in files:
+            if file1['id'] == self.parent_id:
+                continue
+            elif self.feed == 'modified':
+                # A file reported again without a change keeps its debounce
+                modified = file1.get('modifiedDate', '')
+                if self.reported.get(file1['id']) == modified:
+                    continue
+                self.reported[file1['id']] = modified
+
+            if file1.get('labels', {}).get('trashed'):
+                if file1['id'] in self.folders:
+                    self.move_folder(file1['id'], None)
+                continue
+
+            path = self.get_path(file1)
+            if file1.get('mimeType') == FOLDER_MIME:
+                self.move_folder(file1['id'], path)
+                continue
+            elif path is None or 'fileSize' not in file1 or \
+                    not self.matches(path):
+                continue
+
+            self.pending[file1['id']] = (
+                {'id': file1['id'], 'name': path,
+                 'fileSize': int(file1['fileSize']), 'alias': None,
+                 'fileobj': file1}, now)
+
+    def due(self):
+        """
+        Get the files that have not changed for the debounce. They are kept
+        pending until they are removed after they were downloaded.
+        """
+
+        now = time.time()
+        due = [value for value, seen in self.pending.values()
+               if now - seen >= self.debounce]
+
+        return sorted(due, key=lambda value: value['name'])
+
+    def remove(self, values):
+        "Stop tracking downloaded files"
+
+        for value in values:
+            self.pending.pop(value['id'], None)
+
+    def requeue(self, values):
+        "Download files again after the debounce, such as after a failure"
+
+        now = time.time()
+        for value in values:
+            self.pending[value['id']] = (value, now)
+
+    def get_key(self, outdir):
+        "Key of the saved state of the watch"
+        import os
+        import hashlib
+
+        key = '%s %s %s %s' % (self.name, os.path.abspath(outdir or '.'),
+                               self.recursive, ' '.join(self.patterns))
+
+        return 'watch-' + hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def save(self, outdir):
+        from gd_cache import save_cached
+
+        # The pending files are saved with the cursor, which is already
+        # past their changes
+        save_cached(self.get_key(outdir),
+                    {'parent_id': self.parent_id, 'cursor': self.cursor,
+                     'feed': self.feed, 'folders': self.folders,
+                     'pending': list(self.pending.values()),
+                     'reported': self.reported})
+
+    def load(self, outdir):
+        "Load the saved state of the watch, and return whether it exists"
+        from gd_cache import load_cached
+
+        state = load_cached(self.get_key(outdir), STATE_TTL)
+        if not state:
+            return False
+
+        self.parent_id = state['parent_id']
+        self.cursor = state['cursor']
+        self.feed = state['feed']
+        self.folders = state['folders']
+        self.pending = dict((value['id'], (value, seen))
+                            for value, seen in state.get('pending', []))
+        self.reported = state.get('reported', {})
+
+        return True
+
+
+def is_downloaded(value, args):
+    """
+    Check whether a file in the listing was downloaded, as far as it can be
+    told without hashing it. Extracted archives are assumed to be.
+    """
+    import os
+    from gd_stream import get_compression, is_tar
+    from gd_get import get_outname, get_modified_time
+
+    if value['fileSize'] < 0 or args.extract and is_tar(value['name']):
+        return True
+
+    fname = get_outname(value, args)
+    if not os.path.isfile(fname) or os.path.exists(fname + '.ranges'):
+        # A file downloaded in ranges is incomplete while they are recorded
+        return False
+    elif args.decompress and get_compression(value['name']):
+        # A decompressed file gets the modification time of the remote file
+        # when it is complete
+        return os.path.getmtime(fname) == get_modified_time(value)
+
+    return os.path.getsize(fname) == value['fileSize']
+
+
+def watch(auth, args, pool=None):
+    """
+    Download the files under args.parent and keep downloading new or
+    modified files until interrupted
+    """
+    from pydrive.drive import GoogleDrive
+    from gd_list import list_files
+    from gd_profile import phase
+    from gd_get import download_file, download_files
+
+    def download(values):
+        "Download the files, and return those that failed"
+
+        if args.jobs > 1 or pool:
+            try:
+                download_files(values, auth, args, pool)
+            except Exception as e:
+                sys.stderr.write('Failed to download: %s\n' % e)
+        else:
+            for value in values:
+                try:
+                    download_file(value, auth, args)
+                except Exception as e:
+                    sys.stderr.write('Failed to download %s: %s\n' %
+                                     (value['name'], e))
+
+        return [value for value in values if not is_downloaded(value, args)]
+
+    watcher = Watcher(auth, args.parent, args.patterns, args.recursive,
+                      args.debounce)
+
+    if not watcher.load(args.outdir):
+        # Take the cursor before listing, so that files created during the
+        # listing are not missed
+        watcher.get_cursor()
+        with phase('list_files'):
+            ls = list_files(GoogleDrive(auth),
+                            parent_id=args.parent,
+                            patterns=args.patterns,
+                            recursive=args.recursive)
+        watcher.start(ls)
+        watcher.requeue(download(list(ls.values())))
+        watcher.save(args.outdir)
+    elif not args.quiet:
+        sys.stderr.write('Resuming the watch of %s\n' % args.parent)
+
+    if not args.quiet:
+        sys.stderr.write('Watching for changes. Press Ctrl-C to stop.\n')
+
+    try:
+        while True:
+            try:
+                watcher.update(watcher.poll())
+            except Exception as e:
+                sys.stderr.write('Failed to poll the changes: %s\n' % e)
+            watcher.save(args.outdir)
+
+            due = watcher.due()
+            if due:
+                failed = download(due)
+                watcher.remove(due)
+                watcher.requeue(failed)
+                if failed and not args.quiet:
+                    sys.stderr.write('Retrying %d files after the debounce\n' %
+                                     len(failed))
+                watcher.save(args.outdir)
+
+            # Poll again soon if files are waiting for the debounce
+            time.sleep(min(args.interval, args.debounce)
+                       if watcher.pending else args.interval)
+    except KeyboardInterrupt:
+        if not args.quiet:
+            sys.stderr.write('\nStopped watching\n')
@@ -0,0 +1,129 @@
+"""
+Local HTTP servers and fake authentications shared by the tests.
+"""
+
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    "A server whose kept-alive connections do not block its shutdown"
+
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    "A quiet handler keeping connections alive like the servers of Drive"
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, content=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class RangeHandler(Handler):
+    """
+    Serve the files of self.server by byte ranges. Requests for ranges
+    starting at an offset in server.fail get an error, and those in
+    server.drop get no response. Those in server.cut get half of the body
+    before the connection is closed, once.
+    """
+
+    def do_GET(self):
+        server = self.server
+        data = server.files[self.path]
+        start, end = self.headers['Range'][len('bytes='):].split('-')
+        start, end = int(start), int(end)
+        server.requests.append(start)
+
+        if start in server.drop:
+            self.close_connection = True
+            return
+
+        if start in server.cut:
+            server.cut.remove(start)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif start in server.fail:
+            self.reply(500)
+        else:
+            self.reply(206, data[start:end + 1])
+
+
+def start_server(test, handler):
+    """
+    Start a local server with the handler class for a test case, which
+    shuts it down on cleanup. The server gets its base URL as server.url.
+    """
+
+    server = LocalServer(('127.0.0.1', 0), handler)
+    server.url = 'http://127.0.0.1:%d' % server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+
+    return server
+
+
+def make_auth():
+    "Make an authentication like from gd_auth.authenticate"
+    import httplib2
+    from oauth2client.client import AccessTokenCredentials
+
+    auth = mock.Mock(spec=['credentials', 'service'])
+    auth.credentials = AccessTokenCredentials('token', 'gdutil')
+    auth.service._http = auth.credentials.authorize(httplib2.Http())
+
+    return auth
+
+
+def start_range_server(test):
+    "Start a server of files by byte ranges with RangeHandler"
+
+    server = start_server(test, RangeHandler)
+    server.files = {}
+    server.fail = set()
+    server.drop = set()
+    server.cut = set()
+    server.requests = []
+
+    return server
+
+
+def add_file(server, name, data):
+    "Serve a file by a range server, and return its entry of the listing"
+    import hashlib
+
+    server.files['/' + name] = data
+
+    return {'id': name, 'name': name, 'fileSize': len(data),
+            'alias': None,
+            'fileobj': {'downloadUrl': server.url + '/' + name,
+                        'fileSize': str(len(data)), 'title': name,
+                        'md5Checksum': hashlib.md5(data).hexdigest(),
+                        'modifiedDate': '2018-01-01T00:00:00.000Z'}}
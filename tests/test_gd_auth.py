@@ -0,0 +1,111 @@
+"""
+Test that access tokens refreshed during a run are stored in the
+credential file under its lock.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import datetime
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_auth  # noqa: E402
+
+
+class FakeHttp(object):
+    "Answer token requests with new access tokens"
+
+    def __init__(self):
+        self.count = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import httplib2
+
+        self.count += 1
+        content = json.dumps({'access_token': 'token%d' % self.count,
+                              'expires_in': 3600})
+
+        return httplib2.Response({'status': '200'}), content.encode('utf-8')
+
+
+class CredentialTest(unittest.TestCase):
+
+    def setUp(self):
+        from pydrive.auth import GoogleAuth
+        from oauth2client.client import OAuth2Credentials
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.credfile = os.path.join(self.dir, 'mycred.txt')
+
+        expiry = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        credentials = OAuth2Credentials(
+            'token0', 'client', 'secret', 'refresh', expiry,
+            'https://oauth2.example.com/token', 'gdutil')
+        self.gauth = GoogleAuth()
+        self.gauth.credentials = credentials
+
+        with gd_auth.lock_credential(self.credfile):
+            gd_auth.save_credential(self.gauth, self.credfile)
+
+    def load(self):
+        with open(self.credfile) as f:
+            return json.load(f)
+
+    def test_refresh_updates_credfile(self):
+        self.assertEqual(self.load()['access_token'], 'token0')
+
+        self.gauth.credentials.refresh(FakeHttp())
+
+        self.assertEqual(self.gauth.credentials.access_token, 'token1')
+        self.assertEqual(self.load()['access_token'], 'token1')
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['mycred.txt', 'mycred.txt.lock'])
+
+    def test_refresh_holds_lock(self):
+        import fcntl
+
+        locked = []
+
+        def request(*args, **kwargs):
+            # Another process cannot take the lock during the refresh
+            with open(self.credfile + '.lock', 'a+') as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    locked.append(True)
+
+            return http.request(*args, **kwargs)
+
+        http = FakeHttp()
+        self.gauth.credentials.refresh(mock.Mock(request=request))
+        self.assertEqual(locked, [True])
+
+    def test_token_refreshed_by_another_process(self):
+        import copy
+
+        # Another process refreshed the token in the meantime
+        other = copy.copy(self.gauth.credentials)
+        other.access_token = 'other'
+        other.token_expiry = datetime.datetime.utcnow() + \
+            datetime.timedelta(hours=1)
+        with gd_auth.lock_credential(self.credfile):
+            gd_auth.write_credential(other, self.credfile)
+
+        http = FakeHttp()
+        self.gauth.credentials.refresh(http)
+        self.assertEqual(self.gauth.credentials.access_token, 'other')
+        self.assertEqual(http.count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
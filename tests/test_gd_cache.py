@@ -0,0 +1,104 @@
+"""
+Test the bounded metadata cache of gd_cache and the removal of the
+unbounded cache of earlier versions.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_cache  # noqa: E402
+
+URI = 'https://www.googleapis.com/drive/v2/files/%d?alt=json'
+
+
+def make_response(size):
+    "Make a cached response of size bytes that can be revalidated"
+
+    header = (b'status: 200\r\ncontent-type: application/json\r\n'
+              b'etag: "1"\r\n\r\n')
+
+    return header + b'x' * (size - len(header))
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache = gd_cache.MetadataCache(self.dir, max_size=4000)
+
+    def disk_size(self):
+        return sum(os.path.getsize(os.path.join(self.dir, fname))
+                   for fname in os.listdir(self.dir))
+
+    def test_overwrite(self):
+        # Revalidating the same entries does not grow the accounted size,
+        # so that they are not evicted
+        for i in range(10):
+            self.cache.set(URI % 1, make_response(1000))
+            self.cache.set(URI % 2, make_response(1000 + i))
+        self.assertEqual(self.cache.size, 2009)
+        self.assertEqual(self.cache.size, self.disk_size())
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+        self.cache.delete(URI % 1)
+        self.assertEqual(self.cache.size, 1009)
+
+    def test_evict(self):
+        for i in range(5):
+            self.cache.set(URI % i, make_response(1000))
+        self.assertLessEqual(self.cache.size, 3000)
+        self.assertEqual(self.cache.size, self.disk_size())
+        self.assertIsNotNone(self.cache.get(URI % 4))
+        self.assertIsNone(self.cache.get(URI % 0))
+
+    def test_not_stored(self):
+        self.cache.set(URI % 1 + '&alt=media', make_response(1000))
+        self.cache.set(URI % 2, make_response(1000).replace(b'etag', b'date'))
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class LegacyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        patch = mock.patch.dict(os.environ, {'GDUTIL_CACHE_DIR': self.dir})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_prune(self):
+        import httplib2
+
+        legacy = httplib2.safename(URI % 1)
+        for fname in [legacy, 'discovery.json', '.discovery123']:
+            with open(os.path.join(self.dir, fname), 'w') as f:
+                f.write('x')
+        os.mkdir(os.path.join(self.dir, 'quota'))
+
+        self.assertIsInstance(gd_cache.get_http_cache(),
+                              gd_cache.MetadataCache)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['.discovery123', '.legacy-pruned', 'discovery.json',
+                          'http', 'quota'])
+
+        # The directory is scanned only once
+        with open(os.path.join(self.dir, legacy), 'w') as f:
+            f.write('x')
+        with mock.patch('os.listdir', side_effect=AssertionError):
+            gd_cache.get_http_cache()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, legacy)))
+
+
+if __name__ == '__main__':
+    unittest.main()
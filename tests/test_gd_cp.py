@@ -0,0 +1,146 @@
+"""
+Test server-side copies of folder trees by gd_cp with a fake Drive service.
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_cp  # noqa: E402
+
+
+class FakeRequest(object):
+
+    def __init__(self, service, kind, body, source=None):
+        self.service = service
+        self.kind = kind
+        self.body = body
+        self.source = source
+
+    def execute(self, http=None, num_retries=0):
+        service = self.service
+        if self.source in service.fail:
+            raise IOError('copy failed')
+
+        with service.lock:
+            id = 'new%d' % len(service.created)
+            service.created[id] = (self.kind, self.body['title'],
+                                   self.body['parents'][0]['id'], self.source)
+
+        return {'id': id}
+
+
+class FakeService(object):
+    "A Drive service recording the created folders and copies by ID"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = {}
+        self.fail = set()
+
+    def files(self):
+        files = mock.Mock()
+        files.insert.side_effect = \
+            lambda body, fields: FakeRequest(self, 'folder', body)
+        files.copy.side_effect = \
+            lambda fileId, body, fields: FakeRequest(self, 'copy', body,
+                                                     fileId)
+        return files
+
+    def paths(self, target):
+        "Get the paths of the created folders and copies below target"
+
+        def path(id):
+            title, parent = self.created[id][1:3]
+            if parent == target:
+                return title
+            return path(parent) + '/' + title
+
+        return dict((path(id), (self.created[id][0], self.created[id][3]))
+                    for id in self.created)
+
+
+def make_value(id, name, size=100):
+    fileobj = {'mimeType': gd_cp.FOLDER_MIME if size < 0 else 'text/plain'}
+    return {'id': id, 'name': name, 'fileSize': size, 'alias': None,
+            'fileobj': fileobj}
+
+
+class CopyTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.service = FakeService()
+        self.auth = mock.Mock(spec=['service'])
+        self.auth.service = self.service
+
+        self.ls = [make_value('a', 'a', -1),
+                   make_value('x', 'a/b/x.txt'),
+                   make_value('y', 'a/y.txt', 200),
+                   make_value('z', 'z.txt', 300)]
+
+        patches = [mock.patch('gd_get.get_http', lambda auth: None),
+                   mock.patch.object(sys, 'stderr', io.StringIO())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_args(self, *argv):
+        with mock.patch.object(sys, 'argv',
+                               ['gd-cp', '-t', 'target', '-q', '-L', '0'] +
+                               list(argv)):
+            return gd_cp.parse_args('')
+
+    def test_copy_tree(self):
+        stats = gd_cp.copy_tree(self.ls, self.auth, self.get_args('-j', '3'))
+        self.assertEqual((stats['copied'], stats['skipped'], stats['failed'],
+                          stats['bytes']), (3, 0, 0, 600))
+
+        # The folders of unlisted parents are created too, before the files
+        self.assertEqual(self.service.paths('target'),
+                         {'a': ('folder', None),
+                          'a/b': ('folder', None),
+                          'a/b/x.txt': ('copy', 'x'),
+                          'a/y.txt': ('copy', 'y'),
+                          'z.txt': ('copy', 'z')})
+
+    def test_journal(self):
+        journal = os.path.join(self.dir, 'journal')
+        self.service.fail.add('y')
+
+        stats = gd_cp.copy_tree(self.ls, self.auth,
+                                self.get_args('-J', journal))
+        self.assertEqual((stats['copied'], stats['failed']), (2, 1))
+        with open(journal) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(sorted(entry['source'] for entry in entries),
+                         ['/a/b', 'a', 'x', 'z'])
+
+        # A rerun copies only the failed file, into the existing folders
+        self.service.fail.clear()
+        created = len(self.service.created)
+        stats = gd_cp.copy_tree(self.ls, self.auth,
+                                self.get_args('-J', journal))
+        self.assertEqual((stats['copied'], stats['skipped'], stats['failed']),
+                         (1, 2, 0))
+        self.assertEqual(len(self.service.created), created + 1)
+        self.assertEqual(self.service.paths('target')['a/y.txt'],
+                         ('copy', 'y'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+"""
+Test downloads of gd_get against a local server answering Range requests
+like the download URLs of Drive.
+"""
+
+import io
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_get  # noqa: E402
+from helpers import start_range_server, add_file, make_auth  # noqa: E402
+
+BLOCKSIZE = 4096
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_range_server(self)
+
+        self.outdir = tempfile.mkdtemp() + '/'
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+        self.auth = make_auth()
+
+        self.stderr = io.StringIO()
+        patches = [mock.patch.object(gd_get, 'get_hostaddr',
+                                     lambda: 'localhost'),
+                   mock.patch.object(gd_get, 'get_chunksize_perthread',
+                                     lambda hostaddr: BLOCKSIZE),
+                   mock.patch('time.sleep'),
+                   mock.patch('gd_plan.load_throughput', lambda: 1e8),
+                   mock.patch('gd_plan.save_throughput'),
+                   mock.patch.object(sys, 'stderr', self.stderr)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def add_file(self, name, data):
+        return add_file(self.server, name, data)
+
+    def get_args(self, *argv):
+        with mock.patch.object(sys, 'argv',
+                               ['gd-get', '-d', self.outdir] + list(argv)):
+            return gd_get.parse_args('')
+
+    def read(self, name):
+        with open(self.outdir + name, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        data = os.urandom(3 * BLOCKSIZE + 100)
+        file1 = self.add_file('data.bin', data)
+
+        for transport in ['httplib2', 'stream']:
+            if os.path.exists(self.outdir + 'data.bin'):
+                os.remove(self.outdir + 'data.bin')
+            args = self.get_args('--transport', transport)
+            self.assertEqual(gd_get.download_file(file1, self.auth, args)[0],
+                             len(data))
+            self.assertEqual(self.read('data.bin'), data)
+            self.assertNotIn('does not match', self.stderr.getvalue())
+
+    def test_failed_block(self):
+        file1 = self.add_file('data.bin', os.urandom(3 * BLOCKSIZE))
+        self.server.fail.add(BLOCKSIZE)
+
+        for transport in ['httplib2', 'stream']:
+            args = self.get_args('--transport', transport)
+            sz = gd_get.download_file(file1, self.auth, args)[0]
+            self.assertEqual(sz, BLOCKSIZE)
+            self.assertIn('Failed to download data.bin',
+                          self.stderr.getvalue())
+
+    def test_lost_connection_stream(self):
+        file1 = self.add_file('data.bin', os.urandom(3 * BLOCKSIZE))
+        self.server.drop.add(BLOCKSIZE)
+
+        args = self.get_args('--transport', 'stream')
+        sz = gd_get.download_file(file1, self.auth, args)[0]
+        self.assertEqual(sz, BLOCKSIZE)
+        self.assertIn('Failed to download data.bin', self.stderr.getvalue())
+
+    def test_cut_connection_stream(self):
+        data = os.urandom(3 * BLOCKSIZE)
+        file1 = self.add_file('data.bin', data)
+        self.server.cut.add(BLOCKSIZE)
+
+        # The rest of the block is requested over a new connection
+        args = self.get_args('--transport', 'stream')
+        self.assertEqual(gd_get.download_file(file1, self.auth, args)[0],
+                         len(data))
+        self.assertEqual(self.read('data.bin'), data)
+        self.assertIn(BLOCKSIZE + BLOCKSIZE // 2, self.server.requests)
+
+    def test_extract(self):
+        import tarfile
+
+        data = os.urandom(3 * BLOCKSIZE)
+        f = io.BytesIO()
+        with tarfile.open(fileobj=f, mode='w:gz') as tar:
+            info = tarfile.TarInfo('dir/data.bin')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        file1 = self.add_file('archive.tar.gz', f.getvalue())
+
+        for transport in ['httplib2', 'stream']:
+            del self.server.requests[:]
+            args = self.get_args('-x', '--transport', transport)
+            self.assertEqual(gd_get.download_file(file1, self.auth, args)[0],
+                             file1['fileSize'])
+            self.assertEqual(self.read('dir/data.bin'), data)
+            self.assertTrue(self.server.requests)
+        self.assertNotIn('does not match', self.stderr.getvalue())
+
+    def test_corrupt_compressed(self):
+        data = os.urandom(3 * BLOCKSIZE)
+        corrupt = self.add_file('corrupt.bin.gz', data)
+        good = self.add_file('good.bin.gz', gzip.compress(b'good' * 1000))
+
+        args = self.get_args('-z')
+        self.assertEqual(gd_get.download_file(corrupt, self.auth, args)[0], 0)
+        self.assertIn('Failed to decompress corrupt.bin.gz',
+                      self.stderr.getvalue())
+
+        # The other files are still downloaded
+        gd_get.download_file(good, self.auth, args)
+        self.assertEqual(self.read('good.bin'), b'good' * 1000)
+
+    def test_resume_ranges(self):
+        data = os.urandom(8 * BLOCKSIZE)
+        file1 = self.add_file('data.bin', data)
+        self.server.fail.add(5 * BLOCKSIZE)
+
+        # The second of the two ranges fails
+        gd_get.download_files([file1], self.auth, self.get_args('-j', '2'))
+        self.assertIn('Failed to download bytes %d-%d of data.bin' %
+                      (4 * BLOCKSIZE, 8 * BLOCKSIZE - 1),
+                      self.stderr.getvalue())
+        self.assertTrue(os.path.exists(self.outdir + 'data.bin.ranges'))
+
+        # Only the failed range is downloaded again
+        self.server.fail.clear()
+        del self.server.requests[:]
+        gd_get.download_files([file1], self.auth,
+                              self.get_args('-j', '2', '-R'))
+        self.assertEqual(sorted(self.server.requests),
+                         [i * BLOCKSIZE for i in range(4, 8)])
+        self.assertEqual(self.read('data.bin'), data)
+        self.assertFalse(os.path.exists(self.outdir + 'data.bin.ranges'))
+        self.assertNotIn('does not match', self.stderr.getvalue())
+
+        # Without -R, the file is downloaded again
+        with open(self.outdir + 'data.bin.ranges', 'w'):
+            pass
+        del self.server.requests[:]
+        gd_get.download_files([file1], self.auth, self.get_args('-j', '2'))
+        self.assertEqual(len(self.server.requests), 8)
+        self.assertEqual(self.read('data.bin'), data)
+
+    def test_manifest(self):
+        import gd_list
+        from gd_manifest import ManifestWriter, read_manifest
+
+        data = os.urandom(3 * BLOCKSIZE)
+        ls = [self.add_file('data.bin', data),
+              self.add_file('empty.bin', b'')]
+
+        for fname in ['files.ndjson', 'files.csv']:
+            # Write the manifest like gd-ls -m
+            manifest = self.outdir + fname
+            with mock.patch.object(sys, 'argv',
+                                   ['gd-ls', '-q', '-m', manifest]):
+                list_args = gd_list.parse_args('')
+            writer = ManifestWriter(manifest, list_args.format)
+            for value in ls:
+                gd_list.print_entry(value, list_args, writer)
+            writer.close()
+
+            # Download the files in it like gd-get -m, without listing them
+            entries = read_manifest(manifest)
+            self.assertEqual([(value['id'], value['name'], value['fileSize'],
+                               value['fileobj']['md5Checksum'])
+                              for value in entries],
+                             [(value['id'], value['name'], value['fileSize'],
+                               value['fileobj']['md5Checksum'])
+                              for value in ls])
+
+            gd_get.download_files(entries, self.auth,
+                                  self.get_args('-j', '2', '-m', manifest))
+            self.assertEqual(self.read('data.bin'), data)
+            self.assertEqual(self.read('empty.bin'), b'')
+            self.assertNotIn('does not match', self.stderr.getvalue())
+            os.remove(self.outdir + 'data.bin')
+            os.remove(self.outdir + 'empty.bin')
+
+    def test_shared_ranges(self):
+        data = os.urandom(4 * BLOCKSIZE)
+        file1 = self.add_file('data.bin', data)
+        args = self.get_args()
+
+        # Ranges recorded for an earlier version of the file are dropped
+        fname = self.outdir + 'data.bin'
+        with open(fname + '.ranges', 'w') as f:
+            f.write('%d %d old\n' % (0, 4 * BLOCKSIZE))
+        self.assertEqual(gd_get.prepare_ranges(file1, args, True), fname)
+        self.assertEqual(os.path.getsize(fname + '.ranges'), 0)
+
+        # Only the node recording the last range completes the file
+        self.assertFalse(gd_get.record_range(fname, BLOCKSIZE,
+                                             4 * BLOCKSIZE, file1))
+        self.assertTrue(gd_get.record_range(fname, 0, BLOCKSIZE, file1))
+        self.assertFalse(os.path.exists(fname + '.ranges'))
+
+        # Other nodes find the completed file up to date without hashing it
+        with open(fname, 'wb') as f:
+            f.write(data)
+        mtime = gd_get.get_modified_time(file1)
+        os.utime(fname, (mtime, mtime))
+        with mock.patch.object(gd_get, 'md5chksum') as md5chksum:
+            self.assertIsNone(gd_get.prepare_ranges(file1, args, True))
+        self.assertFalse(md5chksum.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
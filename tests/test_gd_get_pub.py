@@ -0,0 +1,147 @@
+"""
+Test downloads of gd_get_pub against a local server answering like the
+download endpoint of public files in Drive.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_get_pub  # noqa: E402
+from helpers import Handler, start_server  # noqa: E402
+
+MEGA = 1048576
+
+
+class PublicHandler(Handler):
+    """
+    Serve server.data as the public file data.bin, by byte ranges if
+    requested. Ranges starting at an offset in server.fail get an error,
+    and the first server.truncate responses stop halfway.
+    """
+
+    def do_GET(self):
+        server = self.server
+        headers = {'Content-Disposition': 'attachment;filename="data.bin"'}
+
+        if 'Range' in self.headers:
+            start, end = self.headers['Range'][len('bytes='):].split('-')
+            start = int(start)
+            end = int(end) + 1 if end else len(server.data)
+            if start in server.fail:
+                return self.reply(500)
+            status = 206
+        else:
+            start, end = 0, len(server.data)
+            status = 200
+
+        content = server.data[start:end]
+        if server.truncate:
+            server.truncate -= 1
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content[:len(content) // 2])
+            self.close_connection = True
+            return
+
+        self.reply(status, content, headers)
+
+
+class PublicDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(self, PublicHandler)
+        self.server.data = os.urandom(2 * 8 * MEGA + 1000)
+        self.server.fail = set()
+        self.server.truncate = 0
+
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+        self.outfile = os.path.join(self.outdir, 'data.bin')
+
+        patches = [mock.patch.object(gd_get_pub, 'URL',
+                                     self.server.url + '/uc?export=download'),
+                   mock.patch('time.sleep')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_download_ranged(self):
+        sz = gd_get_pub.download_file_ranged('id', self.outfile, -1, 2,
+                                             quiet=True)[0]
+        self.assertEqual(sz, len(self.server.data))
+        with open(self.outfile, 'rb') as f:
+            self.assertEqual(f.read(), self.server.data)
+
+    def test_failed_range(self):
+        self.server.fail.add(8 * MEGA)
+
+        with self.assertRaises(IOError) as cm:
+            gd_get_pub.download_file_ranged('id', self.outfile, -1, 2,
+                                            quiet=True)
+        self.assertIn('bytes %d-%d' % (8 * MEGA, 16 * MEGA - 1),
+                      str(cm.exception))
+
+        # No file with holes is left behind
+        self.assertFalse(os.path.exists(self.outfile))
+
+    def test_batch_manifest(self):
+        size = len(self.server.data)
+        manifest = os.path.join(self.outdir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# id, name, size\n\n'
+                    'id1, %s/a.bin, %d\n'
+                    'id2 %s/sub/b.bin\n'
+                    'id3,%s/c.bin,%d\n' % (self.outdir, size, self.outdir,
+                                           self.outdir, size))
+        entries = gd_get_pub.read_manifest(manifest)
+        self.assertEqual(entries,
+                         [('id1', self.outdir + '/a.bin', size),
+                          ('id2', self.outdir + '/sub/b.bin', -1),
+                          ('id3', self.outdir + '/c.bin', size)])
+
+        # Files present at the expected size are skipped
+        with open(self.outdir + '/c.bin', 'wb') as f:
+            f.write(b'x' * size)
+
+        summary = gd_get_pub.download_batch(entries, 2, 2, quiet=True)
+        self.assertEqual((summary['downloaded'], summary['skipped'],
+                          summary['failed']), (2, 1, []))
+        self.assertEqual(summary['bytes'], 2 * size)
+        for name in ['a.bin', 'sub/b.bin']:
+            with open(os.path.join(self.outdir, name), 'rb') as f:
+                self.assertEqual(f.read(), self.server.data)
+
+    def test_batch_truncated(self):
+        entries = [('id', self.outfile, -1)]
+
+        # A transfer is recovered from where it stopped
+        self.server.truncate = 1
+        summary = gd_get_pub.download_batch(entries, 1, 2, quiet=True)
+        self.assertEqual(summary['downloaded'], 1)
+        with open(self.outfile, 'rb') as f:
+            self.assertEqual(f.read(), self.server.data)
+
+        # A transfer that stays truncated fails without a size in the
+        # manifest
+        os.remove(self.outfile)
+        self.server.truncate = 10
+        summary = gd_get_pub.download_batch(entries, 1, 2, quiet=True)
+        self.assertEqual(summary['downloaded'], 0)
+        self.assertEqual(summary['failed'], ['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Test the hash engine of gd_hash on local files.
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_hash  # noqa: E402
+
+
+class HashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.data = os.urandom(100000)
+        self.fname = os.path.join(self.dir, 'data.bin')
+        with open(self.fname, 'wb') as f:
+            f.write(self.data)
+
+    def test_hash_file(self):
+        md5 = hashlib.md5(self.data).hexdigest()
+        for use_mmap in [False, True]:
+            engine = gd_hash.HashEngine(1, blocksize=4096, use_mmap=use_mmap)
+            self.assertEqual(engine.hash_file(self.fname), md5)
+
+    def test_missing_file(self):
+        engine = gd_hash.HashEngine(1)
+        missing = os.path.join(self.dir, 'missing.bin')
+
+        self.assertEqual(engine.hash_files([missing, self.fname])[missing],
+                         None)
+        with self.assertRaises((IOError, OSError)):
+            engine.hash_file(missing)
+
+    def test_unreadable_file(self):
+        engine = gd_hash.HashEngine(1)
+        with mock.patch.object(gd_hash, 'md5_file',
+                               side_effect=IOError('read error')):
+            self.assertEqual(engine.hash_files([self.fname]),
+                             {self.fname: None})
+            with self.assertRaises(IOError):
+                engine.hash_file(self.fname)
+
+    def test_mmap_error(self):
+        # The error is not hidden by closing the map while it is exported
+        class FailingMD5(object):
+            def update(self, data):
+                raise IOError('read error')
+
+        with mock.patch('hashlib.md5', FailingMD5):
+            with self.assertRaises(IOError):
+                gd_hash.md5_file(self.fname, 4096, use_mmap=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
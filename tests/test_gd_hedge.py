@@ -0,0 +1,129 @@
+"""
+Test hedged Range requests of gd_hedge against a local server that stalls
+some responses.
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_hedge  # noqa: E402
+import gd_transport  # noqa: E402
+from helpers import Handler, start_server  # noqa: E402
+
+DATA = os.urandom(10000)
+
+
+class StallHandler(Handler):
+    """
+    Serve DATA by byte ranges. Each request takes the next delay in
+    server.delays, where None stalls it until the test ends.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            delay = server.delays.pop(0) if server.delays else 0
+
+        if delay is None:
+            server.stalled.wait()
+            return
+        time.sleep(delay)
+
+        start, end = self.headers['Range'][len('bytes='):].split('-')
+        try:
+            self.reply(206, DATA[int(start):int(end) + 1])
+        except (OSError, IOError):
+            pass
+
+
+class HedgeTest(unittest.TestCase):
+
+    def setUp(self):
+        import httplib2
+
+        self.server = start_server(self, StallHandler)
+        self.server.lock = threading.Lock()
+        self.server.delays = []
+        self.server.stalled = threading.Event()
+        self.addCleanup(self.server.stalled.set)
+
+        # Enough fast samples for a deadline of MIN_DELAY
+        self.tracker = gd_hedge.LatencyTracker(fraction=1.0)
+        for i in range(gd_hedge.MIN_SAMPLES):
+            self.tracker.record(0.0, 1000)
+
+        self.https = []
+
+        def new_http():
+            self.https.append(httplib2.Http(timeout=10))
+            return self.https[-1]
+
+        self.http = gd_hedge.HedgedHttp(new_http(), new_http, self.tracker)
+
+        patches = [mock.patch.object(gd_hedge, 'MIN_DELAY', 0.1),
+                   mock.patch.object(gd_transport, 'budget',
+                                     gd_transport.MemoryBudget())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def request(self, start=100, end=5099):
+        resp, content = self.http.request(
+            self.server.url + '/data', headers={'Range': 'bytes=%d-%d' %
+                                                (start, end)})
+        self.assertEqual(resp.status, 206)
+        self.assertEqual(content, DATA[start:end + 1])
+
+    def test_fast(self):
+        self.request()
+        self.assertEqual(self.tracker.hedges, 0)
+        self.assertEqual(len(self.https), 1)
+
+    def test_hedge_wins(self):
+        # The original request stalls and the hedge answers
+        self.server.delays = [None]
+        self.request()
+        self.assertEqual((self.tracker.hedges, self.tracker.wins), (1, 1))
+
+        # The connection of the hedge is used from now on
+        self.assertIs(self.http.http, self.https[1])
+        self.request(0, 99)
+        self.assertEqual(len(self.https), 2)
+        self.assertEqual(gd_transport.budget.used, 0)
+
+    def test_hedge_loses(self):
+        # The original request is slow but answers before the stalled hedge
+        self.server.delays = [0.3, None]
+        self.request()
+        self.assertEqual((self.tracker.hedges, self.tracker.wins), (1, 0))
+        self.assertIs(self.http.http, self.https[0])
+
+        # The budget charged for the hedge is released once it has failed
+        for i in range(50):
+            if not gd_transport.budget.used:
+                break
+            time.sleep(0.1)
+        self.assertEqual(gd_transport.budget.used, 0)
+
+    def test_budget(self):
+        # No hedge is sent without room in the memory budget
+        gd_transport.budget.limit = 1000
+        gd_transport.budget.acquire(1000)
+        self.server.delays = [0.3]
+        self.request()
+        self.assertEqual(self.tracker.hedges, 0)
+        self.assertEqual(len(self.https), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Test the batching and retries of the bulk mutation engine of gd_mutate
+with a fake Drive service.
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_mutate  # noqa: E402
+
+
+def http_error(status, content=b''):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+class FakeRequest(object):
+    "An API request whose outcome is looked up by its name"
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeService(object):
+    """
+    A Drive service whose batch requests answer each request with the next
+    of the outcomes listed for its name, which are responses or errors, and
+    with {'id': name} if none are left. An error in self.batch_errors fails
+    a whole batch request.
+    """
+
+    def __init__(self):
+        self.outcomes = {}
+        self.batch_errors = []
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def files(self):
+        files = mock.Mock()
+        files.insert.side_effect = \
+            lambda body, fields: FakeRequest(body['title'] + ' in ' +
+                                             body['parents'][0]['id'])
+        return files
+
+
+class FakeBatch(object):
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        service = self.service
+        service.batches.append([request.name for _, request in self.requests])
+        if service.batch_errors:
+            raise service.batch_errors.pop(0)
+
+        for request_id, request in self.requests:
+            outcomes = service.outcomes.get(request.name)
+            outcome = outcomes.pop(0) if outcomes else {'id': request.name}
+            if isinstance(outcome, Exception):
+                self.callback(request_id, None, outcome)
+            else:
+                self.callback(request_id, outcome, None)
+
+
+class MutatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.service = FakeService()
+        auth = mock.Mock(spec=['service'])
+        auth.service = self.service
+
+        self.stderr = io.StringIO()
+        self.sleep = mock.Mock()
+        patches = [mock.patch.dict(os.environ, {'GDUTIL_CACHE_DIR': self.dir}),
+                   mock.patch('gd_get.get_http', lambda auth: None),
+                   mock.patch('time.sleep', self.sleep),
+                   mock.patch.object(sys, 'stderr', self.stderr)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.mutator = gd_mutate.Mutator(auth, jobs=2, rate=0, retries=3,
+                                         batch_size=10)
+        self.addCleanup(self.mutator.limiter.close)
+
+    def make_ops(self, n):
+        return [('f%d' % i, FakeRequest('f%d' % i)) for i in range(n)]
+
+    def test_batches(self):
+        results = self.mutator.run(self.make_ops(25))
+        self.assertEqual(results, dict(('f%d' % i, {'id': 'f%d' % i})
+                                       for i in range(25)))
+        self.assertEqual(sorted(len(batch) for batch in self.service.batches),
+                         [5, 10, 10])
+        self.assertEqual((self.mutator.calls, self.mutator.batches), (25, 3))
+        self.assertFalse(self.sleep.called)
+
+    def test_retry(self):
+        self.service.outcomes = {
+            'f1': [http_error(429), http_error(500)],
+            'f2': [http_error(403, b'{"reason": "userRateLimitExceeded"}')],
+            'f3': [http_error(404)],
+            'f4': [http_error(403, b'{"reason": "insufficientPermissions"}')]}
+
+        results = self.mutator.run(self.make_ops(12))
+        self.assertEqual(sorted(results), sorted('f%d' % i for i in range(12)
+                                                 if i not in (3, 4)))
+
+        # Only the failed calls are retried, in batches of their own, with
+        # exponential backoff
+        self.assertEqual(self.service.batches[2:], [['f1', 'f2'], ['f1']])
+        self.assertEqual([args[0][0] for args in self.sleep.call_args_list],
+                         [0.5, 1.0])
+        self.assertIn('Failed to update f3', self.stderr.getvalue())
+        self.assertIn('Failed to update f4', self.stderr.getvalue())
+
+    def test_failed_batch(self):
+        # A batch request that fails as a whole is retried
+        self.service.batch_errors = [http_error(503)]
+        results = self.mutator.run(self.make_ops(5))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.service.batches), 2)
+
+        # Other errors fail the operations of the batch
+        self.service.batch_errors = [http_error(400)]
+        self.assertEqual(self.mutator.run(self.make_ops(5)), {})
+        self.assertEqual(len(self.service.batches), 3)
+        self.assertIn('batch of f0', self.stderr.getvalue())
+
+    def test_retries_exhausted(self):
+        self.service.outcomes = {'f0': [http_error(429)] * 10}
+        results = self.mutator.run(self.make_ops(2))
+        self.assertEqual(list(results), ['f1'])
+        self.assertEqual(self.sleep.call_count, 3)
+        self.assertIn('Failed to update f0: rate limit exceeded',
+                      self.stderr.getvalue())
+
+    def test_make_folders(self):
+        found = {'': {'id': 'root', 'name': '', 'fileSize': -1,
+                      'alias': None,
+                      'fileobj': {'mimeType': gd_mutate.FOLDER_MIME}}}
+        self.service.outcomes = {'c in a in root': [http_error(404)]}
+
+        created = self.mutator.make_folders(['a/b/x', 'a/c/y', 'd'], found,
+                                            parents=True)
+
+        # The folders of each depth are created in one batch, in the
+        # folders created before
+        self.assertEqual(self.service.batches,
+                         [['a in root', 'd in root'],
+                          ['b in a in root', 'c in a in root'],
+                          ['x in b in a in root']])
+        self.assertEqual(sorted(created), ['a', 'a/b', 'a/b/x', 'd'])
+        self.assertEqual(found['a/b']['id'], 'b in a in root')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Test spreading downloads across the credentials of a gd_pool.CredentialPool.
+"""
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_pool  # noqa: E402
+from helpers import start_range_server, add_file, make_auth  # noqa: E402
+
+BLOCKSIZE = 4096
+
+
+class PoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.stderr = io.StringIO()
+        patches = [mock.patch('time.time', lambda: self.now),
+                   mock.patch('time.sleep', self.sleep),
+                   mock.patch.object(sys, 'stderr', self.stderr)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.auths = [mock.Mock(spec=['service', 'tracker'])
+                      for i in range(3)]
+        self.pool = gd_pool.CredentialPool(self.auths, ['a', 'b', 'c'])
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_least_loaded(self):
+        acquired = [self.pool.acquire() for i in range(6)]
+        self.assertEqual(acquired, self.auths * 2)
+
+        self.pool.release(self.auths[1])
+        self.assertIs(self.pool.acquire(), self.auths[1])
+
+        # Among idle credentials, the one with fewer recent requests wins
+        for auth in acquired:
+            self.pool.release(auth)
+        self.auths[0].tracker.record(200)
+        self.auths[1].tracker.record(200)
+        self.assertIs(self.pool.acquire(), self.auths[2])
+
+    def test_rate_limited(self):
+        a, b, c = [auth.tracker for auth in self.auths]
+        b.record(403, 'Rate Limit Exceeded')
+        c.record(429)
+        self.assertEqual([self.pool.acquire() for i in range(2)],
+                         [self.auths[0]] * 2)
+
+        # Repeated rate limits double the cool-down
+        a.record(429)
+        a.record(429)
+        self.assertIs(self.pool.acquire(), self.auths[1])
+        self.assertEqual(self.now, 1000.0 + gd_pool.COOLDOWN)
+        self.assertEqual(a.limited_until, 1000.0 + 2 * gd_pool.COOLDOWN)
+
+        a.record(200)
+        self.assertEqual(a.cooldown, gd_pool.COOLDOWN)
+
+    def test_unhealthy(self):
+        a, b, c = [auth.tracker for auth in self.auths]
+        for state in [a, b]:
+            for i in range(gd_pool.MAX_ERRORS):
+                state.record(500)
+        self.assertIn('Credential a is unhealthy', self.stderr.getvalue())
+        self.assertEqual([self.pool.acquire() for i in range(3)],
+                         [self.auths[2]] * 3)
+
+        # Unhealthy credentials are tried again after a while
+        self.now += gd_pool.HEALTH_RETRY + 1
+        self.assertIs(self.pool.acquire(), self.auths[0])
+
+        c.unhealthy_since = self.now
+        a.unhealthy_since = b.unhealthy_since = self.now
+        with self.assertRaises(IOError):
+            self.pool.acquire()
+
+
+class PoolDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        import gd_get
+
+        self.server = start_range_server(self)
+        self.outdir = tempfile.mkdtemp() + '/'
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+        patches = [mock.patch.object(gd_get, 'get_hostaddr',
+                                     lambda: 'localhost'),
+                   mock.patch.object(gd_get, 'get_chunksize_perthread',
+                                     lambda hostaddr: BLOCKSIZE),
+                   mock.patch('time.sleep'),
+                   mock.patch('gd_plan.load_throughput', lambda: 1e8),
+                   mock.patch('gd_plan.save_throughput'),
+                   mock.patch.object(sys, 'stderr', io.StringIO())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_download_files(self):
+        import gd_get
+
+        files = [add_file(self.server, 'data%d.bin' % i,
+                          os.urandom(2 * BLOCKSIZE)) for i in range(8)]
+        auths = [make_auth(), make_auth()]
+        pool = gd_pool.CredentialPool(auths)
+
+        with mock.patch.object(sys, 'argv',
+                               ['gd-get', '-d', self.outdir, '-j', '2']):
+            args = gd_get.parse_args('')
+        gd_get.download_files(files, auths[0], args, pool)
+
+        for file1 in files:
+            with open(self.outdir + file1['name'], 'rb') as f:
+                self.assertEqual(f.read(),
+                                 self.server.files['/' + file1['name']])
+
+        # The responses are recorded for the credential that made them
+        self.assertEqual(sum(auth.tracker.requests for auth in auths),
+                         len(self.server.requests))
+        self.assertTrue(all(auth.tracker.requests for auth in auths))
+        self.assertEqual([auth.tracker.active for auth in auths], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
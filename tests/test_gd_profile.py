@@ -0,0 +1,127 @@
+"""
+Test the phase timings and request counters of gd_profile.
+"""
+
+import io
+import os
+import sys
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_profile  # noqa: E402
+from helpers import Handler, start_server  # noqa: E402
+
+
+class ContentHandler(Handler):
+    "Answer every request with 100 bytes"
+
+    def do_GET(self):
+        self.reply(200, b'x' * 100)
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        # A clock advancing only when the test says so, with the CPU time
+        # at half of the wall time
+        self.now = 1000.0
+        self.profiler = gd_profile.Profiler()
+        patches = [mock.patch('time.time', lambda: self.now),
+                   mock.patch.object(gd_profile, 'cpu_time',
+                                     lambda: self.now / 2),
+                   mock.patch.object(gd_profile, 'profiler', self.profiler)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_nested_phases(self):
+        with gd_profile.phase('transfer'):
+            self.now += 1
+            for i in range(3):
+                with gd_profile.phase('hash'):
+                    self.now += 2
+            self.now += 1
+
+        # The time of nested phases is not charged to the enclosing one
+        self.assertEqual(self.profiler.phases['transfer'], [1, 2.0, 1.0])
+        self.assertEqual(self.profiler.phases['hash'], [3, 6.0, 3.0])
+
+    def test_profiled(self):
+        @gd_profile.profiled('list_files')
+        def list_files():
+            self.now += 5
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            list_files()
+        self.assertEqual(self.profiler.phases['list_files'], [1, 5.0, 2.5])
+
+        # Without a profiler, phases cost nothing
+        with mock.patch.object(gd_profile, 'profiler', None):
+            with gd_profile.phase('other'):
+                gd_profile.count('bytes hashed', 10)
+        self.assertEqual(list(self.profiler.phases), ['list_files'])
+        self.assertEqual(self.profiler.counters, {})
+
+    def test_report(self):
+        with gd_profile.phase('verify'):
+            self.now += 1.5
+        gd_profile.count('bytes hashed', 1000)
+        gd_profile.count('bytes hashed', 24)
+
+        f = io.StringIO()
+        self.profiler.report(f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ['verify', '1', '1.500', '0.750'])
+        self.assertIn('Bytes hashed: 1024', lines)
+
+    def test_request_kind(self):
+        self.assertEqual(gd_profile.get_request_kind(
+            'https://www.googleapis.com/drive/v2/files/x',
+            {'Range': 'bytes=0-99'}), 'download requests')
+        self.assertEqual(gd_profile.get_request_kind(
+            'https://docs.google.com/uc?export=download&id=x', None),
+            'download requests')
+        self.assertEqual(gd_profile.get_request_kind(
+            'https://oauth2.googleapis.com/token', {}), 'auth requests')
+        self.assertEqual(gd_profile.get_request_kind(
+            'https://www.googleapis.com/drive/v2/files?q=x', {}), 'API calls')
+
+    def test_instrument_http(self):
+        import httplib2
+        import requests
+
+        # Restore the instrumented methods afterwards
+        for cls, name in [(httplib2.Http, 'request'),
+                          (requests.Session, 'send'),
+                          (requests.Response, 'iter_content')]:
+            patch = mock.patch.object(cls, name, getattr(cls, name))
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        server = start_server(self, ContentHandler)
+        gd_profile.instrument_http(self.profiler)
+        http = httplib2.Http()
+        http.request(server.url + '/files')
+        http.request(server.url + '/data', headers={'Range': 'bytes=0-99'})
+        self.assertEqual(self.profiler.counters['API calls'], 1)
+        self.assertEqual(self.profiler.counters['download requests'], 1)
+        self.assertEqual(self.profiler.counters['bytes transferred'], 100)
+
+        # Downloads with requests are counted by chunk
+        session = requests.Session()
+        with session.get(server.url + '/uc?export=download', stream=True) as r:
+            self.assertEqual(sum(len(chunk) for chunk in r.iter_content(30)),
+                             100)
+        self.assertEqual(self.profiler.counters['download requests'], 2)
+        self.assertEqual(self.profiler.counters['bytes transferred'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
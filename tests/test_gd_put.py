@@ -0,0 +1,184 @@
+"""
+Test resumable uploads of gd_put against a local server that answers like
+the upload endpoint of Drive, including 308 responses without a Location
+header, lost responses and partially kept chunks.
+"""
+
+import io
+import os
+import sys
+import json
+import hashlib
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_put  # noqa: E402
+from helpers import Handler, start_server, make_auth  # noqa: E402
+
+
+class UploadHandler(Handler):
+    "Serve a resumable upload session of Drive from self.server"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply(200, headers={'Location': self.server.url + '/session'})
+
+    def do_PUT(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        spec, total = self.headers['Content-Range'][len('bytes '):].split('/')
+
+        if body:
+            start = int(spec.split('-')[0])
+            assert start <= len(server.received)
+            server.chunks += 1
+            if server.chunks in server.partial:
+                # Keep half of the chunk and fail
+                server.partial.remove(server.chunks)
+                server.received += body[len(server.received) - start:
+                                        len(body) // 2]
+                return self.reply(503)
+
+            server.received += body[len(server.received) - start:]
+            if server.lost and server.chunks >= server.lost_at:
+                # Keep the chunk but lose the response
+                server.lost -= 1
+                self.close_connection = True
+                return
+
+        if total != '*' and len(server.received) == int(total):
+            content = json.dumps({
+                'id': 'uploaded', 'fileSize': str(len(server.received)),
+                'md5Checksum': hashlib.md5(server.received).hexdigest()})
+            return self.reply(200, content.encode('utf-8'))
+
+        # An incomplete upload is answered with 308 without a Location
+        if server.received:
+            self.reply(308, headers={
+                'Range': 'bytes=0-%d' % (len(server.received) - 1)})
+        else:
+            self.reply(308)
+
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(self, UploadHandler)
+        self.server.received = b''
+        self.server.chunks = 0
+        self.server.lost = 0
+        self.server.lost_at = 0
+        self.server.partial = set()
+        self.auth = make_auth()
+        self.data = os.urandom(3500)
+
+        patches = [mock.patch.object(gd_put, 'UPLOAD_URI',
+                                     self.server.url + '/upload'),
+                   mock.patch('time.sleep'),
+                   mock.patch.object(sys, 'stderr', io.StringIO())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def upload_stream(self):
+        return gd_put.upload_fileobj(io.BytesIO(self.data), self.auth,
+                                     'test.bin', chunksize=1000)
+
+    def upload_file(self):
+        http = gd_put.get_upload_http(self.auth)
+        uri = gd_put.start_session(http, {'title': 'test.bin'},
+                                   len(self.data))
+        md5 = hashlib.md5()
+        chunks = gd_put.FileChunks(io.BytesIO(self.data), len(self.data),
+                                   1000)
+        file1 = gd_put.upload_chunks(http, uri, chunks, 0, md5)
+        self.assertEqual(md5.hexdigest(), file1['md5Checksum'])
+
+        return file1
+
+    def lose(self, chunk):
+        "Lose the responses to a chunk and to its retry by httplib2"
+
+        self.server.lost = 2
+        self.server.lost_at = chunk
+
+    def check(self, file1):
+        self.assertEqual(self.server.received, self.data)
+        self.assertEqual(file1['md5Checksum'],
+                         hashlib.md5(self.data).hexdigest())
+
+    def test_308_without_location(self):
+        self.check(self.upload_file())
+        self.assertEqual(self.server.chunks, 4)
+
+    def test_308_without_location_hedged(self):
+        import gd_hedge
+
+        # Hedging must not wrap the HTTP object of uploads
+        with mock.patch.object(gd_hedge, 'tracker',
+                               gd_hedge.LatencyTracker()):
+            self.check(self.upload_file())
+
+    def test_lost_response(self):
+        self.lose(2)
+        self.check(self.upload_file())
+
+    def test_lost_final_response(self):
+        self.lose(4)
+        self.check(self.upload_file())
+
+    def test_partial_chunk(self):
+        self.server.partial.add(2)
+        self.check(self.upload_file())
+
+    def test_failed_files(self):
+        import shutil
+        import tempfile
+
+        localdir = tempfile.mkdtemp() + '/'
+        self.addCleanup(shutil.rmtree, localdir)
+        with open(localdir + 'data.bin', 'wb') as f:
+            f.write(self.data)
+        tasks = [{'file': {'name': name, 'title': name, 'parent': 'root',
+                           'id': None}}
+                 for name in ['data.bin', 'missing.bin']]
+
+        for jobs in ['1', '2']:
+            self.server.received = b''
+            self.server.chunks = 0
+            argv = ['gd-put', '-q', '-c', localdir, '-d', localdir,
+                    '-j', jobs, 'data.bin', 'missing.bin']
+            with mock.patch.object(sys, 'argv', argv):
+                args = gd_put.parse_args('')
+
+            nbytes, elapsed, failed = gd_put.upload_files(tasks, self.auth,
+                                                          args)
+            self.assertEqual(nbytes, len(self.data))
+            self.assertEqual(failed, [tasks[1]])
+            self.assertEqual(self.server.received, self.data)
+
+    def test_stream(self):
+        self.check(self.upload_stream())
+        self.assertEqual(self.server.chunks, 4)
+
+    def test_lost_response_stream(self):
+        self.lose(2)
+        self.check(self.upload_stream())
+
+    def test_lost_final_response_stream(self):
+        self.lose(4)
+        self.check(self.upload_stream())
+
+    def test_partial_chunk_stream(self):
+        self.server.partial.add(2)
+        self.check(self.upload_stream())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Test reading files of gd_reader against a local server answering Range
+requests like the download URLs of Drive.
+"""
+
+import io
+import os
+import sys
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_reader  # noqa: E402
+from helpers import start_range_server, add_file, make_auth  # noqa: E402
+
+BLOCKSIZE = 4096
+
+
+class ReaderTestCase(unittest.TestCase):
+    "Serve a file by a local range server"
+
+    def setUp(self):
+        self.server = start_range_server(self)
+        self.auth = make_auth()
+        self.data = os.urandom(5 * BLOCKSIZE + 100)
+        self.fileobj = add_file(self.server, 'data.bin', self.data)['fileobj']
+
+        patches = [mock.patch('time.sleep'),
+                   mock.patch.object(sys, 'stderr', io.StringIO())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+
+class DriveFileTest(ReaderTestCase):
+
+    def open(self, **kwargs):
+        return gd_reader.open_file(self.auth, fileobj=self.fileobj,
+                                   blocksize=BLOCKSIZE, **kwargs)
+
+    def test_sequential(self):
+        f = self.open(cache_blocks=8, readahead=4)
+        chunks = []
+        while True:
+            chunk = f.read(BLOCKSIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertEqual(f.tell(), len(self.data))
+
+        # The readahead window doubles up to 4 blocks
+        self.assertEqual(self.server.requests,
+                         [0, BLOCKSIZE, 2 * BLOCKSIZE, 4 * BLOCKSIZE])
+        self.assertEqual(f.fetched, len(self.data))
+
+    def test_seek(self):
+        f = self.open(cache_blocks=2, readahead=2)
+        self.assertEqual(f.seek(-150, io.SEEK_END), len(self.data) - 150)
+        self.assertEqual(f.read(), self.data[-150:])
+        self.assertEqual(f.read(10), b'')
+
+        f.seek(BLOCKSIZE - 10)
+        self.assertEqual(f.read(20), self.data[BLOCKSIZE - 10:BLOCKSIZE + 10])
+        f.seek(-20, io.SEEK_CUR)
+        self.assertEqual(f.read(5), self.data[BLOCKSIZE - 10:BLOCKSIZE - 5])
+
+        # Random reads fetch the blocks they need in one request, and
+        # reading them again hits the cache
+        self.assertEqual(self.server.requests, [4 * BLOCKSIZE, 0])
+
+        # The least recently used block is evicted and fetched again
+        f.seek(3 * BLOCKSIZE)
+        f.read(1)
+        f.seek(BLOCKSIZE)
+        self.assertEqual(f.read(1), self.data[BLOCKSIZE:BLOCKSIZE + 1])
+        self.assertEqual(self.server.requests,
+                         [4 * BLOCKSIZE, 0, 3 * BLOCKSIZE, BLOCKSIZE])
+        self.assertEqual(f.requests, 4)
+
+        with self.assertRaises(ValueError):
+            f.seek(-1)
+
+    def test_buffered(self):
+        f = io.BufferedReader(self.open(), buffer_size=1000)
+        f.seek(3 * BLOCKSIZE + 5)
+        self.assertEqual(f.read(3000), self.data[3 * BLOCKSIZE + 5:][:3000])
+        lines = self.data.split(b'\n')
+        f.seek(0)
+        self.assertEqual(f.readline(), lines[0] + b'\n')
+
+    def test_failed_block(self):
+        self.server.fail.add(2 * BLOCKSIZE)
+
+        f = self.open(readahead=1)
+        self.assertEqual(f.read(2 * BLOCKSIZE), self.data[:2 * BLOCKSIZE])
+        with self.assertRaises(IOError):
+            f.read(BLOCKSIZE)
+
+
+class DownloadIntoTest(ReaderTestCase):
+
+    def download_into(self, buf, offset=0):
+        return gd_reader.download_into(self.auth, buf, fileobj=self.fileobj,
+                                       offset=offset, nthreads=3,
+                                       blocksize=BLOCKSIZE)
+
+    def test_download_into(self):
+        import gd_get
+
+        # The responses are read into the buffer, not fetched as bytes
+        buf = bytearray(len(self.data))
+        with mock.patch.object(gd_get, 'get_next_block',
+                               side_effect=AssertionError):
+            self.assertEqual(self.download_into(buf), len(self.data))
+        self.assertEqual(bytes(buf), self.data)
+        self.assertEqual(sorted(self.server.requests),
+                         list(range(0, len(self.data), BLOCKSIZE)))
+
+    def test_range(self):
+        # A buffer larger than the rest of the file
+        buf = bytearray(3 * BLOCKSIZE)
+        offset = 3 * BLOCKSIZE + 10
+        n = self.download_into(memoryview(buf), offset)
+        self.assertEqual(n, len(self.data) - offset)
+        self.assertEqual(bytes(buf[:n]), self.data[offset:])
+        self.assertEqual(bytes(buf[n:]), b'\0' * (len(buf) - n))
+
+    def test_cut_connection(self):
+        self.server.cut.add(2 * BLOCKSIZE)
+
+        buf = bytearray(len(self.data))
+        self.assertEqual(self.download_into(buf), len(self.data))
+        self.assertEqual(bytes(buf), self.data)
+
+    def test_failed_block(self):
+        self.server.fail.add(2 * BLOCKSIZE)
+
+        with self.assertRaises(IOError):
+            self.download_into(bytearray(len(self.data)))
+
+    def test_readonly(self):
+        with self.assertRaises(TypeError):
+            self.download_into(self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Test the processing stages of gd_stream on streams of blocks.
+"""
+
+import io
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gd_stream import BlockReader, DecompressWriter, DecompressError, \
+    extract_tar  # noqa: E402
+
+
+def split(data, blocksize):
+    return [data[i:i + blocksize] for i in range(0, len(data), blocksize)]
+
+
+class BlockReaderTest(unittest.TestCase):
+
+    def test_read(self):
+        reader = BlockReader([b'abc', b'', b'defg', b'h'])
+        self.assertEqual(reader.read(2), b'ab')
+        self.assertEqual(reader.read(4), b'cdef')
+        self.assertEqual(reader.read(0), b'')
+        self.assertEqual(reader.read(), b'gh')
+        self.assertEqual(reader.read(1), b'')
+        self.assertEqual(reader.count, 8)
+        self.assertEqual(reader.hexdigest(),
+                         hashlib.md5(b'abcdefgh').hexdigest())
+
+    def test_drain(self):
+        reader = BlockReader(split(b'0123456789', 3))
+        self.assertEqual(reader.read(4), b'0123')
+        reader.drain()
+        self.assertEqual(reader.count, 10)
+        self.assertEqual(reader.hexdigest(),
+                         hashlib.md5(b'0123456789').hexdigest())
+
+
+def gzip_compress(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+        gz.write(data)
+
+    return f.getvalue()
+
+
+class DecompressWriterTest(unittest.TestCase):
+
+    def decompress(self, data, blocksize=7):
+        f = io.BytesIO()
+        out = DecompressWriter(f, '.gz')
+        for block in split(data, blocksize):
+            out.write(block)
+        out.finish()
+        self.assertEqual(out.hexdigest(), hashlib.md5(data).hexdigest())
+
+        return f.getvalue()
+
+    def test_multi_member(self):
+        data = gzip_compress(b'abc' * 100) + gzip_compress(b'def' * 100)
+        self.assertEqual(self.decompress(data), b'abc' * 100 + b'def' * 100)
+        self.assertEqual(self.decompress(data, len(data)),
+                         b'abc' * 100 + b'def' * 100)
+
+    def test_corrupt(self):
+        data = gzip_compress(os.urandom(1000))
+        with self.assertRaises(DecompressError):
+            self.decompress(data[:100] + b'x' * 100 + data[200:])
+        with self.assertRaises(DecompressError):
+            self.decompress(data + b'garbage')
+
+    def test_truncated(self):
+        with self.assertRaises(DecompressError):
+            self.decompress(gzip_compress(os.urandom(1000))[:500])
+
+
+class ExtractTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+        self.data = os.urandom(100000)
+        f = io.BytesIO()
+        with tarfile.open(fileobj=f, mode='w:gz') as tar:
+            info = tarfile.TarInfo('dir/data.bin')
+            info.size = len(self.data)
+            tar.addfile(info, io.BytesIO(self.data))
+        self.archive = f.getvalue()
+
+    def test_extract(self):
+        reader = BlockReader(split(self.archive, 4096))
+        self.assertEqual(extract_tar(reader, self.outdir), 1)
+        with open(os.path.join(self.outdir, 'dir', 'data.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def make_archive(self, members):
+        "Make a tar archive of (name, type, linkname or data) members"
+
+        f = io.BytesIO()
+        with tarfile.open(fileobj=f, mode='w') as tar:
+            for name, type, value in members:
+                info = tarfile.TarInfo(name)
+                info.type = type
+                if type == tarfile.REGTYPE:
+                    info.size = len(value)
+                    tar.addfile(info, io.BytesIO(value))
+                else:
+                    info.linkname = value
+                    tar.addfile(info)
+
+        return f.getvalue()
+
+    def check_links(self):
+        # Extract into a subfolder, so that escapes land in self.outdir
+        outdir = os.path.join(self.outdir, 'out')
+        outside = os.path.join(self.outdir, 'outside')
+        os.mkdir(outside)
+        archive = self.make_archive([
+            ('abs', tarfile.SYMTYPE, outside),
+            ('abs/escaped', tarfile.REGTYPE, b'x'),
+            ('rel', tarfile.SYMTYPE, '../outside'),
+            ('rel/escaped', tarfile.REGTYPE, b'x'),
+            ('hard', tarfile.LNKTYPE, '../outside'),
+            ('dir/up', tarfile.SYMTYPE, '..'),
+            ('dir/up/../escaped', tarfile.REGTYPE, b'x'),
+            ('safe', tarfile.SYMTYPE, 'dir'),
+            ('data.bin', tarfile.REGTYPE, b'data')])
+
+        with mock.patch.object(sys, 'stderr', io.StringIO()) as stderr:
+            extract_tar(BlockReader(split(archive, 512)), outdir)
+
+        self.assertEqual(os.listdir(outside), [])
+        self.assertEqual(sorted(os.listdir(self.outdir)), ['out', 'outside'])
+        for name in ['abs', 'rel', 'hard', 'dir/up/../escaped']:
+            self.assertIn('Skipped unsafe member %s' % name,
+                          stderr.getvalue())
+        self.assertTrue(os.path.islink(os.path.join(outdir, 'safe')))
+        self.assertTrue(os.path.islink(os.path.join(outdir, 'dir', 'up')))
+        with open(os.path.join(outdir, 'data.bin'), 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_links(self):
+        self.check_links()
+
+    def test_links_without_filter(self):
+        # Python 2.7 and 3.5 have no extraction filters
+        if hasattr(tarfile, 'data_filter'):
+            data_filter = tarfile.data_filter
+            del tarfile.data_filter
+            self.addCleanup(setattr, tarfile, 'data_filter', data_filter)
+
+        self.check_links()
+
+    def test_failed_block(self):
+        def blocks():
+            yield self.archive[:4096]
+            raise IOError('could not download bytes 4096-8191')
+
+        with self.assertRaises(IOError):
+            extract_tar(BlockReader(blocks()), self.outdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+Test the token bucket of gd_throttle on a fake clock.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_throttle  # noqa: E402
+
+RATE = 100000
+
+
+class LimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        # Sleeping advances the clock
+        self.now = 1000.0
+        patches = [mock.patch('time.time', lambda: self.now),
+                   mock.patch('time.sleep', self.sleep)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def make_limiter(self, name, priority='normal', **kwargs):
+        limiter = gd_throttle.BandwidthLimiter(RATE, priority,
+                                               registry_dir=self.dir, **kwargs)
+        # The limiters of a test run in the same process
+        limiter.registry = self.dir + '/' + name
+        self.addCleanup(limiter.close)
+
+        return limiter
+
+    def transfer(self, limiter, nbytes, blocksize=10000):
+        "Return the seconds taken to transfer nbytes"
+
+        start = self.now
+        for i in range(nbytes // blocksize):
+            limiter.consume(blocksize)
+
+        return self.now - start
+
+    def test_parse_rate(self):
+        self.assertEqual(gd_throttle.parse_rate('500'), 500)
+        self.assertEqual(gd_throttle.parse_rate('10M'), 10 * 1048576)
+        self.assertEqual(gd_throttle.parse_rate('1.5kB/s'), 1536)
+
+    def test_rate(self):
+        limiter = self.make_limiter('a')
+
+        # After the initial burst, the rate is enforced
+        self.assertAlmostEqual(self.transfer(limiter, 10 * RATE), 10.0,
+                               delta=gd_throttle.BURST + 0.1)
+        self.assertAlmostEqual(self.transfer(limiter, 10 * RATE), 10.0)
+
+        # Blocks larger than the bucket are allowed at the same rate
+        self.assertAlmostEqual(self.transfer(limiter, 10 * RATE, 3 * RATE),
+                               9.0, delta=0.1)
+
+    def test_unlimited(self):
+        limiter = self.make_limiter('a')
+        limiter.set_rate(0)
+        self.assertEqual(self.transfer(limiter, 10 * RATE), 0)
+
+    def test_priority_shares(self):
+        urgent = self.make_limiter('urgent', 'urgent')
+        low = self.make_limiter('low', 'low')
+        urgent.refresh()
+        low.refresh()
+        urgent.refresh()
+
+        self.assertAlmostEqual(urgent.share, RATE * 8 / 9.0)
+        self.assertAlmostEqual(low.share, RATE / 9.0)
+        self.transfer(urgent, RATE)
+        self.assertAlmostEqual(self.transfer(urgent, 8 * RATE), 9.0)
+        self.assertAlmostEqual(self.transfer(low, 2 * RATE), 18.0, delta=1.1)
+
+        # The share of a process that stopped goes to the others
+        low.close()
+        urgent.refresh()
+        self.assertAlmostEqual(urgent.share, RATE)
+
+    def test_stale_registry(self):
+        urgent = self.make_limiter('urgent', 'urgent')
+        with open(self.dir + '/crashed', 'w') as f:
+            f.write('8')
+        urgent.refresh()
+        self.assertAlmostEqual(urgent.share, RATE / 2.0)
+
+        self.now += gd_throttle.REGISTRY_TIMEOUT + 1
+        os.utime(self.dir + '/crashed', (0, 0))
+        urgent.refresh()
+        self.assertAlmostEqual(urgent.share, RATE)
+        self.assertFalse(os.path.exists(self.dir + '/crashed'))
+
+    def test_control_file(self):
+        control_file = self.dir + '.rate'
+        self.addCleanup(os.remove, control_file)
+        with open(control_file, 'w') as f:
+            f.write('50K')
+
+        limiter = gd_throttle.BandwidthLimiter(RATE, control_file=control_file)
+        limiter.refresh()
+        self.assertEqual(limiter.share, 50 * 1024)
+
+        # A rate set by a signal applies at the next refresh until the
+        # control file is changed
+        limiter.set_rate(limiter.rate * 2)
+        limiter.consume(0)
+        self.assertEqual(limiter.share, 100 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Test the memory budget and the buffer pool of gd_transport.
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_transport  # noqa: E402
+
+
+def run_with_timeout(func, timeout=5):
+    "Run func in a thread, and return whether it finished within timeout"
+
+    t = threading.Thread(target=func)
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+
+    return not t.is_alive()
+
+
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        gd_transport.configure_budget(4096)
+        self.addCleanup(gd_transport.configure_budget, 0)
+
+    def test_idle_buffers_do_not_hold_budget(self):
+        pool = gd_transport.BufferPool(1024, 4, copies=2)
+        bufs = [pool.acquire(), pool.acquire()]
+        self.assertEqual(gd_transport.budget.used, 4096)
+        for buf in bufs:
+            pool.release(buf)
+        self.assertEqual(gd_transport.budget.used, 0)
+
+        def reserve():
+            with gd_transport.budget.reserve(1024):
+                pass
+
+        self.assertTrue(run_with_timeout(reserve))
+
+    def test_buffers_are_reused(self):
+        pool = gd_transport.BufferPool(1024, 1)
+        buf = pool.acquire()
+        pool.release(buf)
+        self.assertIs(pool.acquire(), buf)
+
+    def test_wait_for_budget_outside_pool(self):
+        pool = gd_transport.BufferPool(1024, 4, copies=2)
+        bufs = [pool.acquire(), pool.acquire()]
+
+        # A third buffer waits for the budget, while the others can still
+        # be released into the pool
+        acquired = []
+        waiter = threading.Thread(target=lambda:
+                                  acquired.append(pool.acquire()))
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(0.2)
+        self.assertEqual(acquired, [])
+
+        self.assertTrue(run_with_timeout(lambda: pool.release(bufs[0])))
+        waiter.join(5)
+        self.assertEqual(len(acquired), 1)
+        self.assertEqual(gd_transport.budget.used, 4096)
+        self.assertEqual(gd_transport.budget.peak, 4096)
+
+    def test_oversized_request_alone(self):
+        with gd_transport.budget.reserve(8192):
+            self.assertFalse(gd_transport.budget.acquire(1, block=False))
+        self.assertEqual(gd_transport.budget.used, 0)
+        self.assertEqual(gd_transport.budget.peak, 8192)
+
+
+if __name__ == '__main__':
+    unittest.main()
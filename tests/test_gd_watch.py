@@ -0,0 +1,106 @@
+"""
+Test the tracking of changed files by gd_watch with a fake Drive service.
+"""
+
+import os
+import sys
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gd_watch  # noqa: E402
+
+
+def make_file(id, title, modified, parent='parent'):
+    return {'id': id, 'title': title, 'fileSize': '100',
+            'mimeType': 'application/octet-stream',
+            'modifiedDate': modified, 'parents': [{'id': parent}]}
+
+
+class FallbackTest(unittest.TestCase):
+    "Polling for the files modified since the cursor"
+
+    def setUp(self):
+        auth = mock.Mock(spec=['service'])
+        self.service = auth.service
+        self.files = []
+        self.service.files.return_value.list.side_effect = \
+            lambda **kwargs: {'items': list(self.files)}
+
+        self.watcher = gd_watch.Watcher(auth, 'parent', debounce=2.0)
+        self.watcher.execute = lambda request: request
+        self.watcher.folders = {'parent': ''}
+        self.watcher.feed = 'modified'
+        self.watcher.cursor = '2018-01-01T00:00:00'
+
+        self.now = 1514764800.0
+        patch = mock.patch('time.time', lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def poll(self, seconds):
+        self.now += seconds
+        self.watcher.update(self.watcher.poll())
+
+        return [value['name'] for value in self.watcher.due()]
+
+    def test_query(self):
+        self.poll(10)
+        q = self.service.files.return_value.list.call_args[1]['q']
+        self.assertIn("modifiedDate > '2018-01-01T00:00:00'", q)
+
+        # The cursor lags behind for modifications during the poll
+        self.assertEqual(self.watcher.cursor, '2018-01-01T00:00:00')
+        self.poll(110)
+        self.assertEqual(self.watcher.cursor, '2018-01-01T00:01:00')
+
+    def test_debounce(self):
+        self.files = [make_file('a', 'a.bin', '2018-01-01T00:00:05.000Z')]
+        self.assertEqual(self.poll(10), [])
+
+        # The overlapping polls report the unchanged file again, which does
+        # not restart its debounce
+        self.assertEqual(self.poll(1), [])
+        self.assertEqual(self.poll(1), ['a.bin'])
+        self.watcher.remove(self.watcher.due())
+
+        # It is not downloaded again until it is modified
+        self.assertEqual(self.poll(5), [])
+        self.files = [make_file('a', 'a.bin', '2018-01-01T00:00:25.000Z')]
+        self.assertEqual(self.poll(1), [])
+        self.assertEqual(self.poll(2), ['a.bin'])
+
+    def test_modified_during_debounce(self):
+        self.files = [make_file('a', 'a.bin', '2018-01-01T00:00:05.000Z')]
+        self.poll(10)
+        self.files = [make_file('a', 'a.bin', '2018-01-01T00:00:11.000Z')]
+        self.assertEqual(self.poll(1.5), [])
+        self.assertEqual(self.poll(1), [])
+        self.assertEqual(self.poll(1), ['a.bin'])
+
+    def test_prune(self):
+        self.files = [make_file('a', 'a.bin', '2018-01-01T00:00:05.000Z')]
+        self.poll(10)
+        self.assertIn('a', self.watcher.reported)
+
+        # Files modified before the cursor are forgotten
+        self.files = []
+        self.poll(120)
+        self.assertEqual(self.watcher.reported, {})
+
+    def test_outside(self):
+        self.files = [make_file('b', 'b.bin', '2018-01-01T00:00:05.000Z',
+                                parent='other')]
+        self.service.files.return_value.get.return_value = \
+            {'id': 'other', 'title': 'other', 'parents': []}
+        self.poll(10)
+        self.assertEqual(self.poll(3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()